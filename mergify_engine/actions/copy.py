@@ -25,6 +25,7 @@ from mergify_engine import check_api
 from mergify_engine import config
 from mergify_engine import context
 from mergify_engine import duplicate_pull
+from mergify_engine import git_jobs
 from mergify_engine import github_types
 from mergify_engine import rules
 from mergify_engine.clients import http
@@ -49,13 +50,11 @@ class CopyAction(actions.Action):
         voluptuous.Required("label_conflicts", default="conflicts"): str,
     }
 
-    def _copy(self, ctxt, branch_name):
-        """Copy the PR to a branch.
+    def _check_branch(self, ctxt, branch_name):
+        """Ensure the branch exists.
 
-        Returns a tuple of strings (state, reason).
+        Returns a tuple of strings (state, reason) if it doesn't.
         """
-
-        # NOTE(sileht): Ensure branch exists first
         escaped_branch_name = parse.quote(branch_name, safe="")
         try:
             ctxt.client.item(f"{ctxt.base_url}/branches/{escaped_branch_name}")
@@ -71,29 +70,17 @@ class CopyAction(actions.Action):
                 detail += e.response.json()["message"]
             return state, detail
 
-        # NOTE(sileht) does the duplicate have already been done ?
-        new_pull = self.get_existing_duplicate_pull(ctxt, branch_name)
+    def _get_duplicate_result(self, ctxt, branch_name, new_pull):
+        if isinstance(new_pull, duplicate_pull.DuplicateFailed):
+            return (
+                check_api.Conclusion.FAILURE,
+                f"Backport to branch `{branch_name}` failed\n{new_pull.reason}",
+            )
 
-        # No, then do it
+        # NOTE(sileht): We relook again in case of concurrent duplicate
+        # are done because of two events received too closely
         if not new_pull:
-            try:
-                new_pull = duplicate_pull.duplicate(
-                    ctxt,
-                    branch_name,
-                    self.config["label_conflicts"],
-                    self.config["ignore_conflicts"],
-                    self.KIND,
-                )
-            except duplicate_pull.DuplicateFailed as e:
-                return (
-                    check_api.Conclusion.FAILURE,
-                    f"Backport to branch `{branch_name}` failed\n{e.reason}",
-                )
-
-            # NOTE(sileht): We relook again in case of concurrent duplicate
-            # are done because of two events received too closely
-            if not new_pull:
-                new_pull = self.get_existing_duplicate_pull(ctxt, branch_name)
+            new_pull = self.get_existing_duplicate_pull(ctxt, branch_name)
 
         if new_pull:
             return (
@@ -107,6 +94,97 @@ class CopyAction(actions.Action):
             f"{self.KIND.capitalize()} to branch `{branch_name}` failed",
         )
 
+    def _get_pending_result(self, branch_name):
+        return (
+            check_api.Conclusion.PENDING,
+            f"{self.KIND.capitalize()} to branch `{branch_name}` in progress",
+        )
+
+    def _copy(self, ctxt, branch_name):
+        """Copy the PR to a branch.
+
+        Returns a tuple of strings (state, reason).
+        """
+
+        # NOTE(sileht): Ensure branch exists first
+        output = self._check_branch(ctxt, branch_name)
+        if output:
+            return output
+
+        # NOTE(sileht) does the duplicate have already been done ?
+        new_pull = self.get_existing_duplicate_pull(ctxt, branch_name)
+        if new_pull:
+            return self._get_duplicate_result(ctxt, branch_name, new_pull)
+
+        # No, then do it
+        try:
+            new_pull = git_jobs.run(
+                ctxt,
+                f"{self.KIND}~{branch_name}",
+                lambda c: duplicate_pull.duplicate(
+                    c,
+                    branch_name,
+                    self.config["label_conflicts"],
+                    self.config["ignore_conflicts"],
+                    self.KIND,
+                ),
+            )
+        except git_jobs.JobPending:
+            return self._get_pending_result(branch_name)
+        except duplicate_pull.DuplicateFailed as e:
+            new_pull = e
+
+        return self._get_duplicate_result(ctxt, branch_name, new_pull)
+
+    def _copy_many(self, ctxt, branch_names):
+        """Copy the PR to several branches with one git repository.
+
+        Returns a list of tuple of strings (state, reason).
+        """
+        results = {}
+        to_duplicate = []
+        for branch_name in dict.fromkeys(branch_names):
+            output = self._check_branch(ctxt, branch_name)
+            if output:
+                results[branch_name] = output
+                continue
+
+            new_pull = self.get_existing_duplicate_pull(ctxt, branch_name)
+            if new_pull:
+                results[branch_name] = self._get_duplicate_result(
+                    ctxt, branch_name, new_pull
+                )
+            else:
+                to_duplicate.append(branch_name)
+
+        if to_duplicate:
+            try:
+                new_pulls = git_jobs.run(
+                    ctxt,
+                    "~".join([self.KIND] + to_duplicate),
+                    lambda c: duplicate_pull.duplicate_many(
+                        c,
+                        to_duplicate,
+                        self.config["label_conflicts"],
+                        self.config["ignore_conflicts"],
+                        self.KIND,
+                    ),
+                )
+            except git_jobs.JobPending:
+                new_pulls = None
+            except duplicate_pull.DuplicateFailed as e:
+                new_pulls = dict.fromkeys(to_duplicate, e)
+
+            for branch_name in to_duplicate:
+                if new_pulls is None:
+                    results[branch_name] = self._get_pending_result(branch_name)
+                else:
+                    results[branch_name] = self._get_duplicate_result(
+                        ctxt, branch_name, new_pulls[branch_name]
+                    )
+
+        return [results[branch_name] for branch_name in branch_names]
+
     def run(self, ctxt: context.Context, rule: rules.EvaluatedRule) -> check_api.Result:
         if not config.GITHUB_APP:
             return check_api.Result(
@@ -134,7 +212,10 @@ class CopyAction(actions.Action):
                 )
             )
 
-        results = [self._copy(ctxt, branch_name) for branch_name in branches]
+        if config.DUPLICATE_BATCHING and len(branches) > 1:
+            results = self._copy_many(ctxt, branches)
+        else:
+            results = [self._copy(ctxt, branch_name) for branch_name in branches]
 
         # Pick the first status as the final_status
         conclusion = results[0][0]
@@ -143,7 +224,13 @@ class CopyAction(actions.Action):
                 conclusion = check_api.Conclusion.FAILURE
                 # If we have a failure, everything is set to fail
                 break
-            elif r[0] == check_api.Conclusion.SUCCESS:
+            elif r[0] == check_api.Conclusion.PENDING:
+                # The action must run again until everything is done
+                conclusion = check_api.Conclusion.PENDING
+            elif (
+                r[0] == check_api.Conclusion.SUCCESS
+                and conclusion is not check_api.Conclusion.PENDING
+            ):
                 # If it was None, replace with success
                 # Keep checking for a failure just in case
                 conclusion = check_api.Conclusion.SUCCESS
@@ -22,6 +22,7 @@ import voluptuous
 from mergify_engine import actions
 from mergify_engine import check_api
 from mergify_engine import context
+from mergify_engine import labels_store
 from mergify_engine import rules
 from mergify_engine.clients import http
 
@@ -36,11 +37,15 @@ class LabelAction(actions.Action):
     silent_report = True
 
     def run(self, ctxt: context.Context, rule: rules.EvaluatedRule) -> check_api.Result:
-        if self.config["add"]:
-            all_label = [
-                label["name"] for label in ctxt.client.items(f"{ctxt.base_url}/labels")
-            ]
-            for label in self.config["add"]:
+        pull_labels = [label["name"] for label in ctxt.pull["labels"]]
+
+        # NOTE: only the labels missing on the pull request are added
+        labels_to_add = [
+            label for label in self.config["add"] if label not in pull_labels
+        ]
+        if labels_to_add:
+            all_label = labels_store.get_names(ctxt)
+            for label in labels_to_add:
                 if label not in all_label:
                     color = "%06x" % random.randrange(16 ** 6)
                     try:
@@ -50,16 +55,19 @@ class LabelAction(actions.Action):
                         )
                     except http.HTTPClientSideError:
                         continue
+                    labels_store.add(ctxt, label)
 
             ctxt.client.post(
                 f"{ctxt.base_url}/issues/{ctxt.pull['number']}/labels",
-                json={"labels": self.config["add"]},
+                json={"labels": labels_to_add},
             )
 
         if self.config["remove_all"]:
-            ctxt.client.delete(f"{ctxt.base_url}/issues/{ctxt.pull['number']}/labels")
+            if pull_labels or labels_to_add:
+                ctxt.client.delete(
+                    f"{ctxt.base_url}/issues/{ctxt.pull['number']}/labels"
+                )
         elif self.config["remove"]:
-            pull_labels = [label["name"] for label in ctxt.pull["labels"]]
             for label in self.config["remove"]:
                 if label in pull_labels:
                     label_escaped = parse.quote(label, safe="")
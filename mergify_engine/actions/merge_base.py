@@ -26,6 +26,7 @@ from mergify_engine import branch_updater
 from mergify_engine import check_api
 from mergify_engine import config
 from mergify_engine import context
+from mergify_engine import git_jobs
 from mergify_engine import json as mergify_json
 from mergify_engine import queue
 from mergify_engine import subscription
@@ -304,7 +305,15 @@ class MergeBaseAction(actions.Action):
                 output = branch_updater.pre_rebase_check(ctxt)
                 if output:
                     return output
-                branch_updater.rebase_with_git(ctxt, user)
+                git_jobs.run(
+                    ctxt,
+                    f"rebase~{user}",
+                    lambda c: branch_updater.rebase_with_git(c, user),
+                )
+        except git_jobs.JobPending:
+            return check_api.Result(
+                check_api.Conclusion.PENDING, "Base branch update in progress", ""
+            )
         except branch_updater.BranchUpdateFailure as e:
             # NOTE(sileht): Maybe the PR has been rebased and/or merged manually
             # in the meantime. So double check that to not report a wrong status.
@@ -596,9 +605,10 @@ This pull request must be merged manually."""
         # don't have it here, so just guess it.
         priorities_configured = False
 
+        configs = q.get_configs(pulls)
         summary = "\n\nThe following pull requests are queued:"
         for priority, grouped_pulls in itertools.groupby(
-            pulls, key=lambda v: q.get_config(v)["priority"]
+            pulls, key=lambda v: configs[v]["priority"]
         ):
             if priority != PriorityAliases.medium.value:
                 priorities_configured = True
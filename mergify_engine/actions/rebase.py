@@ -21,6 +21,7 @@ from mergify_engine import branch_updater
 from mergify_engine import check_api
 from mergify_engine import config
 from mergify_engine import context
+from mergify_engine import git_jobs
 from mergify_engine import rules
 from mergify_engine.rules import types
 
@@ -59,13 +60,22 @@ class RebaseAction(actions.Action):
             if output:
                 return output
 
+            bot_account = self.config["bot_account"]
             try:
-                branch_updater.rebase_with_git(ctxt, self.config["bot_account"])
+                git_jobs.run(
+                    ctxt,
+                    f"rebase~{bot_account}",
+                    lambda c: branch_updater.rebase_with_git(c, bot_account),
+                )
                 return check_api.Result(
                     check_api.Conclusion.SUCCESS,
                     "Branch has been successfully rebased",
                     "",
                 )
+            except git_jobs.JobPending:
+                return check_api.Result(
+                    check_api.Conclusion.PENDING, "Branch rebase in progress", ""
+                )
             except (
                 branch_updater.AuthenticationFailure,
                 branch_updater.BranchUpdateFailure,
@@ -11,7 +11,6 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
-import asyncio
 import typing
 
 from mergify_engine import actions
@@ -19,6 +18,7 @@ from mergify_engine import check_api
 from mergify_engine import context
 from mergify_engine import github_events
 from mergify_engine import rules
+from mergify_engine import utils
 
 
 class RefreshAction(actions.Action):
@@ -27,7 +27,7 @@ class RefreshAction(actions.Action):
     validator: typing.ClassVar[typing.Dict[typing.Any, typing.Any]] = {}
 
     def run(self, ctxt: context.Context, rule: rules.EvaluatedRule) -> check_api.Result:
-        asyncio.run(github_events.send_refresh(ctxt.pull))
+        utils.run_coroutine(github_events.send_refresh(ctxt.pull))
         return check_api.Result(
             check_api.Conclusion.SUCCESS, title="Pull request refreshed", summary=""
         )
@@ -23,6 +23,7 @@ import tenacity
 from mergify_engine import check_api
 from mergify_engine import config
 from mergify_engine import context
+from mergify_engine import git_mirrors
 from mergify_engine import utils
 from mergify_engine.clients import http
 
@@ -98,6 +99,68 @@ def pre_rebase_check(ctxt: context.Context) -> typing.Optional[check_api.Result]
         return None
 
 
+def _fetch_shallow(
+    ctxt: context.Context, git: utils.Gitter, head_branch: str, base_branch: str
+) -> None:
+    depth = len(ctxt.commits) + 1
+    git("fetch", "--quiet", "--depth=%d" % depth, "origin", head_branch)
+    git("checkout", "-q", "-b", head_branch, "origin/%s" % head_branch)
+
+    out = git("log", "--format=%cI").stdout
+    last_commit_date = [d for d in out.split("\n") if d.strip()][-1]
+
+    git(
+        "fetch",
+        "--quiet",
+        "upstream",
+        base_branch,
+        "--shallow-since='%s'" % last_commit_date,
+    )
+
+    # Try to find the merge base, but don't fetch more that 1000 commits.
+    for _ in range(20):
+        git("repack", "-d")
+        result = git(
+            "merge-base",
+            f"upstream/{base_branch}",
+            f"origin/{head_branch}",
+            check=False,
+        )
+        if result.returncode == 0:
+            # We have enough commits
+            break
+        elif result.returncode == 1:
+            # We need more commits
+            continue
+        else:
+            result.check_returncode()
+        git("fetch", "-q", "--deepen=50", "upsteam", base_branch)
+
+
+def _rebase_and_push(
+    ctxt: context.Context, git: utils.Gitter, head_branch: str, base_branch: str
+) -> None:
+    try:
+        git("rebase", "upstream/%s" % base_branch)
+        git("push", "--verbose", "origin", head_branch, "-f")
+    except subprocess.CalledProcessError as e:  # pragma: no cover
+        for message in GIT_MESSAGE_TO_UNSHALLOW:
+            if message in e.output:
+                ctxt.log.info("Complete history cloned")
+                # NOTE(sileht): We currently assume we have only one parent
+                # commit in common. Since Git is a graph, in some case this
+                # graph can be more complicated.
+                # So, retrying with the whole git history for now
+                git("fetch", "--unshallow")
+                git("fetch", "--quiet", "origin", head_branch)
+                git("fetch", "--quiet", "upstream", base_branch)
+                git("rebase", "upstream/%s" % base_branch)
+                git("push", "--verbose", "origin", head_branch, "-f")
+                break
+        else:
+            raise
+
+
 @tenacity.retry(
     wait=tenacity.wait_exponential(multiplier=0.2),
     stop=tenacity.stop_after_attempt(5),
@@ -139,59 +202,15 @@ def _do_rebase(ctxt: context.Context, token: str) -> None:
         git("remote", "add", "origin", f"{config.GITHUB_URL}/{head_repo}")
         git("remote", "add", "upstream", f"{config.GITHUB_URL}/{base_repo}")
 
-        depth = len(ctxt.commits) + 1
-        git("fetch", "--quiet", "--depth=%d" % depth, "origin", head_branch)
-        git("checkout", "-q", "-b", head_branch, "origin/%s" % head_branch)
-
-        out = git("log", "--format=%cI").stdout
-        last_commit_date = [d for d in out.split("\n") if d.strip()][-1]
-
-        git(
-            "fetch",
-            "--quiet",
-            "upstream",
-            base_branch,
-            "--shallow-since='%s'" % last_commit_date,
-        )
-
-        # Try to find the merge base, but don't fetch more that 1000 commits.
-        for _ in range(20):
-            git("repack", "-d")
-            result = git(
-                "merge-base",
-                f"upstream/{base_branch}",
-                f"origin/{head_branch}",
-                check=False,
-            )
-            if result.returncode == 0:
-                # We have enough commits
-                break
-            elif result.returncode == 1:
-                # We need more commits
-                continue
+        with git_mirrors.use(git, base_repo) as mirrored:
+            if mirrored:
+                git("fetch", "--quiet", "origin", head_branch)
+                git("checkout", "-q", "-b", head_branch, "origin/%s" % head_branch)
+                git("fetch", "--quiet", "upstream", base_branch)
             else:
-                result.check_returncode()
-            git("fetch", "-q", "--deepen=50", "upsteam", base_branch)
+                _fetch_shallow(ctxt, git, head_branch, base_branch)
 
-        try:
-            git("rebase", "upstream/%s" % base_branch)
-            git("push", "--verbose", "origin", head_branch, "-f")
-        except subprocess.CalledProcessError as e:  # pragma: no cover
-            for message in GIT_MESSAGE_TO_UNSHALLOW:
-                if message in e.output:
-                    ctxt.log.info("Complete history cloned")
-                    # NOTE(sileht): We currently assume we have only one parent
-                    # commit in common. Since Git is a graph, in some case this
-                    # graph can be more complicated.
-                    # So, retrying with the whole git history for now
-                    git("fetch", "--unshallow")
-                    git("fetch", "--quiet", "origin", head_branch)
-                    git("fetch", "--quiet", "upstream", base_branch)
-                    git("rebase", "upstream/%s" % base_branch)
-                    git("push", "--verbose", "origin", head_branch, "-f")
-                    break
-            else:
-                raise
+            _rebase_and_push(ctxt, git, head_branch, base_branch)
 
         expected_sha = git("log", "-1", "--format=%H").stdout.strip()
         # NOTE(sileht): We store this for dismissal action
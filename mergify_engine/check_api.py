@@ -16,6 +16,7 @@ import dataclasses
 import enum
 import typing
 
+from mergify_engine import checks_store
 from mergify_engine import github_types
 from mergify_engine import utils
 
@@ -56,18 +57,29 @@ def get_checks_for_ref(
     sha: github_types.SHAType,
     check_name: typing.Optional[str] = None,
 ) -> typing.List[github_types.GitHubCheckRun]:
-    if check_name is None:
-        kwargs = {}
+    owner = ctxt.pull["base"]["user"]["login"]
+    repo = ctxt.pull["base"]["repo"]["name"]
+    checks = checks_store.get(checks_store.CHECK_RUNS, owner, repo, sha)
+    if checks is not None:
+        if check_name is not None:
+            checks = [c for c in checks if c["name"] == check_name]
     else:
-        kwargs = {"check_name": check_name}
-    checks = list(
-        ctxt.client.items(
-            f"{ctxt.base_url}/commits/{sha}/check-runs",
-            api_version="antiope",
-            list_items="check_runs",
-            **kwargs,
+        if check_name is None:
+            kwargs = {}
+        else:
+            kwargs = {"check_name": check_name}
+        checks = list(
+            ctxt.client.items(
+                f"{ctxt.base_url}/commits/{sha}/check-runs",
+                api_version="antiope",
+                list_items="check_runs",
+                **kwargs,
+            )
         )
-    )
+        if check_name is None:
+            checks_store.store(
+                checks_store.CHECK_RUNS, owner, repo, sha, checks, synced=True
+            )
 
     # FIXME(sileht): We currently have some issue to set back
     # conclusion to null, Maybe a GH bug or not.
@@ -77,7 +89,37 @@ def get_checks_for_ref(
         if check["status"] == "in_progress":
             check["conclusion"] = None
 
-    return checks
+    return typing.cast(typing.List[github_types.GitHubCheckRun], checks)
+
+
+def get_statuses_for_ref(
+    ctxt: "context.Context", sha: github_types.SHAType
+) -> typing.List[github_types.GitHubStatus]:
+    owner = ctxt.pull["base"]["user"]["login"]
+    repo = ctxt.pull["base"]["repo"]["name"]
+    statuses = checks_store.get(checks_store.STATUSES, owner, repo, sha)
+    if statuses is not None:
+        return typing.cast(typing.List[github_types.GitHubStatus], statuses)
+
+    statuses = list(
+        ctxt.client.items(
+            f"{ctxt.base_url}/commits/{sha}/status", list_items="statuses"
+        )
+    )
+    checks_store.store(checks_store.STATUSES, owner, repo, sha, statuses, synced=True)
+    return typing.cast(typing.List[github_types.GitHubStatus], statuses)
+
+
+def _store_check_run(
+    ctxt: "context.Context", check: github_types.GitHubCheckRun
+) -> None:
+    checks_store.store(
+        checks_store.CHECK_RUNS,
+        ctxt.pull["base"]["user"]["login"],
+        ctxt.pull["base"]["repo"]["name"],
+        check["head_sha"],
+        [typing.cast(typing.Dict[str, typing.Any], check)],
+    )
 
 
 def compare_dict(d1, d2, keys):
@@ -137,6 +179,7 @@ def set_check_run(
                 json=post_parameters,
             ).json(),
         )
+        _store_check_run(ctxt, check)
         ctxt.update_pull_check_runs(check)
         return check
 
@@ -174,6 +217,7 @@ def set_check_run(
                 json=post_parameters,
             ).json(),
         )
+        _store_check_run(ctxt, check)
 
     ctxt.update_pull_check_runs(check)
     return check
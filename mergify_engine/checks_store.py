@@ -0,0 +1,168 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import json
+import operator
+import typing
+
+import aredis
+from datadog import statsd
+
+from mergify_engine import config
+from mergify_engine import github_types
+from mergify_engine import utils
+
+
+# Store of the check runs and the commit statuses of a sha.
+#
+# The store is filled by the check_run and status webhooks, and by the
+# listings done by the engine. Only a listing marks the store as synced:
+# before that, the webhooks received may not be the whole picture.
+
+StoreKindT = typing.Literal["check-runs", "statuses"]
+
+CHECK_RUNS: StoreKindT = "check-runs"
+STATUSES: StoreKindT = "statuses"
+
+STORE_EXPIRATION = 60 * 60 * 24  # 1 day
+
+CHECK_RUN_STATUS_RANKS = {"queued": 0, "in_progress": 1, "completed": 2}
+
+# Webhooks can be delivered out of order, so an item only replaces the stored
+# one if it is at least as recent. Check runs are ordered by id (a rerun has a
+# new id) and then by status, statuses by id.
+STORE_SCRIPT = """
+local items_key = KEYS[1]
+local orders_key = KEYS[2]
+local expiration = ARGV[1]
+
+for i = 2, #ARGV, 4 do
+    local field = ARGV[i]
+    local id = tonumber(ARGV[i + 1])
+    local rank = tonumber(ARGV[i + 2])
+    local newer = true
+    local previous = redis.call("HGET", orders_key, field)
+    if previous then
+        local sep = string.find(previous, ":")
+        local previous_id = tonumber(string.sub(previous, 1, sep - 1))
+        local previous_rank = tonumber(string.sub(previous, sep + 1))
+        newer = id > previous_id or (id == previous_id and rank >= previous_rank)
+    end
+    if newer then
+        redis.call("HSET", items_key, field, ARGV[i + 3])
+        redis.call("HSET", orders_key, field, ARGV[i + 1] .. ":" .. ARGV[i + 2])
+    end
+end
+redis.call("EXPIRE", items_key, expiration)
+redis.call("EXPIRE", orders_key, expiration)
+"""
+
+
+def _get_keys(
+    kind: StoreKindT, owner: str, repo: str, sha: github_types.SHAType
+) -> typing.Tuple[str, str]:
+    return (f"{kind}~{owner}~{repo}~{sha}", f"{kind}-order~{owner}~{repo}~{sha}")
+
+
+def _get_synced_key(
+    kind: StoreKindT, owner: str, repo: str, sha: github_types.SHAType
+) -> str:
+    return f"{kind}-synced~{owner}~{repo}~{sha}"
+
+
+def _get_script_args(
+    kind: StoreKindT, items: typing.Iterable[typing.Dict[str, typing.Any]]
+) -> typing.List[typing.Any]:
+    args: typing.List[typing.Any] = [STORE_EXPIRATION]
+    for item in items:
+        if kind == CHECK_RUNS:
+            field = item["name"]
+            rank = CHECK_RUN_STATUS_RANKS.get(item.get("status") or "", 0)
+        else:
+            field = item["context"]
+            rank = 0
+        args.extend((field, item["id"], rank, json.dumps(item)))
+    return args
+
+
+def get(
+    kind: StoreKindT, owner: str, repo: str, sha: github_types.SHAType
+) -> typing.Optional[typing.List[typing.Dict[str, typing.Any]]]:
+    """Return the stored items, or None if the store is not synced."""
+    if not config.CHECKS_STORE:
+        return None
+
+    with utils.get_redis_for_cache() as redis:
+        with redis.pipeline() as pipe:
+            pipe.exists(_get_synced_key(kind, owner, repo, sha))
+            pipe.hvals(_get_keys(kind, owner, repo, sha)[0])
+            synced, items = pipe.execute()
+
+    if not synced:
+        statsd.increment("engine.checks_store.miss", tags=[f"kind:{kind}"])
+        return None
+    statsd.increment("engine.checks_store.hit", tags=[f"kind:{kind}"])
+    decoded_items: typing.List[typing.Dict[str, typing.Any]] = [
+        json.loads(item) for item in items
+    ]
+    return sorted(decoded_items, key=operator.itemgetter("id"))
+
+
+def store(
+    kind: StoreKindT,
+    owner: str,
+    repo: str,
+    sha: github_types.SHAType,
+    items: typing.Iterable[typing.Dict[str, typing.Any]],
+    synced: bool = False,
+) -> None:
+    """Store items, `synced` must be set when items come from a full listing."""
+    if not config.CHECKS_STORE:
+        return
+
+    with utils.get_redis_for_cache() as redis:
+        with redis.pipeline() as pipe:
+            pipe.eval(
+                STORE_SCRIPT,
+                2,
+                *_get_keys(kind, owner, repo, sha),
+                *_get_script_args(kind, items),
+            )
+            if synced:
+                pipe.set(
+                    _get_synced_key(kind, owner, repo, sha),
+                    "1",
+                    ex=config.CHECKS_STORE_MAX_AGE,
+                )
+            pipe.execute()
+
+
+async def astore(
+    redis: aredis.StrictRedis,
+    kind: StoreKindT,
+    owner: str,
+    repo: str,
+    sha: github_types.SHAType,
+    items: typing.Iterable[typing.Dict[str, typing.Any]],
+) -> None:
+    if not config.CHECKS_STORE:
+        return
+
+    await redis.eval(
+        STORE_SCRIPT,
+        2,
+        *_get_keys(kind, owner, repo, sha),
+        *_get_script_args(kind, items),
+    )
@@ -17,6 +17,9 @@ import contextlib
 import dataclasses
 import datetime
 import functools
+import json
+import os
+import time
 import typing
 from urllib import parse
 
@@ -25,8 +28,10 @@ from datadog import statsd
 import httpx
 
 from mergify_engine import config
+from mergify_engine import crypto
 from mergify_engine import exceptions
 from mergify_engine import github_types
+from mergify_engine import utils
 from mergify_engine.clients import github_app
 from mergify_engine.clients import http
 
@@ -43,9 +48,37 @@ class TooManyPages(Exception):
     response: httpx.Response
 
 
+@dataclasses.dataclass
+class GraphQLError(Exception):
+    errors: typing.List[typing.Dict[str, typing.Any]]
+
+    def __str__(self):
+        return ", ".join(e.get("message", "unknown error") for e in self.errors)
+
+
+def get_graphql_url() -> str:
+    # GitHub Enterprise serves the REST API on /api/v3 and GraphQL on /api/graphql
+    api_url = config.GITHUB_API_URL.rstrip("/")
+    if api_url.endswith("/v3"):
+        return api_url[: -len("/v3")] + "/graphql"
+    return api_url + "/graphql"
+
+
+def _get_graphql_data(response: httpx.Response) -> typing.Dict[str, typing.Any]:
+    result = response.json()
+    if result.get("errors"):
+        raise GraphQLError(result["errors"])
+    return typing.cast(typing.Dict[str, typing.Any], result["data"])
+
+
 @dataclasses.dataclass
 class CachedToken:
     STORAGE: typing.ClassVar[typing.Dict[int, typing.Any]] = {}
+    # GitHub tokens are valid for one hour, they are renewed a bit before so
+    # requests never hit an expired token.
+    REFRESH_MARGIN: typing.ClassVar[datetime.timedelta] = datetime.timedelta(minutes=5)
+    LOCK_TIMEOUT: typing.ClassVar[float] = 5
+    LOCK_POLL_INTERVAL: typing.ClassVar[float] = 0.1
 
     installation_id: int
     token: github_types.GitHubInstallationAccessToken
@@ -54,12 +87,82 @@ class CachedToken:
     def __post_init__(self):
         CachedToken.STORAGE[self.installation_id] = self
 
+    @staticmethod
+    def _redis_key(installation_id: int) -> str:
+        return f"installation-token~{installation_id}"
+
+    @staticmethod
+    def _redis_lock_key(installation_id: int) -> str:
+        return f"installation-token-lock~{installation_id}"
+
     @classmethod
     def get(cls, installation_id):
-        return cls.STORAGE.get(installation_id)
+        cached_token = cls.STORAGE.get(installation_id)
+        if cached_token is None:
+            cached_token = cls.get_from_redis(installation_id)
+        return cached_token
+
+    @classmethod
+    def get_from_redis(cls, installation_id: int) -> typing.Optional["CachedToken"]:
+        encrypted_token = utils.get_redis_for_cache().get(
+            cls._redis_key(installation_id)
+        )
+        if encrypted_token is None:
+            return None
+        try:
+            data = json.loads(crypto.decrypt(encrypted_token).decode())
+        except crypto.CryptoError:
+            LOG.warning("unable to decrypt cached token", exc_info=True)
+            return None
+        return cls(
+            installation_id,
+            data["token"],
+            datetime.datetime.fromisoformat(data["expiration"]),
+        )
+
+    def save(self) -> None:
+        ttl = int((self.expiration - datetime.datetime.utcnow()).total_seconds())
+        if ttl <= 0:
+            return
+        utils.get_redis_for_cache().setex(
+            self._redis_key(self.installation_id),
+            ttl,
+            crypto.encrypt(
+                json.dumps(
+                    {"token": self.token, "expiration": self.expiration.isoformat()}
+                ).encode()
+            ),
+        )
 
     def invalidate(self):
         CachedToken.STORAGE.pop(self.installation_id, None)
+        # Another process may already have stored a new token, keep it.
+        cached_token = CachedToken.get_from_redis(self.installation_id)
+        if cached_token is not None and cached_token.token == self.token:
+            CachedToken.STORAGE.pop(self.installation_id, None)
+            utils.get_redis_for_cache().delete(self._redis_key(self.installation_id))
+
+    def is_expired(self) -> bool:
+        return self.expiration <= datetime.datetime.utcnow()
+
+    def need_refresh(self) -> bool:
+        return self.expiration - self.REFRESH_MARGIN <= datetime.datetime.utcnow()
+
+    @classmethod
+    def acquire_refresh_lock(cls, installation_id: int) -> bool:
+        """Ensure only one process mints a new token for an installation."""
+        return bool(
+            utils.get_redis_for_cache().set(
+                cls._redis_lock_key(installation_id),
+                os.getpid(),
+                nx=True,
+                px=int(cls.LOCK_TIMEOUT * 1000),
+            )
+        )
+
+    @classmethod
+    def release_refresh_lock(cls, installation_id: int) -> None:
+        utils.get_redis_for_cache().delete(cls._redis_lock_key(installation_id))
 
 
 class GithubActionAccessTokenAuth(httpx.Auth):
@@ -127,7 +230,7 @@ class GithubAppInstallationAuth(httpx.Auth):
     def __init__(self, owner: str):
         self.owner = owner
 
-        self._cached_token = None
+        self._cached_token: typing.Optional[CachedToken] = None
         self.installation = None
         self.owner_id = None
         self.permissions_need_to_be_updated = None
@@ -143,6 +246,11 @@ class GithubAppInstallationAuth(httpx.Auth):
     def auth_flow(
         self, request: httpx.Request
     ) -> typing.Generator[httpx.Request, httpx.Response, None]:
+        if self.installation is None:
+            installation = github_app.get_installation_from_cache(self.owner)
+            if installation is not None:
+                self._set_installation(installation)
+
         if self.installation is None:
             with self.response_body_read():
                 installation_response = yield self.build_installation_request()
@@ -165,7 +273,9 @@ class GithubAppInstallationAuth(httpx.Auth):
 
                 http.raise_for_status(installation_response)
 
-                self._set_installation(installation_response)
+                fetched_installation = installation_response.json()
+                self._set_installation(fetched_installation)
+                github_app.cache_installation(self.owner, fetched_installation)
 
         token = self._get_access_token()
         if token:
@@ -173,7 +283,35 @@ class GithubAppInstallationAuth(httpx.Auth):
             response = yield request
             if response.status_code != 401:  # due to access_token
                 return
+            if self._cached_token is not None:
+                self._cached_token.invalidate()
+                self._cached_token = None
+
+        installation_id = typing.cast(
+            github_types.GitHubInstallation, self.installation
+        )["id"]
+        locked = CachedToken.acquire_refresh_lock(installation_id)
+        if not locked:
+            # Another process is minting a token, use the current one if it's
+            # still valid or wait for the new one.
+            token = self._wait_for_access_token(installation_id)
+            if token:
+                request.headers["Authorization"] = f"token {token}"
+                yield request
+                return
+
+        try:
+            token = yield from self._create_access_token()
+        finally:
+            if locked:
+                CachedToken.release_refresh_lock(installation_id)
+
+        request.headers["Authorization"] = f"token {token}"
+        yield request
 
+    def _create_access_token(
+        self,
+    ) -> typing.Generator[httpx.Request, httpx.Response, str]:
         with self.response_body_read():
             auth_response = yield self.build_access_token_request()
             if auth_response.status_code == 401:  # due to jwt
@@ -192,10 +330,7 @@ class GithubAppInstallationAuth(httpx.Auth):
                     raise exceptions.MergifyNotInstalled()
 
             http.raise_for_status(auth_response)
-            token = self._set_access_token(auth_response.json())
-
-        request.headers["Authorization"] = f"token {token}"
-        yield request
+            return typing.cast(str, self._set_access_token(auth_response.json()))
 
     def build_installation_request(self, url=None, force=False):
         if url is None:
@@ -214,8 +349,8 @@ class GithubAppInstallationAuth(httpx.Auth):
         headers["Authorization"] = f"Bearer {github_app.get_or_create_jwt(force)}"
         return httpx.Request(method, url, headers=headers)
 
-    def _set_installation(self, installation_response):
-        self.installation = installation_response.json()
+    def _set_installation(self, installation):
+        self.installation = installation
         self.owner_id = self.installation["account"]["id"]
         self.permissions_need_to_be_updated = github_app.permissions_need_to_be_updated(
             self.installation
@@ -228,6 +363,7 @@ class GithubAppInstallationAuth(httpx.Auth):
             data["token"],
             datetime.datetime.fromisoformat(data["expires_at"][:-1]),  # Remove the Z
         )
+        self._cached_token.save()
         LOG.info(
             "New token acquired",
             gh_owner=self.owner,
@@ -236,10 +372,9 @@ class GithubAppInstallationAuth(httpx.Auth):
         return self._cached_token.token
 
     def _get_access_token(self):
-        now = datetime.datetime.utcnow()
         if not self._cached_token:
             return None
-        elif self._cached_token.expiration <= now:
+        elif self._cached_token.is_expired():
             LOG.info(
                 "Token expired",
                 gh_owner=self.owner,
@@ -248,14 +383,42 @@ class GithubAppInstallationAuth(httpx.Auth):
             self._cached_token.invalidate()
             self._cached_token = None
             return None
+        elif self._cached_token.need_refresh():
+            # Another process may already have refreshed it
+            cached_token = CachedToken.get_from_redis(
+                self._cached_token.installation_id
+            )
+            if cached_token is not None and not cached_token.need_refresh():
+                self._cached_token = cached_token
+                return cached_token.token
+            LOG.info(
+                "Token about to expire, refreshing",
+                gh_owner=self.owner,
+                expire_at=self._cached_token.expiration,
+            )
+            return None
         else:
             return self._cached_token.token
 
+    def _wait_for_access_token(self, installation_id):
+        started_at = time.monotonic()
+        while True:
+            if self._cached_token is not None and not self._cached_token.is_expired():
+                return self._cached_token.token
+
+            cached_token = CachedToken.get_from_redis(installation_id)
+            if cached_token is not None and not cached_token.is_expired():
+                self._cached_token = cached_token
+                return cached_token.token
+
+            if time.monotonic() - started_at >= CachedToken.LOCK_TIMEOUT:
+                return None
+            time.sleep(CachedToken.LOCK_POLL_INTERVAL)
+
     def get_access_token(self):
         """Legacy method for backport/copy actions"""
-        token = self._get_access_token()
-        if token:
-            return token
+        if self._cached_token and not self._cached_token.is_expired():
+            return self._cached_token.token
         else:
             raise RuntimeError("get_access_token() call on an unused client")
 
@@ -303,7 +466,8 @@ class AsyncGithubInstallationClient(http.AsyncClient):
         super().__init__(
             base_url=config.GITHUB_API_URL,
             auth=auth,
-            **http.DEFAULT_CLIENT_OPTIONS,  # type: ignore
+            response_cache=http.get_response_cache(),
+            **http.DEFAULT_CLIENT_OPTIONS,
         )
 
         for method in ("get", "post", "put", "patch", "delete", "head"):
@@ -358,6 +522,16 @@ class AsyncGithubInstallationClient(http.AsyncClient):
             else:
                 break
 
+    async def graphql(
+        self,
+        query: str,
+        variables: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ) -> typing.Dict[str, typing.Any]:
+        response = await self.post(
+            get_graphql_url(), json={"query": query, "variables": variables or {}}
+        )
+        return _get_graphql_data(response)
+
     async def request(self, method, url, *args, **kwargs):
         reply = None
         try:
@@ -369,6 +543,8 @@ class AsyncGithubInstallationClient(http.AsyncClient):
         finally:
             if reply is None:
                 status_code = "error"
+            elif http.is_cached_response(reply):
+                status_code = 304
             else:
                 status_code = reply.status_code
             statsd.increment(
@@ -418,7 +594,8 @@ class GithubInstallationClient(http.Client):
         super().__init__(
             base_url=config.GITHUB_API_URL,
             auth=auth,
-            **http.DEFAULT_CLIENT_OPTIONS,  # type: ignore
+            response_cache=http.get_response_cache(),
+            **http.DEFAULT_CLIENT_OPTIONS,
         )
 
         for method in ("get", "post", "put", "patch", "delete", "head"):
@@ -471,6 +648,16 @@ class GithubInstallationClient(http.Client):
             else:
                 break
 
+    def graphql(
+        self,
+        query: str,
+        variables: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ) -> typing.Dict[str, typing.Any]:
+        response = self.post(
+            get_graphql_url(), json={"query": query, "variables": variables or {}}
+        )
+        return _get_graphql_data(response)
+
     def request(self, method, url, *args, **kwargs):
         reply = None
         try:
@@ -482,6 +669,8 @@ class GithubInstallationClient(http.Client):
         finally:
             if reply is None:
                 status_code = "error"
+            elif http.is_cached_response(reply):
+                status_code = 304
             else:
                 status_code = reply.status_code
             statsd.increment(
@@ -14,15 +14,20 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import json
 import threading
 import time
+import typing
 
 import daiquiri
 import httpx
 import jwt
 
 from mergify_engine import config
+from mergify_engine import crypto
 from mergify_engine import exceptions
+from mergify_engine import github_types
+from mergify_engine import utils
 from mergify_engine.clients import http
 
 
@@ -108,8 +113,80 @@ class GithubBearerAuth(httpx.Auth):
             yield request
 
 
+INSTALLATION_CACHE_EXPIRATION = 3600
+
+
+def _installation_cache_key(owner: str) -> str:
+    return f"installation-cache~{owner.lower()}"
+
+
+def _encrypt_installation(installation: github_types.GitHubInstallation) -> bytes:
+    return typing.cast(bytes, crypto.encrypt(json.dumps(installation).encode()))
+
+
+def _decrypt_installation(
+    encrypted_installation: typing.Optional[str],
+) -> typing.Optional[github_types.GitHubInstallation]:
+    if encrypted_installation is None:
+        return None
+    try:
+        return typing.cast(
+            github_types.GitHubInstallation,
+            json.loads(crypto.decrypt(encrypted_installation).decode()),
+        )
+    except crypto.CryptoError:
+        LOG.warning("unable to decrypt cached installation", exc_info=True)
+        return None
+
+
+def get_installation_from_cache(
+    owner: str,
+) -> typing.Optional[github_types.GitHubInstallation]:
+    redis = utils.get_redis_for_cache()
+    return _decrypt_installation(redis.get(_installation_cache_key(owner)))
+
+
+def cache_installation(
+    owner: str, installation: github_types.GitHubInstallation
+) -> None:
+    redis = utils.get_redis_for_cache()
+    redis.setex(
+        _installation_cache_key(owner),
+        INSTALLATION_CACHE_EXPIRATION,
+        _encrypt_installation(installation),
+    )
+
+
+async def aget_installation_from_cache(
+    owner: str,
+) -> typing.Optional[github_types.GitHubInstallation]:
+    redis = await utils.get_aredis_for_cache()
+    return _decrypt_installation(await redis.get(_installation_cache_key(owner)))
+
+
+async def acache_installation(
+    owner: str, installation: github_types.GitHubInstallation
+) -> None:
+    redis = await utils.get_aredis_for_cache()
+    await redis.setex(
+        _installation_cache_key(owner),
+        INSTALLATION_CACHE_EXPIRATION,
+        _encrypt_installation(installation),
+    )
+
+
+async def invalidate_installation_cache(owner: str) -> None:
+    redis = await utils.get_aredis_for_cache()
+    await redis.delete(_installation_cache_key(owner))
+
+
 async def get_installation(account):
     owner = account["login"]
+    installation = await aget_installation_from_cache(owner)
+    if installation is not None:
+        permissions_need_to_be_updated(installation)
+        return installation
+
     account_type = "users" if account["type"].lower() == "user" else "orgs"
     url = f"{config.GITHUB_API_URL}/{account_type}/{owner}/installation"
     async with http.AsyncClient(
@@ -118,6 +195,7 @@ async def get_installation(account):
         try:
             installation = (await client.get(url)).json()
             permissions_need_to_be_updated(installation)
+            await acache_installation(owner, installation)
             return installation
         except http.HTTPNotFound as e:
             LOG.debug(
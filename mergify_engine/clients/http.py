@@ -15,14 +15,25 @@
 # under the License.
 
 
+import collections
+import dataclasses
 import datetime
+import hashlib
 import json
+import re
+import threading
+import typing
+from urllib import parse
 
 import daiquiri
+from datadog import statsd
 import httpx
 import tenacity
 from werkzeug.http import parse_date
 
+from mergify_engine import config
+from mergify_engine import utils
+
 
 LOG = daiquiri.getLogger(__name__)
 
@@ -182,17 +193,314 @@ def raise_for_status(resp):
     raise exc_class(message, request=resp.request, response=resp)
 
 
-class AsyncClient(httpx.AsyncClient):
+RESPONSE_CACHE_EXPIRATION = 3600 * 24
+# Headers needed to rebuild a response served from the cache, Link is required
+# for pagination
+RESPONSE_CACHE_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Link")
+
+_SHA_RE = re.compile("^[0-9a-f]{40}$")
+# Path segments followed by a free-form identifier
+_ENDPOINT_PLACEHOLDERS = {
+    "collaborators": "{username}",
+    "installations": "{installation_id}",
+    "orgs": "{org}",
+    "users": "{username}",
+}
+# Path segments followed by an identifier that may contain slashes
+_ENDPOINT_TRAILING_PLACEHOLDERS = {
+    "branches": "{branch}",
+    "contents": "{path}",
+    "ref": "{ref}",
+    "refs": "{ref}",
+}
+
+
+def get_endpoint(url: typing.Union[str, httpx.URL]) -> str:
+    """Return the URL path with identifiers replaced by placeholders.
+
+    This keeps the cardinality of the metrics tags low:
+    `/repos/jd/foo/pulls/42/reviews` becomes `/repos/{owner}/{repo}/pulls/{number}/reviews`.
+    """
+    segments = [s for s in parse.urlparse(str(url)).path.split("/") if s]
+    endpoint = []
+    i = 0
+    while i < len(segments):
+        segment = segments[i]
+        endpoint.append(segment)
+        i += 1
+        if segment == "repos" and i + 1 < len(segments):
+            endpoint.extend(("{owner}", "{repo}"))
+            i += 2
+        elif segment in _ENDPOINT_TRAILING_PLACEHOLDERS and i < len(segments):
+            endpoint.append(_ENDPOINT_TRAILING_PLACEHOLDERS[segment])
+            break
+        elif segment in _ENDPOINT_PLACEHOLDERS and i < len(segments):
+            endpoint.append(_ENDPOINT_PLACEHOLDERS[segment])
+            i += 1
+        elif segment.isdigit():
+            endpoint[-1] = "{number}"
+        elif _SHA_RE.match(segment):
+            endpoint[-1] = "{sha}"
+    return "/" + "/".join(endpoint)
+
+
+@dataclasses.dataclass
+class CachedResponse:
+    headers: typing.Dict[str, str]
+    content: str
+
+    @property
+    def etag(self) -> typing.Optional[str]:
+        return self.headers.get("ETag")
+
+    @property
+    def last_modified(self) -> typing.Optional[str]:
+        return self.headers.get("Last-Modified")
+
+    @classmethod
+    def from_response(cls, resp: httpx.Response) -> typing.Optional["CachedResponse"]:
+        if resp.status_code != 200:
+            return None
+        headers = {
+            name: resp.headers[name]
+            for name in RESPONSE_CACHE_HEADERS
+            if name in resp.headers
+        }
+        if "ETag" not in headers and "Last-Modified" not in headers:
+            return None
+        try:
+            content = resp.content.decode()
+        except UnicodeDecodeError:
+            return None
+        return cls(headers, content)
+
+    @classmethod
+    def deserialize(cls, data: str) -> "CachedResponse":
+        return cls(**json.loads(data))
+
+    def serialize(self) -> str:
+        return json.dumps(dataclasses.asdict(self))
+
+    def conditional_headers(self) -> typing.Dict[str, str]:
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_response(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200,
+            headers=self.headers,
+            content=self.content.encode(),
+            request=request,
+            ext={"from_cache": True},
+        )
+
+
+def is_cached_response(resp: httpx.Response) -> bool:
+    return bool(resp.ext.get("from_cache"))
+
+
+class ResponseCache:
+    """Storage of GET responses that can be revalidated with conditional requests."""
+
+    def get(self, key: str) -> typing.Optional[CachedResponse]:
+        raise NotImplementedError
+
+    def set(self, key: str, cached: CachedResponse) -> None:
+        raise NotImplementedError
+
+    async def aget(self, key: str) -> typing.Optional[CachedResponse]:
+        return self.get(key)
+
+    async def aset(self, key: str, cached: CachedResponse) -> None:
+        self.set(key, cached)
+
+
+class LocalResponseCache(ResponseCache):
+    """Bounded in-process LRU cache."""
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self._lock = threading.Lock()
+        self._responses: typing.OrderedDict[
+            str, CachedResponse
+        ] = collections.OrderedDict()
+
+    def get(self, key: str) -> typing.Optional[CachedResponse]:
+        with self._lock:
+            cached = self._responses.get(key)
+            if cached is not None:
+                self._responses.move_to_end(key)
+            return cached
+
+    def set(self, key: str, cached: CachedResponse) -> None:
+        with self._lock:
+            self._responses[key] = cached
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.size:
+                self._responses.popitem(last=False)
+
+
+class RedisResponseCache(ResponseCache):
+    """Cache shared by all processes and stored in the Redis cache."""
+
+    @staticmethod
+    def _redis_key(key: str) -> str:
+        return f"http-cache~{key}"
+
+    def get(self, key: str) -> typing.Optional[CachedResponse]:
+        data = utils.get_redis_for_cache().get(self._redis_key(key))
+        if data is None:
+            return None
+        return CachedResponse.deserialize(data)
+
+    def set(self, key: str, cached: CachedResponse) -> None:
+        utils.get_redis_for_cache().set(
+            self._redis_key(key), cached.serialize(), ex=RESPONSE_CACHE_EXPIRATION
+        )
+
+    async def aget(self, key: str) -> typing.Optional[CachedResponse]:
+        redis = await utils.get_aredis_for_cache()
+        data = await redis.get(self._redis_key(key))
+        if data is None:
+            return None
+        return CachedResponse.deserialize(data)
+
+    async def aset(self, key: str, cached: CachedResponse) -> None:
+        redis = await utils.get_aredis_for_cache()
+        await redis.set(
+            self._redis_key(key), cached.serialize(), ex=RESPONSE_CACHE_EXPIRATION
+        )
+
+
+_RESPONSE_CACHE: typing.Optional[ResponseCache] = None
+
+
+def get_response_cache() -> typing.Optional[ResponseCache]:
+    """Return the response cache configured with HTTP_CACHE, if any."""
+    global _RESPONSE_CACHE
+    if config.HTTP_CACHE is None:
+        return None
+    if _RESPONSE_CACHE is None:
+        if config.HTTP_CACHE == "redis":
+            _RESPONSE_CACHE = RedisResponseCache()
+        else:
+            _RESPONSE_CACHE = LocalResponseCache(config.HTTP_CACHE_LOCAL_SIZE)
+    return _RESPONSE_CACHE
+
+
+class _ResponseCacheMixin:
+    response_cache: typing.Optional[ResponseCache]
+
+    def _get_response_cache_key(
+        self, method: str, url: str, kwargs: typing.Dict[str, typing.Any]
+    ) -> typing.Optional[str]:
+        # Responses fetched with another authentication (e.g. an user token)
+        # or with a body are never cached
+        if (
+            self.response_cache is None
+            or method.upper() != "GET"
+            or isinstance(kwargs.get("auth"), httpx.Auth)
+            or any(kwargs.get(k) is not None for k in ("content", "data", "json"))
+        ):
+            return None
+
+        request = self.build_request(  # type: ignore[attr-defined]
+            method, url, params=kwargs.get("params"), headers=kwargs.get("headers")
+        )
+        owner = extract_github_extra(self) or ""
+        accept = request.headers.get("Accept", "")
+        digest = hashlib.sha256(f"{request.url}\n{accept}".encode()).hexdigest()
+        return f"{owner.lower()}~{digest}"
+
+    @staticmethod
+    def _add_conditional_headers(
+        kwargs: typing.Dict[str, typing.Any], cached: CachedResponse
+    ) -> None:
+        kwargs["headers"] = {**(kwargs.get("headers") or {})}
+        kwargs["headers"].update(cached.conditional_headers())
+
+    def _record_cache_result(self, url: str, hit: bool) -> None:
+        statsd.increment(
+            "http.client.cache",
+            tags=[
+                f"hostname:{self.base_url.host}",  # type: ignore[attr-defined]
+                f"endpoint:{get_endpoint(url)}",
+                f"result:{'hit' if hit else 'miss'}",
+            ],
+        )
+
+
+class AsyncClient(_ResponseCacheMixin, httpx.AsyncClient):
+    def __init__(
+        self,
+        *args: typing.Any,
+        response_cache: typing.Optional[ResponseCache] = None,
+        **kwargs: typing.Any,
+    ) -> None:
+        self.response_cache = response_cache
+        super().__init__(*args, **kwargs)
+
     @connectivity_issue_retry
     async def request(self, method, url, *args, **kwargs):
+        cache_key = self._get_response_cache_key(method, url, kwargs)
+        cached = None
+        if cache_key is not None:
+            cached = await self.response_cache.aget(cache_key)
+            if cached is not None:
+                self._add_conditional_headers(kwargs, cached)
+
         resp = await super().request(method, url, *args, **kwargs)
+
+        if cache_key is not None:
+            if cached is not None and resp.status_code == 304:
+                self._record_cache_result(url, hit=True)
+                return cached.to_response(resp.request)
+            self._record_cache_result(url, hit=False)
+
         raise_for_status(resp)
+
+        if cache_key is not None:
+            cached = CachedResponse.from_response(resp)
+            if cached is not None:
+                await self.response_cache.aset(cache_key, cached)
         return resp
 
 
-class Client(httpx.Client):
+class Client(_ResponseCacheMixin, httpx.Client):
+    def __init__(
+        self,
+        *args: typing.Any,
+        response_cache: typing.Optional[ResponseCache] = None,
+        **kwargs: typing.Any,
+    ) -> None:
+        self.response_cache = response_cache
+        super().__init__(*args, **kwargs)
+
     @connectivity_issue_retry
     def request(self, method, url, *args, **kwargs):
+        cache_key = self._get_response_cache_key(method, url, kwargs)
+        cached = None
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self._add_conditional_headers(kwargs, cached)
+
         resp = super().request(method, url, *args, **kwargs)
+
+        if cache_key is not None:
+            if cached is not None and resp.status_code == 304:
+                self._record_cache_result(url, hit=True)
+                return cached.to_response(resp.request)
+            self._record_cache_result(url, hit=False)
+
         raise_for_status(resp)
+
+        if cache_key is not None:
+            cached = CachedResponse.from_response(resp)
+            if cached is not None:
+                self.response_cache.set(cache_key, cached)
         return resp
@@ -104,6 +104,34 @@ Schema = voluptuous.Schema(
             int
         ),
         voluptuous.Required("STREAM_MAX_BATCH", default=100): voluptuous.Coerce(int),
+        voluptuous.Required("STREAM_PULLS_CONCURRENCY", default=1): voluptuous.Coerce(
+            int
+        ),
+        voluptuous.Required("HTTP_CACHE", default=None): voluptuous.Any(
+            None, "local", "redis"
+        ),
+        voluptuous.Required("HTTP_CACHE_LOCAL_SIZE", default=1000): voluptuous.Coerce(
+            int
+        ),
+        voluptuous.Required("GRAPHQL_PREFETCH", default=False): CoercedBool,
+        voluptuous.Required("CHECKS_STORE", default=False): CoercedBool,
+        voluptuous.Required("PULL_SNAPSHOT_MAX_AGE", default=0): voluptuous.Coerce(int),
+        voluptuous.Required("CHECKS_STORE_MAX_AGE", default=3600): voluptuous.Coerce(
+            int
+        ),
+        voluptuous.Required(
+            "MERGEABLE_STATE_REQUEUE_DELAY", default=0
+        ): voluptuous.Coerce(int),
+        voluptuous.Required("QUEUE_REFRESH_BATCHING", default=False): CoercedBool,
+        voluptuous.Required("GIT_MIRRORS_DIR", default=None): voluptuous.Any(None, str),
+        voluptuous.Required(
+            "GIT_MIRRORS_MAX_SIZE_MB", default=10 * 1024
+        ): voluptuous.Coerce(int),
+        voluptuous.Required("GIT_JOBS_WORKERS", default=0): voluptuous.Coerce(int),
+        voluptuous.Required("DUPLICATE_BATCHING", default=False): CoercedBool,
+        voluptuous.Required("GRAPHQL_COMMITS_HISTORY", default=False): CoercedBool,
+        voluptuous.Required("PENDING_COMMANDS_STORE", default=False): CoercedBool,
+        voluptuous.Required("LABELS_STORE", default=False): CoercedBool,
         GitHubAppRequired("CACHE_TOKEN_SECRET"): str,
         voluptuous.Required("CONTEXT", default="mergify"): str,
         voluptuous.Required("GIT_EMAIL", default="noreply@mergify.io"): str,
@@ -150,6 +178,22 @@ BOT_USER_ID: int
 STORAGE_URL: str
 STREAM_URL: str
 STREAM_MAX_BATCH: int
+STREAM_PULLS_CONCURRENCY: int
+HTTP_CACHE: typing.Optional[str]
+HTTP_CACHE_LOCAL_SIZE: int
+GRAPHQL_PREFETCH: bool
+CHECKS_STORE: bool
+CHECKS_STORE_MAX_AGE: int
+PULL_SNAPSHOT_MAX_AGE: int
+MERGEABLE_STATE_REQUEUE_DELAY: int
+QUEUE_REFRESH_BATCHING: bool
+GIT_MIRRORS_DIR: typing.Optional[str]
+GIT_MIRRORS_MAX_SIZE_MB: int
+GIT_JOBS_WORKERS: int
+DUPLICATE_BATCHING: bool
+GRAPHQL_COMMITS_HISTORY: bool
+PENDING_COMMANDS_STORE: bool
+LABELS_STORE: bool
 INTEGRATION_ID: int
 SUBSCRIPTION_BASE_URL: str
 OAUTH_CLIENT_ID: str
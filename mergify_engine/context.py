@@ -16,12 +16,14 @@
 import dataclasses
 import functools
 import itertools
+import json
 import logging
 import typing
 from urllib import parse
 
 import aredis
 import daiquiri
+from datadog import statsd
 import jinja2.exceptions
 import jinja2.runtime
 import jinja2.sandbox
@@ -40,6 +42,71 @@ from mergify_engine.clients import http
 
 SUMMARY_SHA_EXPIRATION = 60 * 60 * 24 * 31  # ~ 1 Month
 
+# The cached properties of Context that can be loaded with GraphQL, by
+# condition attribute that needs them.
+PREFETCH_GROUPS_BY_ATTRIBUTE = {
+    "files": "files",
+    "approved-reviews-by": "reviews",
+    "dismissed-reviews-by": "reviews",
+    "changes-requested-reviews-by": "reviews",
+    "commented-reviews-by": "reviews",
+    "status-success": "checks",
+    "status-failure": "checks",
+    "status-neutral": "checks",
+    "check-success": "checks",
+    "check-failure": "checks",
+    "check-neutral": "checks",
+}
+
+PREFETCH_PULL_REQUEST_FIELDS = {
+    "reviews": """
+      reviews(first: 100) {
+        pageInfo { hasNextPage }
+        nodes {
+          databaseId
+          state
+          body
+          author {
+            __typename
+            login
+            ... on User { databaseId }
+            ... on Bot { databaseId }
+            ... on Organization { databaseId }
+          }
+        }
+      }""",
+    "files": """
+      files(first: 100) {
+        pageInfo { hasNextPage }
+        nodes { path additions deletions }
+      }""",
+    "commits": """
+      commits(first: 100) {
+        pageInfo { hasNextPage }
+        nodes {
+          commit {
+            oid
+            message
+            parents(first: 100) { nodes { oid } }
+          }
+        }
+      }""",
+}
+
+PREFETCH_HEAD_COMMIT_FIELDS = """
+      ... on Commit {
+        status { contexts { context state } }
+        checkSuites(first: 100) {
+          pageInfo { hasNextPage }
+          nodes {
+            checkRuns(first: 100, filterBy: {checkType: LATEST}) {
+              pageInfo { hasNextPage }
+              nodes { name conclusion }
+            }
+          }
+        }
+      }"""
+
 
 class T_PayloadEventSource(typing.TypedDict):
     event_type: github_types.GitHubEventType
@@ -60,9 +127,13 @@ class Context(object):
     sources: typing.List[T_PayloadEventSource] = dataclasses.field(default_factory=list)
     pull_request: "PullRequest" = dataclasses.field(init=False)
     log: logging.LoggerAdapter = dataclasses.field(init=False)
+    _team_members: typing.Dict[
+        typing.Tuple[str, str], typing.List[str]
+    ] = dataclasses.field(init=False, default_factory=dict)
 
     SUMMARY_NAME = "Summary"
     USER_PERMISSION_EXPIRATION = 3600  # 1 hour
+    TEAM_MEMBERS_EXPIRATION = 3600  # 1 hour
 
     def __post_init__(self):
         self._ensure_complete()
@@ -153,6 +224,63 @@ class Context(object):
             ):
                 redis.delete(key)
 
+    TEAM_MEMBERS_CACHE_KEY_PREFIX = "team_members"
+    TEAM_MEMBERS_CACHE_KEY_DELIMITER = "/"
+
+    @classmethod
+    def _team_members_cache_key_for_org(cls, organization: str) -> str:
+        return f"{cls.TEAM_MEMBERS_CACHE_KEY_PREFIX}{cls.TEAM_MEMBERS_CACHE_KEY_DELIMITER}{organization.lower()}"
+
+    @classmethod
+    def _team_members_cache_key(cls, organization: str, team_slug: str) -> str:
+        return f"{cls._team_members_cache_key_for_org(organization)}{cls.TEAM_MEMBERS_CACHE_KEY_DELIMITER}{team_slug.lower()}"
+
+    @classmethod
+    def clear_team_members_cache_for_team(
+        cls, organization: github_types.GitHubAccount, team: github_types.GitHubTeam
+    ) -> None:
+        with utils.get_redis_for_cache() as redis:  # type: ignore
+            redis.delete(
+                cls._team_members_cache_key(organization["login"], team["slug"])
+            )
+
+    @classmethod
+    def clear_team_members_cache_for_org(
+        cls, organization: github_types.GitHubAccount
+    ) -> None:
+        with utils.get_redis_for_cache() as redis:  # type: ignore
+            for key in redis.scan_iter(
+                f"{cls._team_members_cache_key_for_org(organization['login'])}{cls.TEAM_MEMBERS_CACHE_KEY_DELIMITER}*"
+            ):
+                redis.delete(key)
+
+    def _get_team_members(self, organization: str, team_slug: str) -> typing.List[str]:
+        cache_key = (organization.lower(), team_slug.lower())
+        if cache_key in self._team_members:
+            statsd.increment("engine.team_members_cache.hit", tags=["storage:local"])
+            return self._team_members[cache_key]
+
+        with utils.get_redis_for_cache() as redis:  # type: ignore
+            key = self._team_members_cache_key(organization, team_slug)
+            members = redis.get(key)
+            if members is None:
+                statsd.increment("engine.team_members_cache.miss")
+                members = [
+                    member["login"]
+                    for member in self.client.items(
+                        f"/orgs/{organization}/teams/{team_slug}/members"
+                    )
+                ]
+                redis.setex(key, self.TEAM_MEMBERS_EXPIRATION, json.dumps(members))
+            else:
+                statsd.increment(
+                    "engine.team_members_cache.hit", tags=["storage:redis"]
+                )
+                members = json.loads(members)
+
+        self._team_members[cache_key] = members
+        return members
+
     def has_write_permission(self, user: github_types.GitHubAccount) -> bool:
         with utils.get_redis_for_cache() as redis:  # type: ignore
             key = self._users_permission_cache_key
@@ -376,10 +504,7 @@ class Context(object):
         # or success.
         checks.update(
             (s["context"], s["state"])
-            for s in self.client.items(
-                f"{self.base_url}/commits/{self.pull['head']['sha']}/status",
-                list_items="statuses",
-            )
+            for s in check_api.get_statuses_for_ref(self, self.pull["head"]["sha"])
         )
         return checks
 
@@ -402,12 +527,7 @@ class Context(object):
             team_slug = name[1:]
 
         try:
-            return [
-                member["login"]
-                for member in self.client.items(
-                    f"/orgs/{organization}/teams/{team_slug}/members"
-                )
-            ]
+            return self._get_team_members(organization, team_slug)
         except http.HTTPClientSideError as e:
             self.log.warning(
                 "fail to get the organization, team or members",
@@ -429,10 +549,15 @@ class Context(object):
 
     # NOTE(sileht): quickly retry, if we don't get the status on time
     # the exception is recatch in worker.py, so worker will retry it later
+    # NOTE: when the worker delays the pull requests with an unknown
+    # mergeable_state, we don't sleep in the engine thread at all
     @tenacity.retry(
         wait=tenacity.wait_exponential(multiplier=0.2),
         stop=tenacity.stop_after_attempt(5),
-        retry=tenacity.retry_if_exception_type(exceptions.MergeableStateUnknown),
+        retry=tenacity.retry_if_exception(
+            lambda e: isinstance(e, exceptions.MergeableStateUnknown)
+            and not config.MERGEABLE_STATE_REQUEUE_DELAY
+        ),
         reraise=True,
     )
     def _ensure_complete(self):
@@ -533,6 +658,222 @@ class Context(object):
             self.client.items(f"{self.base_url}/pulls/{self.pull['number']}/files")
         )
 
+    @staticmethod
+    def get_prefetch_groups(attributes: typing.Iterable[str]) -> typing.Set[str]:
+        return {
+            PREFETCH_GROUPS_BY_ATTRIBUTE[attribute]
+            for attribute in attributes
+            if attribute in PREFETCH_GROUPS_BY_ATTRIBUTE
+        }
+
+    def prefetch(self, groups: typing.Iterable[str]) -> None:
+        """Load the requested cached properties with GraphQL.
+
+        `groups` can contain "reviews", "files", "commits" and "checks". Groups
+        already loaded are skipped, and a group that does not fit in one page
+        is left to the REST API.
+        """
+        groups = {
+            group
+            for group in groups
+            if group not in self.__dict__
+            and (group in PREFETCH_PULL_REQUEST_FIELDS or group == "checks")
+        }
+        if not groups:
+            return
+
+        variables = {
+            "owner": self.pull["base"]["user"]["login"],
+            "repo": self.pull["base"]["repo"]["name"],
+            "number": self.pull["number"],
+        }
+        fields = "".join(
+            PREFETCH_PULL_REQUEST_FIELDS[group]
+            for group in sorted(groups)
+            if group in PREFETCH_PULL_REQUEST_FIELDS
+        )
+        query_variables = "$owner: String!, $repo: String!, $number: Int!"
+        head_commit = ""
+        if "checks" in groups:
+            variables["sha"] = self.pull["head"]["sha"]
+            query_variables += ", $sha: GitObjectID!"
+            head_commit = f"\n    headCommit: object(oid: $sha) {{{PREFETCH_HEAD_COMMIT_FIELDS}\n    }}"
+        pull_request = ""
+        if fields:
+            pull_request = f"\n    pullRequest(number: $number) {{{fields}\n    }}"
+
+        query = (
+            f"query({query_variables}) {{\n"
+            f"  repository(owner: $owner, name: $repo) {{{pull_request}{head_commit}\n"
+            "  }\n"
+            "}"
+        )
+        try:
+            repository = self.client.graphql(query, variables)["repository"]
+        except (http.HTTPClientSideError, github.GraphQLError) as e:
+            self.log.warning("fail to prefetch pull request data", error=str(e))
+            return
+
+        pull = repository.get("pullRequest") or {}
+        if "reviews" in groups and self._can_prefetch(pull, "reviews"):
+            self.reviews = [
+                self._review_from_graphql(review) for review in pull["reviews"]["nodes"]
+            ]
+            self._prefetch_permissions()
+        if "files" in groups and self._can_prefetch(pull, "files"):
+            self.files = [self._file_from_graphql(f) for f in pull["files"]["nodes"]]
+        if "commits" in groups and self._can_prefetch(pull, "commits"):
+            self.commits = [
+                self._commit_from_graphql(c["commit"]) for c in pull["commits"]["nodes"]
+            ]
+        if "checks" in groups:
+            checks = self._checks_from_graphql(repository.get("headCommit"))
+            if checks is not None:
+                self.checks = checks
+
+    def _can_prefetch(self, pull: typing.Dict[str, typing.Any], group: str) -> bool:
+        if group not in pull:
+            return False
+        if pull[group]["pageInfo"]["hasNextPage"]:
+            self.log.debug("too many items to prefetch", group=group)
+            return False
+        return True
+
+    @staticmethod
+    def _account_from_graphql(
+        author: typing.Optional[typing.Dict[str, typing.Any]]
+    ) -> typing.Optional[github_types.GitHubAccount]:
+        if author is None or author.get("databaseId") is None:
+            return None
+        return {
+            "id": author["databaseId"],
+            "login": author["login"],
+            "type": author["__typename"],
+        }
+
+    def _review_from_graphql(
+        self, review: typing.Dict[str, typing.Any]
+    ) -> github_types.GitHubReview:
+        return typing.cast(
+            github_types.GitHubReview,
+            {
+                "id": review["databaseId"],
+                "user": self._account_from_graphql(review["author"]),
+                "body": review["body"],
+                "state": review["state"],
+            },
+        )
+
+    def _file_from_graphql(
+        self, f: typing.Dict[str, typing.Any]
+    ) -> typing.Dict[str, typing.Any]:
+        path = parse.quote(f["path"])
+        return {
+            "filename": f["path"],
+            "additions": f["additions"],
+            "deletions": f["deletions"],
+            "contents_url": f"{config.GITHUB_API_URL}{self.base_url}/contents/{path}?ref={self.pull['head']['sha']}",
+        }
+
+    @staticmethod
+    def _commit_from_graphql(
+        commit: typing.Dict[str, typing.Any]
+    ) -> typing.Dict[str, typing.Any]:
+        return {
+            "sha": commit["oid"],
+            "commit": {"message": commit["message"]},
+            "parents": [{"sha": p["oid"]} for p in commit["parents"]["nodes"]],
+        }
+
+    def _checks_from_graphql(
+        self, commit: typing.Optional[typing.Dict[str, typing.Any]]
+    ) -> typing.Optional[typing.Dict[str, typing.Optional[str]]]:
+        if not commit or "checkSuites" not in commit:
+            return None
+        if commit["checkSuites"]["pageInfo"]["hasNextPage"] or any(
+            suite["checkRuns"]["pageInfo"]["hasNextPage"]
+            for suite in commit["checkSuites"]["nodes"]
+        ):
+            self.log.debug("too many items to prefetch", group="checks")
+            return None
+
+        # NOTE: the GraphQL enums are the upper case version of the REST values
+        checks = {
+            check_run["name"]: (
+                check_run["conclusion"] and check_run["conclusion"].lower()
+            )
+            for suite in commit["checkSuites"]["nodes"]
+            for check_run in suite["checkRuns"]["nodes"]
+        }
+        if commit["status"] is not None:
+            checks.update(
+                (status["context"], status["state"].lower())
+                for status in commit["status"]["contexts"]
+            )
+        return checks
+
+    def _prefetch_permissions(self) -> None:
+        users = {
+            user["id"]: user
+            for user in itertools.chain(
+                (review["user"] for review in self.reviews), (self.pull["user"],)
+            )
+            if user is not None and user["type"] != "Bot"
+        }
+        if not users:
+            return
+
+        with utils.get_redis_for_cache() as redis:
+            key = self._users_permission_cache_key
+            cached = redis.hmget(key, [str(user_id) for user_id in users])
+            missing = [
+                user
+                for user, permission in zip(users.values(), cached)
+                if permission is None
+            ]
+            if not missing:
+                return
+
+            variables: typing.Dict[str, typing.Any] = {
+                "owner": self.pull["base"]["user"]["login"],
+                "repo": self.pull["base"]["repo"]["name"],
+            }
+            query_variables = ["$owner: String!", "$repo: String!"]
+            fields = []
+            for i, user in enumerate(missing):
+                variables[f"login{i}"] = user["login"]
+                query_variables.append(f"$login{i}: String!")
+                fields.append(
+                    f"    user{i}: collaborators(query: $login{i}, first: 100) "
+                    "{ edges { permission node { login } } }\n"
+                )
+            query = (
+                f"query({', '.join(query_variables)}) {{\n"
+                "  repository(owner: $owner, name: $repo) {\n"
+                f"{''.join(fields)}"
+                "  }\n"
+                "}"
+            )
+            try:
+                repository = self.client.graphql(query, variables)["repository"]
+            except (http.HTTPClientSideError, github.GraphQLError) as e:
+                self.log.warning("fail to prefetch users permission", error=str(e))
+                return
+
+            with redis.pipeline() as pipe:
+                for i, user in enumerate(missing):
+                    collaborators = repository.get(f"user{i}")
+                    if collaborators is None:
+                        continue
+                    # NOTE: the collaborators query also matches names and
+                    # partial logins. Users not listed are left to the REST API.
+                    for edge in collaborators["edges"]:
+                        if edge["node"]["login"].lower() == user["login"].lower():
+                            pipe.hset(key, user["id"], edge["permission"].lower())
+                            break
+                pipe.expire(key, self.USER_PERMISSION_EXPIRATION)
+                pipe.execute()
+
     @property
     def pull_from_fork(self):
         return self.pull["head"]["repo"]["id"] != self.pull["base"]["repo"]["id"]
@@ -26,6 +26,7 @@ from mergify_engine import queue
 from mergify_engine import rules
 from mergify_engine import subscription
 from mergify_engine import utils
+from mergify_engine import worker
 from mergify_engine.actions import merge_base
 from mergify_engine.clients import github
 from mergify_engine.clients import http
@@ -99,7 +100,7 @@ def report_sub(
 async def report_worker_status(owner: str) -> None:
     stream_name = f"stream~{owner}".encode()
     r = await utils.create_aredis_for_stream()
-    streams = await r.zrangebyscore("streams", min=0, max="+inf", withscores=True)
+    streams = await worker.get_streams(r)
 
     for pos, item in enumerate(streams):
         if item[0] == stream_name:
@@ -108,7 +109,7 @@ async def report_worker_status(owner: str) -> None:
         print("* WORKER: Installation not queued to process")
         return
 
-    planned = datetime.datetime.utcfromtimestamp(streams[pos]).isoformat()
+    planned = datetime.datetime.utcfromtimestamp(streams[pos][1]).isoformat()
 
     attempts = await r.hget("attempts", stream_name) or 0
     print(
@@ -221,8 +222,10 @@ def report(
 
                 print(f"* QUEUES {branch['name']}:")
 
+                configs = q.get_configs(pulls)
+
                 for priority, grouped_pulls in itertools.groupby(
-                    pulls, key=lambda v: q.get_config(v)["priority"]
+                    pulls, key=lambda v: configs[v]["priority"]
                 ):
                     try:
                         fancy_priority = merge_base.PriorityAliases(priority).name
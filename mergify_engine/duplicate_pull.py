@@ -12,16 +12,19 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
+import concurrent.futures
 import dataclasses
-import functools
 import subprocess
 
 import tenacity
 
 from mergify_engine import config
 from mergify_engine import doc
+from mergify_engine import git_mirrors
 from mergify_engine import subscription
 from mergify_engine import utils
+from mergify_engine.clients import github
 from mergify_engine.clients import http
 
 
@@ -45,27 +48,55 @@ GIT_MESSAGE_TO_EXCEPTION = {
 }
 
 
-@functools.total_ordering
-class CommitOrderingKey(object):
-    def __init__(self, obj, *args):
-        self.obj = obj
-
-    @staticmethod
-    def order_commit(c1, c2):
-        if c1["sha"] == c2["sha"]:
-            return 0
-
-        for p in c1["parents"]:
-            if c2["sha"] == p["sha"]:
-                return 1
+# Walk the history of a rebased or squashed pull request from its merge
+# commit, with the pull requests associated to each commit.
+COMMITS_HISTORY_QUERY = """
+query($owner: String!, $repo: String!, $sha: GitObjectID!, $count: Int!, $after: String) {
+  repository(owner: $owner, name: $repo) {
+    object(oid: $sha) {
+      ... on Commit {
+        history(first: $count, after: $after) {
+          pageInfo { hasNextPage endCursor }
+          nodes {
+            oid
+            message
+            parents(first: 2) { nodes { oid } }
+            associatedPullRequests(first: 10) {
+              nodes { number baseRepository { nameWithOwner } }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
 
-        return -1
 
-    def __lt__(self, other):
-        return self.order_commit(self.obj, other.obj) < 0
+def _sort_commits(commits):
+    """Order commits topologically, parents first, in linear time.
 
-    def __eq__(self, other):
-        return self.order_commit(self.obj, other.obj) == 0
+    Commits that don't depend on each other keep their order.
+    """
+    shas = {commit["sha"] for commit in commits}
+    children = collections.defaultdict(list)
+    missing_parents = {}
+    for commit in commits:
+        parents = [p["sha"] for p in commit["parents"] if p["sha"] in shas]
+        missing_parents[commit["sha"]] = len(parents)
+        for parent in parents:
+            children[parent].append(commit)
+
+    ready = collections.deque(c for c in commits if not missing_parents[c["sha"]])
+    sorted_commits = []
+    while ready:
+        commit = ready.popleft()
+        sorted_commits.append(commit)
+        for child in children[commit["sha"]]:
+            missing_parents[child["sha"]] -= 1
+            if not missing_parents[child["sha"]]:
+                ready.append(child)
+    return sorted_commits
 
 
 def is_base_branch_merge_commit(commit, base_branch):
@@ -80,16 +111,88 @@ def _get_commits_without_base_branch_merge(ctxt):
     return list(
         filter(
             lambda c: not is_base_branch_merge_commit(c, base_branch),
-            sorted(ctxt.commits, key=CommitOrderingKey),
+            _sort_commits(ctxt.commits),
         )
     )
 
 
+def _get_rebased_commits_from_graphql(ctxt, merge_commit):
+    """Same as the REST walk of _get_commits_to_cherrypick, but with one query
+    per 100 commits.
+
+    Returns None if the history can't be retrieved.
+    """
+    repo_full_name = ctxt.pull["base"]["repo"]["full_name"]
+    variables = {
+        "owner": ctxt.pull["base"]["user"]["login"],
+        "repo": ctxt.pull["base"]["repo"]["name"],
+        "sha": merge_commit["sha"],
+        # The pull request commits and the one before
+        "count": min(ctxt.pull.get("commits", 99) + 1, 100),
+        "after": None,
+    }
+
+    out_commits = []
+    sha = merge_commit["sha"]
+    while True:
+        try:
+            repository = ctxt.client.graphql(COMMITS_HISTORY_QUERY, variables)[
+                "repository"
+            ]
+        except (http.HTTPClientSideError, github.GraphQLError) as e:
+            ctxt.log.warning("fail to get commits history", error=str(e))
+            return None
+
+        history = (repository.get("object") or {}).get("history")
+        if history is None:
+            return None
+
+        for node in history["nodes"]:
+            if node["oid"] != sha:
+                ctxt.log.warning("unexpected commits history order")
+                return None
+
+            if out_commits:
+                pull_numbers = [
+                    p["number"]
+                    for p in node["associatedPullRequests"]["nodes"]
+                    if p["baseRepository"]["nameWithOwner"] == repo_full_name
+                ]
+                if ctxt.pull["number"] not in pull_numbers:
+                    return out_commits
+
+            parents = [p["oid"] for p in node["parents"]["nodes"]]
+            if len(parents) != 1:
+                # NOTE(sileht): What is that? A merge here?
+                ctxt.log.error("unhandled commit structure")
+                return []
+
+            out_commits.insert(
+                0,
+                {
+                    "sha": node["oid"],
+                    "commit": {"message": node["message"]},
+                    "parents": [{"sha": parents[0]}],
+                },
+            )
+            sha = parents[0]
+
+        if not history["pageInfo"]["hasNextPage"]:
+            return None
+        variables["count"] = 100
+        variables["after"] = history["pageInfo"]["endCursor"]
+
+
 def _get_commits_to_cherrypick(ctxt, merge_commit):
     if len(merge_commit["parents"]) == 1:
         # NOTE(sileht): We have a rebase+merge or squash+merge
         # We pick all commits until a sha is not linked with our PR
 
+        if config.GRAPHQL_COMMITS_HISTORY:
+            out_commits = _get_rebased_commits_from_graphql(ctxt, merge_commit)
+            if out_commits is not None:
+                return out_commits
+
         out_commits = []
         commit = merge_commit
         while True:
@@ -155,36 +258,16 @@ COPY = "copy"
 BRANCH_PREFIX_MAP = {BACKPORT: "bp", COPY: "copy"}
 
 
-def get_destination_branch_name(pull_number, branch_name, kind):
-    return "mergify/%s/%s/pr-%s" % (BRANCH_PREFIX_MAP[kind], branch_name, pull_number)
-
-
-@tenacity.retry(
-    wait=tenacity.wait_exponential(multiplier=0.2),
-    stop=tenacity.stop_after_attempt(5),
-    retry=tenacity.retry_if_exception_type(DuplicateNeedRetry),
-)
-def duplicate(
-    ctxt, branch_name, label_conflicts=None, ignore_conflicts=False, kind=BACKPORT
-):
-    """Duplicate a pull request.
+# Maximum number of pull requests created at the same time by duplicate_many
+DUPLICATE_MAX_CONCURRENCY = 5
 
-    :param pull: The pull request.
-    :type pull: py:class:mergify_engine.context.Context
-    :param branch: The branch to copy to.
-    :param label_conflicts: The label to add to the created PR when cherry-pick failed.
-    :param ignore_conflicts: Whether to commit the result if the cherry-pick fails.
-    :param kind: is a backport or a copy
-    """
-    repo_full_name = ctxt.pull["base"]["repo"]["full_name"]
-    bp_branch = get_destination_branch_name(ctxt.pull["number"], branch_name, kind)
 
-    cherry_pick_fail = False
-    body = ""
+def get_destination_branch_name(pull_number, branch_name, kind):
+    return "mergify/%s/%s/pr-%s" % (BRANCH_PREFIX_MAP[kind], branch_name, pull_number)
 
-    git = utils.Gitter(ctxt.log)
 
-    repo_info = ctxt.client.item(f"/repos/{repo_full_name}")
+def _check_repository_size(ctxt, kind):
+    repo_info = ctxt.client.item(f"/repos/{ctxt.pull['base']['repo']['full_name']}")
     if repo_info["size"] > config.NOSUB_MAX_REPO_SIZE_KB:
         if not ctxt.subscription.has_feature(subscription.Features.LARGE_REPOSITORY):
             ctxt.log.warning(
@@ -197,67 +280,69 @@ def duplicate(
             )
         ctxt.log.info("running %s on large repository", kind)
 
-    # TODO(sileht): This can be done with the Github API only I think:
-    # An example:
-    # https://github.com/shiqiyang-okta/ghpick/blob/master/ghpick/cherry.py
-    try:
-        token = ctxt.client.auth.get_access_token()
-        git("init")
-        git.configure()
-        git.add_cred("x-access-token", token, repo_full_name)
-        git("remote", "add", "origin", f"{config.GITHUB_URL}/{repo_full_name}")
-        git("fetch", "--quiet", "origin", "pull/%s/head" % ctxt.pull["number"])
-        git("fetch", "--quiet", "origin", ctxt.pull["base"]["ref"])
-        git("fetch", "--quiet", "origin", branch_name)
-        git("checkout", "--quiet", "-b", bp_branch, "origin/%s" % branch_name)
-
-        merge_commit = ctxt.client.item(
-            f"{ctxt.base_url}/commits/{ctxt.pull['merge_commit_sha']}"
-        )
-        for commit in _get_commits_to_cherrypick(ctxt, merge_commit):
-            # FIXME(sileht): Github does not allow to fetch only one commit
-            # So we have to fetch the branch since the commit date ...
-            # git("fetch", "origin", "%s:refs/remotes/origin/%s-commit" %
-            #    (commit["sha"], commit["sha"])
-            #    )
-            # last_commit_date = commit["commit"]["committer"]["date"]
-            # git("fetch", "origin", ctxt.pull["base"]["ref"],
-            #    "--shallow-since='%s'" % last_commit_date)
-            try:
-                git("cherry-pick", "-x", commit["sha"])
-            except subprocess.CalledProcessError as e:  # pragma: no cover
-                ctxt.log.info("fail to cherry-pick %s: %s", commit["sha"], e.output)
-                git_status = git("status").stdout
-                body += f"\n\nCherry-pick of {commit['sha']} has failed:\n```\n{git_status}```\n\n"
-                if not ignore_conflicts:
-                    raise DuplicateFailed(body)
-                cherry_pick_fail = True
-                git("add", "*")
-                git("commit", "-a", "--no-edit", "--allow-empty")
-
-        git("push", "origin", bp_branch)
-    except subprocess.CalledProcessError as in_exception:  # pragma: no cover
-        for message, out_exception in GIT_MESSAGE_TO_EXCEPTION.items():
-            if message in in_exception.output:
-                if out_exception is None:
-                    return
-                else:
-                    raise out_exception(
-                        "Git reported the following error:\n"
-                        f"```\n{in_exception.output}\n```\n"
-                    )
-        else:
-            ctxt.log.error(
-                "duplicate failed: %s",
-                in_exception.output,
-                branch=branch_name,
-                kind=kind,
-                exc_info=True,
-            )
+
+def _setup_git(ctxt, git):
+    repo_full_name = ctxt.pull["base"]["repo"]["full_name"]
+    token = ctxt.client.auth.get_access_token()
+    git("init")
+    git.configure()
+    git.add_cred("x-access-token", token, repo_full_name)
+    git("remote", "add", "origin", f"{config.GITHUB_URL}/{repo_full_name}")
+
+
+def _cherry_pick(ctxt, git, commits, ignore_conflicts):
+    """Cherry-pick the commits on the current branch.
+
+    Returns a tuple (body, cherry_pick_fail).
+    """
+    cherry_pick_fail = False
+    body = ""
+    for commit in commits:
+        # FIXME(sileht): Github does not allow to fetch only one commit
+        # So we have to fetch the branch since the commit date ...
+        # git("fetch", "origin", "%s:refs/remotes/origin/%s-commit" %
+        #    (commit["sha"], commit["sha"])
+        #    )
+        # last_commit_date = commit["commit"]["committer"]["date"]
+        # git("fetch", "origin", ctxt.pull["base"]["ref"],
+        #    "--shallow-since='%s'" % last_commit_date)
+        try:
+            git("cherry-pick", "-x", commit["sha"])
+        except subprocess.CalledProcessError as e:  # pragma: no cover
+            ctxt.log.info("fail to cherry-pick %s: %s", commit["sha"], e.output)
+            git_status = git("status").stdout
+            body += f"\n\nCherry-pick of {commit['sha']} has failed:\n```\n{git_status}```\n\n"
+            if not ignore_conflicts:
+                raise DuplicateFailed(body)
+            cherry_pick_fail = True
+            git("add", "*")
+            git("commit", "-a", "--no-edit", "--allow-empty")
+    return body, cherry_pick_fail
+
+
+def _handle_git_error(ctxt, in_exception, branch_name, kind):
+    """Raise the exception matching a git error, or log it if unexpected."""
+    for message, out_exception in GIT_MESSAGE_TO_EXCEPTION.items():
+        if message in in_exception.output:
+            if out_exception is not None:
+                raise out_exception(
+                    "Git reported the following error:\n"
+                    f"```\n{in_exception.output}\n```\n"
+                )
             return
-    finally:
-        git.cleanup()
+    else:
+        ctxt.log.error(
+            "duplicate failed: %s",
+            in_exception.output,
+            branch=branch_name,
+            kind=kind,
+            exc_info=True,
+        )
+
 
+def _create_duplicate_pull(
+    ctxt, branch_name, bp_branch, body, cherry_pick_fail, label_conflicts, kind
+):
     body = (
         f"This is an automated {kind} of pull request #{ctxt.pull['number']} done by Mergify"
         + body
@@ -295,3 +380,161 @@ def duplicate(
         )
 
     return duplicate_pr
+
+
+@tenacity.retry(
+    wait=tenacity.wait_exponential(multiplier=0.2),
+    stop=tenacity.stop_after_attempt(5),
+    retry=tenacity.retry_if_exception_type(DuplicateNeedRetry),
+)
+def duplicate(
+    ctxt, branch_name, label_conflicts=None, ignore_conflicts=False, kind=BACKPORT
+):
+    """Duplicate a pull request.
+
+    :param pull: The pull request.
+    :type pull: py:class:mergify_engine.context.Context
+    :param branch: The branch to copy to.
+    :param label_conflicts: The label to add to the created PR when cherry-pick failed.
+    :param ignore_conflicts: Whether to commit the result if the cherry-pick fails.
+    :param kind: is a backport or a copy
+    """
+    repo_full_name = ctxt.pull["base"]["repo"]["full_name"]
+    bp_branch = get_destination_branch_name(ctxt.pull["number"], branch_name, kind)
+
+    _check_repository_size(ctxt, kind)
+
+    git = utils.Gitter(ctxt.log)
+
+    # TODO(sileht): This can be done with the Github API only I think:
+    # An example:
+    # https://github.com/shiqiyang-okta/ghpick/blob/master/ghpick/cherry.py
+    try:
+        _setup_git(ctxt, git)
+        with git_mirrors.use(git, repo_full_name):
+            git("fetch", "--quiet", "origin", "pull/%s/head" % ctxt.pull["number"])
+            git("fetch", "--quiet", "origin", ctxt.pull["base"]["ref"])
+            git("fetch", "--quiet", "origin", branch_name)
+            git("checkout", "--quiet", "-b", bp_branch, "origin/%s" % branch_name)
+
+            merge_commit = ctxt.client.item(
+                f"{ctxt.base_url}/commits/{ctxt.pull['merge_commit_sha']}"
+            )
+            body, cherry_pick_fail = _cherry_pick(
+                ctxt,
+                git,
+                _get_commits_to_cherrypick(ctxt, merge_commit),
+                ignore_conflicts,
+            )
+
+            git("push", "origin", bp_branch)
+    except subprocess.CalledProcessError as in_exception:  # pragma: no cover
+        _handle_git_error(ctxt, in_exception, branch_name, kind)
+        return
+    finally:
+        git.cleanup()
+
+    return _create_duplicate_pull(
+        ctxt, branch_name, bp_branch, body, cherry_pick_fail, label_conflicts, kind
+    )
+
+
+@tenacity.retry(
+    wait=tenacity.wait_exponential(multiplier=0.2),
+    stop=tenacity.stop_after_attempt(5),
+    retry=tenacity.retry_if_exception_type(DuplicateNeedRetry),
+)
+def duplicate_many(
+    ctxt, branch_names, label_conflicts=None, ignore_conflicts=False, kind=BACKPORT
+):
+    """Duplicate a pull request to several branches.
+
+    Same as `duplicate`, but the objects are fetched once, the commits are
+    cherry-picked on all the branches in the same repository, pushed at once
+    and the pull requests are created concurrently.
+
+    Returns a dict with, for each branch, the created pull request, None, or
+    the DuplicateFailed exception.
+    """
+    repo_full_name = ctxt.pull["base"]["repo"]["full_name"]
+    results = dict.fromkeys(branch_names)
+    to_create = {}
+
+    _check_repository_size(ctxt, kind)
+
+    git = utils.Gitter(ctxt.log)
+
+    try:
+        _setup_git(ctxt, git)
+        with git_mirrors.use(git, repo_full_name):
+            git(
+                "fetch",
+                "--quiet",
+                "origin",
+                "pull/%s/head" % ctxt.pull["number"],
+                ctxt.pull["base"]["ref"],
+                *branch_names,
+            )
+
+            merge_commit = ctxt.client.item(
+                f"{ctxt.base_url}/commits/{ctxt.pull['merge_commit_sha']}"
+            )
+            commits = _get_commits_to_cherrypick(ctxt, merge_commit)
+
+            for branch_name in branch_names:
+                bp_branch = get_destination_branch_name(
+                    ctxt.pull["number"], branch_name, kind
+                )
+                git("checkout", "--quiet", "-b", bp_branch, "origin/%s" % branch_name)
+                try:
+                    to_create[branch_name] = (bp_branch,) + _cherry_pick(
+                        ctxt, git, commits, ignore_conflicts
+                    )
+                except DuplicateFailed as e:
+                    results[branch_name] = e
+                    git("cherry-pick", "--abort")
+
+            bp_branches = [bp_branch for bp_branch, _, _ in to_create.values()]
+            if bp_branches:
+                try:
+                    git("push", "origin", *bp_branches)
+                except subprocess.CalledProcessError:
+                    # NOTE: the push of some branches may have been rejected
+                    # only, push them one by one to handle each error
+                    for branch_name, (bp_branch, _, _) in list(to_create.items()):
+                        try:
+                            git("push", "origin", bp_branch)
+                        except subprocess.CalledProcessError as in_exception:
+                            _handle_git_error(ctxt, in_exception, branch_name, kind)
+                            del to_create[branch_name]
+    except subprocess.CalledProcessError as in_exception:  # pragma: no cover
+        _handle_git_error(ctxt, in_exception, branch_names, kind)
+        return results
+    finally:
+        git.cleanup()
+
+    if to_create:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(len(to_create), DUPLICATE_MAX_CONCURRENCY)
+        ) as executor:
+            futures = {
+                branch_name: executor.submit(
+                    _create_duplicate_pull,
+                    ctxt,
+                    branch_name,
+                    bp_branch,
+                    body,
+                    cherry_pick_fail,
+                    label_conflicts,
+                    kind,
+                )
+                for branch_name, (
+                    bp_branch,
+                    body,
+                    cherry_pick_fail,
+                ) in to_create.items()
+            }
+        for branch_name, future in futures.items():
+            results[branch_name] = future.result()
+
+    return results
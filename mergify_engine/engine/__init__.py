@@ -10,7 +10,6 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
-import asyncio
 import typing
 
 import daiquiri
@@ -88,6 +87,21 @@ def get_summary_from_sha(ctxt, sha):
         return checks[0]
 
 
+# Actions that look at the commits of the pull request
+PREFETCH_COMMITS_ACTIONS = ("merge", "rebase", "update", "backport", "copy")
+
+
+def _prefetch(
+    ctxt: context.Context, pull_request_rules: rules.PullRequestRules
+) -> None:
+    groups = ctxt.get_prefetch_groups(
+        pull_request_rules.get_condition_attribute_names()
+    )
+    if pull_request_rules.get_action_names().intersection(PREFETCH_COMMITS_ACTIONS):
+        groups.add("commits")
+    ctxt.prefetch(groups)
+
+
 async def _ensure_summary_on_head_sha(ctxt: context.Context) -> None:
     for check in ctxt.pull_engine_check_runs:
         if check["name"] == ctxt.SUMMARY_NAME and actions_runner.load_conclusions_line(
@@ -158,7 +172,7 @@ def run(
         return
 
     if ctxt.client.auth.permissions_need_to_be_updated:
-        asyncio.run(
+        utils.run_coroutine(
             ctxt.set_summary_check(
                 check_api.Result(
                     check_api.Conclusion.FAILURE,
@@ -170,7 +184,7 @@ def run(
         return
 
     ctxt.log.debug("engine check configuration change")
-    if asyncio.run(_check_configuration_changes(ctxt)):
+    if utils.run_coroutine(_check_configuration_changes(ctxt)):
         ctxt.log.info("Configuration changed, ignoring")
         return
 
@@ -194,7 +208,7 @@ def run(
             if s["event_type"] == "pull_request":
                 event = typing.cast(github_types.GitHubEventPullRequest, s["data"])
                 if event["action"] in ("opened", "synchronize"):
-                    asyncio.run(
+                    utils.run_coroutine(
                         ctxt.set_summary_check(
                             check_api.Result(
                                 check_api.Conclusion.FAILURE,
@@ -214,7 +228,7 @@ def run(
         subscription.Features.PRIVATE_REPOSITORY
     ):
         ctxt.log.info("mergify disabled: private repository")
-        asyncio.run(
+        utils.run_coroutine(
             ctxt.set_summary_check(
                 check_api.Result(
                     check_api.Conclusion.FAILURE,
@@ -225,7 +239,11 @@ def run(
         )
         return
 
-    asyncio.run(_ensure_summary_on_head_sha(ctxt))
+    if config.GRAPHQL_PREFETCH:
+        ctxt.log.debug("engine prefetch pull request data")
+        _prefetch(ctxt, mergify_config["pull_request_rules"])
+
+    utils.run_coroutine(_ensure_summary_on_head_sha(ctxt))
 
     # NOTE(jd): that's fine for now, but I wonder if we wouldn't need a higher abstraction
     # to have such things run properly. Like hooks based on events that you could
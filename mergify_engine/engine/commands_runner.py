@@ -12,6 +12,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import json
 import re
 import typing
 
@@ -25,6 +26,7 @@ from mergify_engine import config
 from mergify_engine import context
 from mergify_engine import github_types
 from mergify_engine import rules
+from mergify_engine import utils
 from mergify_engine.clients import github
 from mergify_engine.clients import http
 
@@ -38,6 +40,8 @@ MERGE_QUEUE_COMMAND_MESSAGE = "Command not allowed on merge queue pull request."
 UNKNOWN_COMMAND_MESSAGE = "Sorry but I didn't understand the command."
 WRONG_ACCOUNT_MESSAGE = "_Hey, I reacted but my real name is @Mergifyio_"
 
+PENDING_COMMANDS_EXPIRATION = 60 * 60 * 24 * 7  # 7 days
+
 
 def post_comment(
     ctxt: context.Context,
@@ -87,8 +91,24 @@ async def on_each_event(event: github_types.GitHubEventIssueComment) -> None:
             )  # type: ignore[call-arg]
 
 
-def run_pending_commands_tasks(ctxt: context.Context) -> None:
-    pendings = set()
+def _get_pending_commands_key(ctxt: context.Context) -> str:
+    return (
+        f"pending-commands~{ctxt.pull['base']['user']['login']}"
+        f"~{ctxt.pull['base']['repo']['name']}~{ctxt.pull['number']}"
+    )
+
+
+def _update_pending_commands(
+    pendings: typing.Set[str], command: str, state: str
+) -> None:
+    if state == "pending":
+        pendings.add(command)
+    elif state in ("success", "failure"):
+        pendings.discard(command)
+
+
+def _get_pending_commands_from_comments(ctxt: context.Context) -> typing.Set[str]:
+    pendings: typing.Set[str] = set()
     for comment in ctxt.client.items(
         f"{ctxt.base_url}/issues/{ctxt.pull['number']}/comments"
     ):
@@ -96,17 +116,67 @@ def run_pending_commands_tasks(ctxt: context.Context) -> None:
             continue
         match = COMMAND_RESULT_MATCHER.search(comment["body"])
         if match:
-            command = match[1]
-            state = match[2]
-            if state == "pending":
-                pendings.add(command)
-            elif command in pendings:
-                pendings.remove(command)
-
-    for pending in pendings:
+            _update_pending_commands(pendings, match[1], match[2])
+    return pendings
+
+
+def _store_pending_commands(ctxt: context.Context, pendings: typing.Set[str]) -> None:
+    with utils.get_redis_for_cache() as redis:
+        redis.set(
+            _get_pending_commands_key(ctxt),
+            json.dumps(sorted(pendings)),
+            ex=PENDING_COMMANDS_EXPIRATION,
+        )
+
+
+def get_pending_commands(ctxt: context.Context) -> typing.Set[str]:
+    """Return the commands still pending on the pull request.
+
+    With PENDING_COMMANDS_STORE, the state is built once from the comments,
+    then kept up to date by `handle`.
+    """
+    if not config.PENDING_COMMANDS_STORE:
+        return _get_pending_commands_from_comments(ctxt)
+
+    with utils.get_redis_for_cache() as redis:
+        pendings = redis.get(_get_pending_commands_key(ctxt))
+
+    if pendings is None:
+        statsd.increment("engine.pending_commands.backfill")
+        backfilled = _get_pending_commands_from_comments(ctxt)
+        _store_pending_commands(ctxt, backfilled)
+        return backfilled
+
+    return set(json.loads(pendings))
+
+
+def _set_command_state(ctxt: context.Context, command: str, state: str) -> None:
+    if not config.PENDING_COMMANDS_STORE:
+        return
+
+    with utils.get_redis_for_cache() as redis:
+        pendings = redis.get(_get_pending_commands_key(ctxt))
+    if pendings is None:
+        # NOTE: not stored yet, the comment just posted will be read by the
+        # backfill
+        return
+
+    new_pendings = set(json.loads(pendings))
+    _update_pending_commands(new_pendings, command, state)
+    _store_pending_commands(ctxt, new_pendings)
+
+
+def run_pending_commands_tasks(ctxt: context.Context) -> None:
+    for pending in get_pending_commands(ctxt):
         handle(ctxt, "@Mergifyio %s" % pending, None, rerun=True)
 
 
+def get_command_full(command: str, command_args: str) -> str:
+    if command_args:
+        return f"{command} {command_args}"
+    return command
+
+
 def run_action(
     ctxt: context.Context,
     action: typing.Tuple[str, str, actions.Action],
@@ -123,10 +193,7 @@ def run_action(
         ),
     )
 
-    if command_args:
-        command_full = f"{command} {command_args}"
-    else:
-        command_full = command
+    command_full = get_command_full(command, command_args)
 
     ctxt.log.info(
         "command %s",
@@ -181,3 +248,6 @@ def handle(
         return
 
     post_comment(ctxt, message + footer)
+    _set_command_state(
+        ctxt, get_command_full(action[0], action[1]), result.conclusion.name.lower()
+    )
@@ -0,0 +1,175 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import concurrent.futures
+import dataclasses
+import threading
+import time
+import typing
+
+import daiquiri
+from datadog import statsd
+
+from mergify_engine import config
+from mergify_engine import context
+from mergify_engine import github_events
+from mergify_engine import github_types
+from mergify_engine import subscription
+from mergify_engine import utils
+from mergify_engine.clients import github
+
+
+LOG = daiquiri.getLogger(__name__)
+
+# Git operations (rebases, copies and backports) can take minutes. When
+# GIT_JOBS_WORKERS is set, they run in a dedicated pool of threads instead of
+# the engine thread of the stream worker, so the other pull requests handled
+# by the worker are not blocked in the meantime.
+#
+# While a job runs, the action reports a pending state. Once the job is done,
+# the pull request is refreshed and the next evaluation of the action gets the
+# result of the job.
+#
+# Jobs are tracked in memory: the pull requests of an owner are always
+# processed by the same worker process, and the git operations are idempotent,
+# so a job lost by a restart is just run again.
+
+# Results that are never claimed (e.g. the pull request is closed in the
+# meantime) are dropped after this delay
+JOB_RESULT_EXPIRATION = 10 * 60
+
+T = typing.TypeVar("T")
+
+JobKeyT = typing.Tuple[str, github_types.GitHubPullRequestNumber, str, str]
+
+
+class JobPending(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class _Job:
+    future: "concurrent.futures.Future[typing.Any]"
+    finished_at: typing.Optional[float] = None
+
+
+_EXECUTOR: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+_JOBS: typing.Dict[JobKeyT, _Job] = {}
+_JOBS_LOCK = threading.Lock()
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+            max_workers=config.GIT_JOBS_WORKERS, thread_name_prefix="git-jobs"
+        )
+    return _EXECUTOR
+
+
+def _send_depth_metric() -> None:
+    statsd.gauge(
+        "engine.git_jobs.pending",
+        sum(1 for job in _JOBS.values() if job.finished_at is None),
+    )
+
+
+def _expire_jobs() -> None:
+    expired_at = time.monotonic() - JOB_RESULT_EXPIRATION
+    for key, job in list(_JOBS.items()):
+        if job.finished_at is not None and job.finished_at < expired_at:
+            del _JOBS[key]
+
+
+def _run_job(
+    name: str,
+    pull: github_types.GitHubPullRequest,
+    sub: subscription.Subscription,
+    func: typing.Callable[[context.Context], T],
+) -> T:
+    started_at = time.monotonic()
+    try:
+        with github.get_client(pull["base"]["user"]["login"]) as client:
+            return func(context.Context(client, pull, sub))
+    finally:
+        statsd.timing(
+            "engine.git_jobs.duration",
+            (time.monotonic() - started_at) * 1000,
+            tags=[f"job:{name}"],
+        )
+
+
+def _on_job_done(
+    job: _Job,
+    pull: github_types.GitHubPullRequest,
+) -> None:
+    with _JOBS_LOCK:
+        job.finished_at = time.monotonic()
+        _send_depth_metric()
+
+    try:
+        utils.async_run(github_events.send_refresh(pull))
+    except Exception:
+        LOG.error(
+            "fail to refresh pull request after git job",
+            gh_owner=pull["base"]["user"]["login"],
+            gh_repo=pull["base"]["repo"]["name"],
+            gh_pull=pull["number"],
+            exc_info=True,
+        )
+
+
+def run(
+    ctxt: context.Context,
+    name: str,
+    func: typing.Callable[[context.Context], T],
+) -> T:
+    """Run a git operation on a pull request.
+
+    When the git jobs pool is enabled, the operation is submitted to the pool
+    and JobPending is raised until it is done. Then the result of the
+    operation is returned, or its exception is raised.
+
+    Jobs are identified by their name and the head sha of the pull request, so
+    a job is run again once the pull request has changed.
+    """
+    if not config.GIT_JOBS_WORKERS:
+        return func(ctxt)
+
+    key: JobKeyT = (
+        ctxt.pull["base"]["repo"]["full_name"],
+        ctxt.pull["number"],
+        ctxt.pull["head"]["sha"],
+        name,
+    )
+    with _JOBS_LOCK:
+        _expire_jobs()
+        job = _JOBS.get(key)
+        if job is not None:
+            if job.finished_at is None:
+                raise JobPending()
+            del _JOBS[key]
+            return typing.cast(T, job.future.result())
+
+        new_job = _JOBS[key] = _Job(
+            _get_executor().submit(_run_job, name, ctxt.pull, ctxt.subscription, func)
+        )
+        _send_depth_metric()
+
+    # NOTE: out of the lock, the callback is called right away if the job is
+    # already done
+    new_job.future.add_done_callback(lambda f: _on_job_done(new_job, ctxt.pull))
+    ctxt.log.info("git job submitted", job=name)
+    raise JobPending()
@@ -0,0 +1,165 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import contextlib
+import fcntl
+import os
+import shutil
+import subprocess
+import typing
+
+import daiquiri
+from datadog import statsd
+
+from mergify_engine import config
+from mergify_engine import utils
+
+
+LOG = daiquiri.getLogger(__name__)
+
+# Bare mirrors of the repositories, kept on local disk between git operations.
+#
+# A Gitter borrows the objects of the mirror through the git alternates
+# mechanism, so it only fetches from GitHub the objects the mirror doesn't
+# have yet. Once the operation is done, the objects fetched by the Gitter are
+# saved into the mirror. The mirror never talks to GitHub, so no credentials
+# are stored on disk.
+#
+# Each mirror has two lock files:
+# * `.use`: shared by the Gitters borrowing the mirror, exclusive for the
+#   eviction, so a mirror is never removed while it is in use.
+# * `.update`: exclusive, to create the mirror and save objects into it.
+
+LAST_USED_FILE = "mergify-last-used"
+
+
+def _get_mirror_path(repo_full_name: str) -> str:
+    return os.path.join(
+        typing.cast(str, config.GIT_MIRRORS_DIR), repo_full_name.lower() + ".git"
+    )
+
+
+@contextlib.contextmanager
+def _lock(path: str, operation: int) -> typing.Iterator[typing.Optional[typing.TextIO]]:
+    """Lock a file, yield None if LOCK_NB is set and the lock is held."""
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, operation)
+        except BlockingIOError:
+            yield None
+            return
+        try:
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _git(path: str, *args: str) -> None:
+    subprocess.run(
+        ["git", f"--git-dir={path}"] + list(args),
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        encoding="utf-8",
+        timeout=4 * 60 + 30,
+    )
+
+
+def _get_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with contextlib.suppress(FileNotFoundError):
+                size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+@contextlib.contextmanager
+def use(git: utils.Gitter, repo_full_name: str) -> typing.Iterator[bool]:
+    """Make an initialized Gitter borrow the objects of the repository mirror.
+
+    Yield whether a mirror is used. When the mirror is used, the caller should
+    not do shallow fetches: the missing objects only are fetched.
+    """
+    if not config.GIT_MIRRORS_DIR:
+        yield False
+        return
+
+    path = _get_mirror_path(repo_full_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _lock(f"{path}.use", fcntl.LOCK_SH):
+        with _lock(f"{path}.update", fcntl.LOCK_EX):
+            if not os.path.isdir(path):
+                git.logger.info("creating git mirror: %s", path)
+                _git(path, "init", "--quiet", "--bare")
+            with open(os.path.join(path, LAST_USED_FILE), "w"):
+                pass
+
+        with open(
+            os.path.join(git.tmp, ".git", "objects", "info", "alternates"), "w"
+        ) as f:
+            f.write(os.path.join(path, "objects") + "\n")
+
+        try:
+            yield True
+        finally:
+            try:
+                with _lock(f"{path}.update", fcntl.LOCK_EX):
+                    _git(
+                        path,
+                        "fetch",
+                        "--quiet",
+                        "--no-tags",
+                        git.tmp,
+                        "+refs/remotes/*:refs/remotes/*",
+                    )
+            except subprocess.CalledProcessError as e:
+                git.logger.warning("fail to save objects in git mirror: %s", e.output)
+
+    evict(exclude=path)
+
+
+def evict(exclude: typing.Optional[str] = None) -> None:
+    """Remove the least recently used mirrors until the cache fits its size."""
+    mirrors_dir = typing.cast(str, config.GIT_MIRRORS_DIR)
+    mirrors = []
+    for owner in os.listdir(mirrors_dir):
+        owner_dir = os.path.join(mirrors_dir, owner)
+        if not os.path.isdir(owner_dir):
+            continue
+        for name in os.listdir(owner_dir):
+            path = os.path.join(owner_dir, name)
+            if name.endswith(".git") and os.path.isdir(path):
+                try:
+                    last_used = os.path.getmtime(os.path.join(path, LAST_USED_FILE))
+                except FileNotFoundError:
+                    last_used = 0
+                mirrors.append((last_used, path, _get_size(path)))
+
+    total_size = sum(size for _, _, size in mirrors)
+    statsd.gauge("engine.git_mirrors.size", total_size)
+    max_size = config.GIT_MIRRORS_MAX_SIZE_MB * 1024 * 1024
+    for _, path, size in sorted(mirrors):
+        if total_size <= max_size:
+            break
+        if path == exclude:
+            continue
+        with _lock(f"{path}.use", fcntl.LOCK_EX | fcntl.LOCK_NB) as locked:
+            if locked is None:
+                continue
+            LOG.info("evicting git mirror", path=path, size=size)
+            shutil.rmtree(path)
+            total_size -= size
+            statsd.increment("engine.git_mirrors.evicted")
@@ -15,6 +15,7 @@
 # under the License.
 
 import dataclasses
+import itertools
 import typing
 import uuid
 
@@ -23,14 +24,20 @@ import daiquiri
 from datadog import statsd
 
 from mergify_engine import check_api
+from mergify_engine import checks_store
 from mergify_engine import config
 from mergify_engine import context
 from mergify_engine import engine
 from mergify_engine import exceptions
 from mergify_engine import github_types
+from mergify_engine import labels_store
+from mergify_engine import opened_pulls
+from mergify_engine import pull_snapshots
+from mergify_engine import rules
 from mergify_engine import utils
 from mergify_engine import worker
 from mergify_engine.clients import github
+from mergify_engine.clients import github_app
 from mergify_engine.engine import commands_runner
 
 
@@ -103,6 +110,16 @@ class IgnoredEvent(Exception):
     reason: str
 
 
+def _push_touches_mergify_config(event: github_types.GitHubEventPush) -> bool:
+    for commit in event.get("commits", []):
+        for filename in itertools.chain(
+            commit["added"], commit["removed"], commit["modified"]
+        ):
+            if filename in rules.MERGIFY_CONFIG_FILENAMES:
+                return True
+    return False
+
+
 def _log_on_exception(exc: Exception, msg: str) -> None:
     if exceptions.should_be_ignored(exc) or exceptions.need_retry(exc):
         log = LOG.debug
@@ -111,6 +128,60 @@ def _log_on_exception(exc: Exception, msg: str) -> None:
     log(msg, exc_info=exc)
 
 
+async def _store_status(
+    owner: str, repo: str, event: github_types.GitHubEventStatus
+) -> None:
+    status = github_types.GitHubStatus(
+        {
+            "id": event["id"],
+            "context": event["context"],
+            "state": event["state"],
+            "description": event["description"],
+            "target_url": event["target_url"],
+            "created_at": event["created_at"],
+            "updated_at": event["updated_at"],
+        }
+    )
+    try:
+        await checks_store.astore(
+            await utils.get_aredis_for_cache(),
+            checks_store.STATUSES,
+            owner,
+            repo,
+            event["sha"],
+            [typing.cast(typing.Dict[str, typing.Any], status)],
+        )
+    except Exception as e:
+        _log_on_exception(e, "fail to store the status")
+
+
+async def _store_check_run(
+    owner: str, repo: str, event: github_types.GitHubEventCheckRun
+) -> None:
+    try:
+        await checks_store.astore(
+            await utils.get_aredis_for_cache(),
+            checks_store.CHECK_RUNS,
+            owner,
+            repo,
+            event["check_run"]["head_sha"],
+            [typing.cast(typing.Dict[str, typing.Any], event["check_run"])],
+        )
+    except Exception as e:
+        _log_on_exception(e, "fail to store the check run")
+
+
+async def _store_label(
+    owner: str, repo: str, event: github_types.GitHubEventLabel
+) -> None:
+    try:
+        await labels_store.astore(
+            await utils.get_aredis_for_cache(), owner, repo, event
+        )
+    except Exception as e:
+        _log_on_exception(e, "fail to store the label")
+
+
 async def filter_and_dispatch(
     redis: aredis.StrictRedis,
     event_type: github_types.GitHubEventType,
@@ -132,11 +203,37 @@ async def filter_and_dispatch(
         if event["repository"]["archived"]:
             ignore_reason = "repository archived"
 
-        elif event["action"] in ("opened", "synchronize"):
+        else:
+            redis_cache = await utils.get_aredis_for_cache()
             try:
-                await engine.create_initial_summary(event)
+                await opened_pulls.update(redis_cache, event["pull_request"])
             except Exception as e:
-                _log_on_exception(e, "fail to create initial summary")
+                _log_on_exception(e, "fail to update the opened pulls index")
+
+            try:
+                await pull_snapshots.store(
+                    redis_cache, owner_login, repo_name, event["pull_request"]
+                )
+            except Exception as e:
+                _log_on_exception(e, "fail to store the pull request snapshot")
+
+            # NOTE: GitHub has computed the mergeable_state, no need to wait
+            # for the delay of the pull request anymore
+            if config.MERGEABLE_STATE_REQUEUE_DELAY and pull_snapshots.is_complete(
+                event["pull_request"]
+            ):
+                try:
+                    await worker.requeue_delayed_pull(
+                        redis, owner_login, repo_name, pull_number
+                    )
+                except Exception as e:
+                    _log_on_exception(e, "fail to requeue the delayed pull request")
+
+            if event["action"] in ("opened", "synchronize"):
+                try:
+                    await engine.create_initial_summary(event)
+                except Exception as e:
+                    _log_on_exception(e, "fail to create initial summary")
 
     elif event_type == "refresh":
         event = typing.cast(github_types.GitHubEventRefresh, event)
@@ -193,6 +290,8 @@ async def filter_and_dispatch(
 
         if event["repository"]["archived"]:
             ignore_reason = "repository archived"
+        else:
+            await _store_status(owner_login, repo_name, event)
 
     elif event_type == "push":
         event = typing.cast(github_types.GitHubEventPush, event)
@@ -208,6 +307,9 @@ async def filter_and_dispatch(
         elif event["repository"]["archived"]:  # pragma: no cover
             ignore_reason = "repository archived"
 
+        if _push_touches_mergify_config(event):
+            rules.clear_config_cache(owner_login, repo_name)
+
     elif event_type == "check_suite":
         event = typing.cast(github_types.GitHubEventCheckSuite, event)
         owner_login = event["repository"]["owner"]["login"]
@@ -233,8 +335,10 @@ async def filter_and_dispatch(
 
         if event["repository"]["archived"]:
             ignore_reason = "repository archived"
+        else:
+            await _store_check_run(owner_login, repo_name, event)
 
-        elif (
+        if ignore_reason is None and (
             event[event_type]["app"]["id"] == config.INTEGRATION_ID
             and event["action"] != "rerequested"
             and event[event_type].get("external_id") != check_api.USER_CREATED_CHECKS
@@ -250,6 +354,9 @@ async def filter_and_dispatch(
         if event["action"] in ("deleted", "member_added", "member_removed"):
             context.Context.clear_user_permission_cache_for_org(event["organization"])
 
+        if event["action"] in ("deleted", "member_removed"):
+            context.Context.clear_team_members_cache_for_org(event["organization"])
+
     elif event_type == "member":
         event = typing.cast(github_types.GitHubEventMember, event)
         owner_login = event["repository"]["owner"]["login"]
@@ -269,6 +376,9 @@ async def filter_and_dispatch(
         ignore_reason = "membership event"
 
         context.Context.clear_user_permission_cache_for_org(event["organization"])
+        context.Context.clear_team_members_cache_for_team(
+            event["organization"], event["team"]
+        )
 
     elif event_type == "team":
         event = typing.cast(github_types.GitHubEventTeam, event)
@@ -276,6 +386,11 @@ async def filter_and_dispatch(
         repo_name = None
         ignore_reason = "team event"
 
+        if event["action"] in ("edited", "deleted"):
+            context.Context.clear_team_members_cache_for_team(
+                event["organization"], event["team"]
+            )
+
         if event["action"] in (
             "edited",
             "added_to_repository",
@@ -300,6 +415,22 @@ async def filter_and_dispatch(
             event["repository"]["owner"], event["repository"]
         )
 
+    elif event_type == "label":
+        event = typing.cast(github_types.GitHubEventLabel, event)
+        owner_login = event["repository"]["owner"]["login"]
+        repo_name = event["repository"]["name"]
+        ignore_reason = "label event"
+
+        await _store_label(owner_login, repo_name, event)
+
+    elif event_type in ("installation", "installation_repositories"):
+        event = typing.cast(github_types.GitHubEventInstallation, event)
+        owner_login = event["installation"]["account"]["login"]
+        repo_name = None
+        ignore_reason = f"{event_type} event"
+
+        await github_app.invalidate_installation_cache(owner_login)
+
     else:
         owner_login = "<unknown>"
         repo_name = "<unknown>"
@@ -334,9 +465,6 @@ async def filter_and_dispatch(
         raise IgnoredEvent(event_type, event_id, ignore_reason)
 
 
-SHA_EXPIRATION = 60
-
-
 async def _get_github_pulls_from_sha(
     client: github.AsyncGithubInstallationClient,
     repo_name: str,
@@ -344,16 +472,13 @@ async def _get_github_pulls_from_sha(
     pulls: typing.List[github_types.GitHubPullRequest],
 ) -> typing.List[github_types.GitHubPullRequestNumber]:
     redis = await utils.get_aredis_for_cache()
-    cache_key = f"sha~{client.auth.owner}~{repo_name}~{sha}"
-    pull_number = await redis.get(cache_key)
-    if pull_number is None:
-        for pull in pulls:
-            if pull["head"]["sha"] == sha:
-                await redis.set(cache_key, pull["number"], ex=SHA_EXPIRATION)
-                return [pull["number"]]
-        return []
-    else:
-        return [typing.cast(github_types.GitHubPullRequestNumber, int(pull_number))]
+    pull_numbers = await opened_pulls.get_pull_numbers_for_sha(
+        redis, client.auth.owner, repo_name, sha
+    )
+    if pull_numbers:
+        return pull_numbers
+    # NOTE: the index may have been built before it tracked the shas
+    return [pull["number"] for pull in pulls if pull["head"]["sha"] == sha]
 
 
 async def extract_pull_numbers_from_event(
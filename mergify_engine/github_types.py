@@ -272,16 +272,49 @@ class GitHubEventIssueComment(GitHubEvent):
     comment: GitHubComment
 
 
+class GitHubEventPushCommit(typing.TypedDict):
+    id: SHAType
+    added: typing.List[str]
+    removed: typing.List[str]
+    modified: typing.List[str]
+
+
 class GitHubEventPush(GitHubEvent):
     repository: GitHubRepository
     ref: GitHubRefType
     before: SHAType
     after: SHAType
+    commits: typing.List[GitHubEventPushCommit]
+
+
+GitHubStatusState = typing.Literal[
+    "pending",
+    "success",
+    "failure",
+    "error",
+]
+
+
+class GitHubStatus(typing.TypedDict):
+    id: int
+    context: str
+    state: GitHubStatusState
+    description: typing.Optional[str]
+    target_url: typing.Optional[str]
+    created_at: ISODateTimeType
+    updated_at: ISODateTimeType
 
 
 class GitHubEventStatus(GitHubEvent):
     repository: GitHubRepository
     sha: SHAType
+    id: int
+    context: str
+    state: GitHubStatusState
+    description: typing.Optional[str]
+    target_url: typing.Optional[str]
+    created_at: ISODateTimeType
+    updated_at: ISODateTimeType
 
 
 class GitHubApp(typing.TypedDict):
@@ -378,11 +411,32 @@ class GitHubEventMember(GitHubEvent):
     repository: GitHubRepository
 
 
+GitHubEventLabelActionType = typing.Literal["created", "edited", "deleted"]
+
+
+class GitHubEventLabelChanges(typing.TypedDict, total=False):
+    name: typing.Dict[typing.Literal["from"], str]
+    color: typing.Dict[typing.Literal["from"], str]
+
+
+class GitHubEventLabel(GitHubEvent):
+    action: GitHubEventLabelActionType
+    repository: GitHubRepository
+    label: GitHubLabel
+    changes: GitHubEventLabelChanges
+
+
 GitHubEventMembershipActionType = typing.Literal["added", "removed"]
 
 
+class GitHubTeam(typing.TypedDict):
+    id: int
+    slug: str
+
+
 class GitHubEventMembership(GitHubEvent):
     action: GitHubEventMembershipActionType
+    team: GitHubTeam
 
 
 GitHubEventTeamActionType = typing.Literal[
@@ -397,6 +451,23 @@ GitHubEventTeamActionType = typing.Literal[
 class GitHubEventTeam(GitHubEvent):
     action: GitHubEventTeamActionType
     repository: typing.Optional[GitHubRepository]
+    team: GitHubTeam
+
+
+GitHubEventInstallationActionType = typing.Literal[
+    "created",
+    "deleted",
+    "suspend",
+    "unsuspend",
+    "new_permissions_accepted",
+    "added",
+    "removed",
+]
+
+
+class GitHubEventInstallation(GitHubEvent):
+    # Used for installation and installation_repositories events
+    action: GitHubEventInstallationActionType
 
 
 class GitHubEventTeamAdd(GitHubEvent, total=False):
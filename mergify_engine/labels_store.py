@@ -0,0 +1,114 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import typing
+
+import aredis
+from datadog import statsd
+
+from mergify_engine import config
+from mergify_engine import context
+from mergify_engine import github_types
+from mergify_engine import utils
+
+
+# Store of the label names of a repository.
+#
+# The store is filled by a listing of the labels done by the engine, then kept
+# up to date by the label webhooks. It expires in case some webhooks are lost.
+
+STORE_EXPIRATION = 60 * 60 * 24  # 1 day
+
+
+def _get_keys(owner: str, repo: str) -> typing.Tuple[str, str]:
+    return f"labels~{owner}~{repo}", f"labels-synced~{owner}~{repo}"
+
+
+def get_names(ctxt: context.Context) -> typing.Set[str]:
+    """Return the label names of the repository of the pull request."""
+    owner = ctxt.pull["base"]["user"]["login"]
+    repo = ctxt.pull["base"]["repo"]["name"]
+
+    if config.LABELS_STORE:
+        items_key, synced_key = _get_keys(owner, repo)
+        with utils.get_redis_for_cache() as redis:
+            with redis.pipeline() as pipe:
+                pipe.exists(synced_key)
+                pipe.smembers(items_key)
+                synced, stored_names = pipe.execute()
+        if synced:
+            statsd.increment("engine.labels_store.hit")
+            return typing.cast(typing.Set[str], stored_names)
+        statsd.increment("engine.labels_store.miss")
+
+    names = {
+        label["name"]
+        for label in typing.cast(
+            typing.Iterable[github_types.GitHubLabel],
+            ctxt.client.items(f"{ctxt.base_url}/labels"),
+        )
+    }
+
+    if config.LABELS_STORE:
+        with utils.get_redis_for_cache() as redis:
+            with redis.pipeline() as pipe:
+                pipe.delete(items_key)
+                if names:
+                    pipe.sadd(items_key, *names)
+                    pipe.expire(items_key, STORE_EXPIRATION)
+                pipe.set(synced_key, "1", ex=STORE_EXPIRATION)
+                pipe.execute()
+
+    return names
+
+
+def add(ctxt: context.Context, name: str) -> None:
+    """Add a label created by the engine."""
+    if not config.LABELS_STORE:
+        return
+
+    items_key, _ = _get_keys(
+        ctxt.pull["base"]["user"]["login"], ctxt.pull["base"]["repo"]["name"]
+    )
+    with utils.get_redis_for_cache() as redis:
+        with redis.pipeline() as pipe:
+            pipe.sadd(items_key, name)
+            pipe.expire(items_key, STORE_EXPIRATION)
+            pipe.execute()
+
+
+async def astore(
+    redis: aredis.StrictRedis,
+    owner: str,
+    repo: str,
+    event: github_types.GitHubEventLabel,
+) -> None:
+    if not config.LABELS_STORE:
+        return
+
+    items_key, _ = _get_keys(owner, repo)
+    name = event["label"]["name"]
+    pipe = await redis.pipeline()
+    if event["action"] == "created":
+        await pipe.sadd(items_key, name)
+    elif event["action"] == "deleted":
+        await pipe.srem(items_key, name)
+    elif event["action"] == "edited":
+        old_name = event.get("changes", {}).get("name", {}).get("from")
+        if old_name is not None:
+            await pipe.srem(items_key, old_name)
+        await pipe.sadd(items_key, name)
+    await pipe.expire(items_key, STORE_EXPIRATION)
+    await pipe.execute()
@@ -0,0 +1,180 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import json
+import typing
+
+import aredis
+from datadog import statsd
+
+from mergify_engine import github_types
+from mergify_engine.clients import github
+
+
+# The index is fully rebuilt from the GitHub API when it is older than that,
+# to catch up the webhooks that have been missed.
+RECONCILIATION_INTERVAL = 60 * 60  # 1 hour
+# Drop the index of repositories that do not receive any events anymore
+OPENED_PULLS_EXPIRATION = 60 * 60 * 24 * 7  # 1 week
+
+
+def get_opened_pulls_key(owner: str, repo: str) -> str:
+    return f"opened-pulls~{owner}~{repo}"
+
+
+def get_reconciliation_key(owner: str, repo: str) -> str:
+    return f"opened-pulls-reconciled~{owner}~{repo}"
+
+
+def get_pulls_by_sha_key(owner: str, repo: str, sha: github_types.SHAType) -> str:
+    return f"pulls-by-sha~{owner}~{repo}~{sha}"
+
+
+def _slim_pull(
+    pull: github_types.GitHubPullRequest,
+) -> github_types.GitHubPullRequest:
+    head_repo = pull["head"]["repo"]
+    return typing.cast(
+        github_types.GitHubPullRequest,
+        {
+            "number": pull["number"],
+            "state": pull["state"],
+            "base": {
+                "ref": pull["base"]["ref"],
+                "repo": {
+                    "id": pull["base"]["repo"]["id"],
+                    "name": pull["base"]["repo"]["name"],
+                    "owner": {
+                        "id": pull["base"]["repo"]["owner"]["id"],
+                        "login": pull["base"]["repo"]["owner"]["login"],
+                    },
+                },
+            },
+            "head": {
+                "ref": pull["head"]["ref"],
+                "sha": pull["head"]["sha"],
+                # NOTE: the head repository is None when the fork has been deleted
+                "repo": None
+                if head_repo is None
+                else {"id": head_repo["id"], "full_name": head_repo["full_name"]},
+            },
+        },
+    )
+
+
+# The previous head sha of the pull request is read from the index, so a
+# synchronize or a close also removes the pull request from its old sha.
+UPDATE_SCRIPT = """
+local opened_pulls_key = KEYS[1]
+local pull_number = ARGV[1]
+local pull = ARGV[2]
+local sha = ARGV[3]
+local pulls_by_sha_key_prefix = ARGV[4]
+local expiration = ARGV[5]
+
+local previous_pull = redis.call("HGET", opened_pulls_key, pull_number)
+if previous_pull then
+    local previous_sha = cjson.decode(previous_pull)["head"]["sha"]
+    redis.call("SREM", pulls_by_sha_key_prefix .. previous_sha, pull_number)
+end
+
+local pulls_by_sha_key = pulls_by_sha_key_prefix .. sha
+if pull == "" then
+    redis.call("HDEL", opened_pulls_key, pull_number)
+    redis.call("SREM", pulls_by_sha_key, pull_number)
+else
+    redis.call("HSET", opened_pulls_key, pull_number, pull)
+    redis.call("SADD", pulls_by_sha_key, pull_number)
+    redis.call("EXPIRE", pulls_by_sha_key, expiration)
+end
+redis.call("EXPIRE", opened_pulls_key, expiration)
+"""
+
+
+async def update(
+    redis: aredis.StrictRedis, pull: github_types.GitHubPullRequest
+) -> None:
+    """Update the index from the pull request of a `pull_request` event."""
+    owner = pull["base"]["repo"]["owner"]["login"]
+    repo = pull["base"]["repo"]["name"]
+    await redis.eval(
+        UPDATE_SCRIPT,
+        1,
+        get_opened_pulls_key(owner, repo),
+        pull["number"],
+        json.dumps(_slim_pull(pull)) if pull["state"] == "open" else "",
+        pull["head"]["sha"],
+        get_pulls_by_sha_key(owner, repo, github_types.SHAType("")),
+        OPENED_PULLS_EXPIRATION,
+    )
+
+
+async def reconcile(
+    redis: aredis.StrictRedis,
+    client: github.AsyncGithubInstallationClient,
+    repo: str,
+) -> typing.List[github_types.GitHubPullRequest]:
+    """Rebuild the index of a repository from the GitHub API."""
+    owner = client.auth.owner
+    statsd.increment("engine.opened_pulls.reconciliation")
+    pulls = [_slim_pull(p) async for p in client.items(f"/repos/{owner}/{repo}/pulls")]
+
+    key = get_opened_pulls_key(owner, repo)
+    previous_pulls = [json.loads(p) for p in await redis.hvals(key)]
+    pipe = await redis.pipeline()
+    for p in previous_pulls:
+        await pipe.delete(get_pulls_by_sha_key(owner, repo, p["head"]["sha"]))
+    await pipe.delete(key)
+    if pulls:
+        await pipe.hmset(key, {p["number"]: json.dumps(p) for p in pulls})
+        await pipe.expire(key, OPENED_PULLS_EXPIRATION)
+    for p in pulls:
+        pulls_by_sha_key = get_pulls_by_sha_key(owner, repo, p["head"]["sha"])
+        await pipe.sadd(pulls_by_sha_key, p["number"])
+        await pipe.expire(pulls_by_sha_key, OPENED_PULLS_EXPIRATION)
+    await pipe.set(get_reconciliation_key(owner, repo), "1", ex=RECONCILIATION_INTERVAL)
+    await pipe.execute()
+    return pulls
+
+
+async def get(
+    redis: aredis.StrictRedis,
+    client: github.AsyncGithubInstallationClient,
+    repo: str,
+) -> typing.List[github_types.GitHubPullRequest]:
+    """Return the opened pull requests of a repository, newest first.
+
+    The returned pull requests only contain the number, the state, the base
+    and the head of the pull request.
+    """
+    owner = client.auth.owner
+    if not await redis.exists(get_reconciliation_key(owner, repo)):
+        return await reconcile(redis, client, repo)
+
+    pulls = [
+        typing.cast(github_types.GitHubPullRequest, json.loads(p))
+        for p in await redis.hvals(get_opened_pulls_key(owner, repo))
+    ]
+    return sorted(pulls, key=lambda p: p["number"], reverse=True)
+
+
+async def get_pull_numbers_for_sha(
+    redis: aredis.StrictRedis, owner: str, repo: str, sha: github_types.SHAType
+) -> typing.List[github_types.GitHubPullRequestNumber]:
+    """Return the opened pull requests whose head is `sha`, forks included."""
+    return sorted(
+        typing.cast(github_types.GitHubPullRequestNumber, int(number))
+        for number in await redis.smembers(get_pulls_by_sha_key(owner, repo, sha))
+    )
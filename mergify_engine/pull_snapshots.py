@@ -0,0 +1,124 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import json
+import time
+import typing
+
+import aredis
+from datadog import statsd
+
+from mergify_engine import config
+from mergify_engine import context
+from mergify_engine import github_types
+
+
+# Latest known version of each pull request, from the pull_request webhooks
+# and from the pull requests retrieved by the worker.
+
+SNAPSHOT_EXPIRATION = 60 * 60 * 24  # 1 day
+
+# Events that can't change the pull request without a pull_request event
+# being sent too. Check runs, statuses, reviews and pushes on the base branch
+# change the mergeable_state, so they always need a fresh pull request.
+SNAPSHOT_EVENT_TYPES = (
+    "pull_request",
+    "pull_request_review_comment",
+    "issue_comment",
+)
+
+# Snapshots are versioned by `updated_at`: an older version never replaces a
+# newer one.
+STORE_SCRIPT = """
+local previous_updated_at = redis.call("HGET", KEYS[1], "updated_at")
+if previous_updated_at and previous_updated_at > ARGV[1] then
+    return 0
+end
+redis.call("HSET", KEYS[1], "updated_at", ARGV[1], "stored_at", ARGV[2], "pull", ARGV[3])
+redis.call("EXPIRE", KEYS[1], ARGV[4])
+return 1
+"""
+
+
+def get_pull_snapshot_key(owner: str, repo: str, pull_number: int) -> str:
+    return f"pull-snapshot~{owner}~{repo}~{pull_number}"
+
+
+def is_complete(pull: github_types.GitHubPullRequest) -> bool:
+    for field in ("state", "mergeable_state", "merged_by", "merged", "merged_at"):
+        if field not in pull:
+            return False
+    return pull["state"] == "closed" or pull["mergeable_state"] not in (
+        "unknown",
+        None,
+    )
+
+
+async def store(
+    redis: aredis.StrictRedis,
+    owner: str,
+    repo: str,
+    pull: github_types.GitHubPullRequest,
+) -> None:
+    if not config.PULL_SNAPSHOT_MAX_AGE:
+        return
+
+    updated_at = typing.cast(typing.Dict[str, typing.Any], pull).get("updated_at")
+    if updated_at is None:
+        return
+
+    await redis.eval(
+        STORE_SCRIPT,
+        1,
+        get_pull_snapshot_key(owner, repo, pull["number"]),
+        updated_at,
+        time.time(),
+        json.dumps(pull),
+        SNAPSHOT_EXPIRATION,
+    )
+
+
+async def get(
+    redis: aredis.StrictRedis,
+    owner: str,
+    repo: str,
+    pull_number: int,
+    sources: typing.List[context.T_PayloadEventSource],
+) -> typing.Optional[github_types.GitHubPullRequest]:
+    """Return the snapshot of the pull request if it can replace the API.
+
+    The snapshot must be younger than PULL_SNAPSHOT_MAX_AGE, have a known
+    mergeable_state, and the events to process must not have changed it.
+    """
+    if not config.PULL_SNAPSHOT_MAX_AGE or not sources:
+        return None
+
+    if any(s["event_type"] not in SNAPSHOT_EVENT_TYPES for s in sources):
+        return None
+
+    stored_at, pull = await redis.hmget(
+        get_pull_snapshot_key(owner, repo, pull_number), "stored_at", "pull"
+    )
+    if pull is None or time.time() - float(stored_at) > config.PULL_SNAPSHOT_MAX_AGE:
+        statsd.increment("engine.pull_snapshots.miss")
+        return None
+
+    snapshot = typing.cast(github_types.GitHubPullRequest, json.loads(pull))
+    if not is_complete(snapshot):
+        statsd.increment("engine.pull_snapshots.miss")
+        return None
+
+    statsd.increment("engine.pull_snapshots.hit")
+    return snapshot
@@ -13,11 +13,14 @@
 # under the License.
 import dataclasses
 import logging
+import threading
 import typing
 
+import aredis
 import daiquiri
 import redis
 
+from mergify_engine import config
 from mergify_engine import context
 from mergify_engine import github_events
 from mergify_engine import github_types
@@ -27,6 +30,24 @@ from mergify_engine import utils
 
 LOG = daiquiri.getLogger(__name__)
 
+# NOTE: With QUEUE_REFRESH_BATCHING, the refreshes of the queued pull requests
+# are collected here by the engine threads and the worker pushes them in a
+# single batch once the stream has been consumed. A pull request refreshed by
+# many queue changes is refreshed only once.
+_PENDING_REFRESHES_LOCK = threading.Lock()
+_PENDING_REFRESHES: typing.Set[
+    typing.Tuple[str, str, github_types.GitHubPullRequestNumber]
+] = set()
+
+
+def pop_pending_refreshes() -> typing.List[
+    typing.Tuple[str, str, github_types.GitHubPullRequestNumber]
+]:
+    with _PENDING_REFRESHES_LOCK:
+        refreshes = sorted(_PENDING_REFRESHES)
+        _PENDING_REFRESHES.clear()
+    return refreshes
+
 
 class QueueConfig(typing.TypedDict):
     strict_method: typing.Literal["merge", "rebase", "squash"]
@@ -36,6 +57,95 @@ class QueueConfig(typing.TypedDict):
     update_bot_account: typing.Optional[str]
 
 
+DEFAULT_QUEUE_CONFIG = QueueConfig(
+    {
+        "strict_method": "merge",
+        "priority": 2000,
+        "effective_priority": 2000,
+        "bot_account": None,
+        "update_bot_account": None,
+    }
+)
+
+
+def get_redis_queue_key(owner_id: int, repo_id: int, ref: str) -> str:
+    return f"merge-queue~{owner_id}~{repo_id}~{ref}"
+
+
+def get_redis_queue_configs_key(owner_id: int, repo_id: int, ref: str) -> str:
+    return f"merge-queue-configs~{owner_id}~{repo_id}~{ref}"
+
+
+# NOTE: Indexes of the queues, so we never have to scan the keyspace:
+# * the queues of an owner, as `{repo_id}~{ref}` members
+# * the refs of the queues where a pull request is
+def get_redis_owner_queues_key(owner_id: int) -> str:
+    return f"merge-queues~{owner_id}"
+
+
+def get_redis_pull_queues_key(
+    owner_id: int, repo_id: int, pull_number: github_types.GitHubPullRequestNumber
+) -> str:
+    return f"merge-queues-of-pull~{owner_id}~{repo_id}~{pull_number}"
+
+
+QUEUES_INDEX_MIGRATED_KEY = "merge-queues-indexed"
+
+
+def _load_config(config_str: typing.Optional[str]) -> QueueConfig:
+    if config_str is None:
+        return DEFAULT_QUEUE_CONFIG.copy()
+    config: QueueConfig = json.loads(config_str)
+    # TODO(sileht): for compatibility purpose, we can drop that in a couple of week
+    config.setdefault("effective_priority", config["priority"])
+    config.setdefault("bot_account", None)
+    config.setdefault("update_bot_account", None)
+    return config
+
+
+# The configurations of the queued pull requests are stored in a hash next to
+# the sorted set of the queue, both are always updated together, with the
+# indexes of the queues.
+ADD_PULL_SCRIPT = """
+local queue_key = KEYS[1]
+local configs_key = KEYS[2]
+local pull_queues_key = KEYS[3]
+local owner_queues_key = KEYS[4]
+local pull_number = ARGV[1]
+local score = ARGV[2]
+local config = ARGV[3]
+local ref = ARGV[4]
+local queue_name = ARGV[5]
+
+redis.call("HSET", configs_key, pull_number, config)
+redis.call("SADD", pull_queues_key, ref)
+redis.call("SADD", owner_queues_key, queue_name)
+return redis.call("ZADD", queue_key, "NX", score, pull_number)
+"""
+
+REMOVE_PULL_SCRIPT = """
+local queue_key = KEYS[1]
+local configs_key = KEYS[2]
+local legacy_config_key = KEYS[3]
+local pull_queues_key = KEYS[4]
+local owner_queues_key = KEYS[5]
+local pull_number = ARGV[1]
+local ref = ARGV[2]
+local queue_name = ARGV[3]
+
+local removed = redis.call("ZREM", queue_key, pull_number)
+if removed > 0 then
+    redis.call("HDEL", configs_key, pull_number)
+    redis.call("DEL", legacy_config_key)
+end
+redis.call("SREM", pull_queues_key, ref)
+if redis.call("EXISTS", queue_key) == 0 then
+    redis.call("SREM", owner_queues_key, queue_name)
+end
+return removed
+"""
+
+
 @dataclasses.dataclass
 class Queue:
     redis: redis.Redis
@@ -68,9 +178,28 @@ class Queue:
         return self._get_redis_queue_key_for(self.ref)
 
     def _get_redis_queue_key_for(self, ref: str) -> str:
-        return f"merge-queue~{self.owner_id}~{self.repo_id}~{ref}"
+        return get_redis_queue_key(self.owner_id, self.repo_id, ref)
 
-    def _config_redis_queue_key(
+    @property
+    def _redis_queue_configs_key(self) -> str:
+        return get_redis_queue_configs_key(self.owner_id, self.repo_id, self.ref)
+
+    @property
+    def _redis_owner_queues_key(self) -> str:
+        return get_redis_owner_queues_key(self.owner_id)
+
+    @property
+    def _queue_name(self) -> str:
+        return f"{self.repo_id}~{self.ref}"
+
+    def _redis_pull_queues_key(
+        self, pull_number: github_types.GitHubPullRequestNumber
+    ) -> str:
+        return get_redis_pull_queues_key(self.owner_id, self.repo_id, pull_number)
+
+    # NOTE: Configurations used to be stored in one key per pull request,
+    # they are still read for pull requests queued before the hash existed.
+    def _legacy_config_redis_queue_key(
         self, pull_number: github_types.GitHubPullRequestNumber
     ) -> str:
         return f"merge-config~{self.owner_id}~{self.repo_id}~{pull_number}"
@@ -84,37 +213,60 @@ class Queue:
 
         :param pull_number: The pull request number.
         """
-        config_str = self.redis.get(self._config_redis_queue_key(pull_number))
-        if config_str is None:
-            # TODO(sileht): Everything about queue should be done in redis transaction
-            # e.g.: add/update/get/del of a pull in queue
-            return QueueConfig(
-                {
-                    "strict_method": "merge",
-                    "priority": 2000,
-                    "effective_priority": 2000,
-                    "bot_account": None,
-                    "update_bot_account": None,
-                }
+        return self.get_configs([pull_number])[pull_number]
+
+    def get_configs(
+        self, pull_numbers: typing.List[github_types.GitHubPullRequestNumber]
+    ) -> typing.Dict[github_types.GitHubPullRequestNumber, QueueConfig]:
+        """Return merge configs of many pull requests in one round trip.
+
+        Do not use it for logic, just for displaying the queue summary.
+
+        :param pull_numbers: The pull request numbers.
+        """
+        if not pull_numbers:
+            return {}
+
+        configs_str = dict(
+            zip(
+                pull_numbers,
+                self.redis.hmget(
+                    self._redis_queue_configs_key, [str(p) for p in pull_numbers]
+                ),
+            )
+        )
+        legacy_pull_numbers = [p for p, c in configs_str.items() if c is None]
+        if legacy_pull_numbers:
+            configs_str.update(
+                zip(
+                    legacy_pull_numbers,
+                    self.redis.mget(
+                        [
+                            self._legacy_config_redis_queue_key(p)
+                            for p in legacy_pull_numbers
+                        ]
+                    ),
+                )
             )
-        config: QueueConfig = json.loads(config_str)
-        # TODO(sileht): for compatibility purpose, we can drop that in a couple of week
-        config.setdefault("effective_priority", config["priority"])
-        config.setdefault("bot_account", None)
-        config.setdefault("update_bot_account", None)
-        return config
+        return {p: _load_config(c) for p, c in configs_str.items()}
 
     def add_pull(self, ctxt: context.Context, config: QueueConfig) -> None:
         self._remove_pull_from_other_queues(ctxt)
 
-        self.redis.set(
-            self._config_redis_queue_key(ctxt.pull["number"]),
-            json.dumps(config),
-        )
-
+        pulls_before = self.get_pulls()
         score = utils.utcnow().timestamp() / config["effective_priority"]
-        added = self.redis.zadd(
-            self._redis_queue_key, {str(ctxt.pull["number"]): score}, nx=True
+        added = self.redis.eval(
+            ADD_PULL_SCRIPT,
+            4,
+            self._redis_queue_key,
+            self._redis_queue_configs_key,
+            self._redis_pull_queues_key(ctxt.pull["number"]),
+            self._redis_owner_queues_key,
+            ctxt.pull["number"],
+            score,
+            json.dumps(config),
+            self.ref,
+            self._queue_name,
         )
 
         if added:
@@ -123,10 +275,7 @@ class Queue:
                 gh_pull=ctxt.pull["number"],
                 config=config,
             )
-            pull_requests_to_refresh = [
-                p for p in self.get_pulls() if p != ctxt.pull["number"]
-            ]
-            self._refresh_pulls(pull_requests_to_refresh)
+            self._refresh_changed_pulls(pulls_before, ctxt.pull["number"])
         else:
             self.log.info(
                 "pull request already in merge queue",
@@ -135,29 +284,38 @@ class Queue:
             )
 
     def _remove_pull_from_other_queues(self, ctxt: context.Context) -> None:
-        # TODO(sileht): Find if there is an event when the base branch change to do this
-        # only is this case.
-        for queue_name in self.redis.keys(self._get_redis_queue_key_for("*")):
-            if queue_name != self._redis_queue_key:
-                score = self.redis.zscore(queue_name, ctxt.pull["number"])
-                if score is not None:
-                    old_branch = queue_name.split("~")[-1]
-                    old_queue = self.get_queue(old_branch)
-                    ctxt.log.info(
-                        "pull request base branch have changed, cleaning old queue",
-                        old_branch=old_branch,
-                        new_branch=ctxt.pull["base"]["ref"],
-                    )
-                    old_queue.remove_pull(ctxt)
+        # NOTE: a pull request can only be in the queue of another branch if
+        # its base branch has changed
+        refs = self.redis.smembers(self._redis_pull_queues_key(ctxt.pull["number"]))
+        for old_branch in typing.cast(typing.Set[str], refs):
+            if old_branch != self.ref:
+                old_queue = self.get_queue(old_branch)
+                ctxt.log.info(
+                    "pull request base branch have changed, cleaning old queue",
+                    old_branch=old_branch,
+                    new_branch=ctxt.pull["base"]["ref"],
+                )
+                old_queue.remove_pull(ctxt)
 
     def remove_pull(self, ctxt: context.Context) -> None:
-        removed = self.redis.zrem(self._redis_queue_key, ctxt.pull["number"])
+        pulls_before = self.get_pulls()
+        removed = self.redis.eval(
+            REMOVE_PULL_SCRIPT,
+            5,
+            self._redis_queue_key,
+            self._redis_queue_configs_key,
+            self._legacy_config_redis_queue_key(ctxt.pull["number"]),
+            self._redis_pull_queues_key(ctxt.pull["number"]),
+            self._redis_owner_queues_key,
+            ctxt.pull["number"],
+            self.ref,
+            self._queue_name,
+        )
         if removed > 0:
-            self.redis.delete(self._config_redis_queue_key(ctxt.pull["number"]))
             self.log.info(
                 "pull request removed from merge queue", gh_pull=ctxt.pull["number"]
             )
-            self._refresh_pulls(self.get_pulls())
+            self._refresh_changed_pulls(pulls_before, ctxt.pull["number"])
         else:
             self.log.info(
                 "pull request not in merge queue", gh_pull=ctxt.pull["number"]
@@ -175,18 +333,14 @@ class Queue:
         )
 
     def is_first_pull(self, ctxt: context.Context) -> bool:
-        pull_requests = self.get_pulls()
-        if not pull_requests:
+        first_pull = self.redis.zrange(self._redis_queue_key, 0, 0)
+        if not first_pull:
             ctxt.log.error("is_first_pull() called on empty queues")
             return True
-        return pull_requests[0] == ctxt.pull["number"]
+        return int(first_pull[0]) == ctxt.pull["number"]
 
     def get_position(self, ctxt: context.Context) -> typing.Optional[int]:
-        pulls = self.get_pulls()
-        try:
-            return pulls.index(ctxt.pull["number"])
-        except ValueError:
-            return None
+        return self.redis.zrank(self._redis_queue_key, str(ctxt.pull["number"]))
 
     def get_pulls(self) -> typing.List[github_types.GitHubPullRequestNumber]:
         return [
@@ -195,12 +349,37 @@ class Queue:
         ]
 
     def delete(self) -> None:
-        self.redis.delete(self._redis_queue_key)
+        with self.redis.pipeline() as pipe:
+            for pull_number in self.get_pulls():
+                pipe.srem(self._redis_pull_queues_key(pull_number), self.ref)
+            pipe.delete(self._redis_queue_key, self._redis_queue_configs_key)
+            pipe.srem(self._redis_owner_queues_key, self._queue_name)
+            pipe.execute()
+
+    def _refresh_changed_pulls(
+        self,
+        pulls_before: typing.List[github_types.GitHubPullRequestNumber],
+        changed_pull: github_types.GitHubPullRequestNumber,
+    ) -> None:
+        pulls = self.get_pulls()
+        if config.QUEUE_REFRESH_BATCHING:
+            # NOTE: only the pull requests whose position changed have a
+            # different summary to display, the new head of the queue included
+            positions_before = {p: i for i, p in enumerate(pulls_before)}
+            pulls = [p for i, p in enumerate(pulls) if positions_before.get(p) != i]
+        self._refresh_pulls([p for p in pulls if p != changed_pull])
 
     def _refresh_pulls(
         self,
         pull_requests_to_refresh: typing.List[github_types.GitHubPullRequestNumber],
     ) -> None:
+        if config.QUEUE_REFRESH_BATCHING:
+            with _PENDING_REFRESHES_LOCK:
+                _PENDING_REFRESHES.update(
+                    (self.owner, self.repo, pull) for pull in pull_requests_to_refresh
+                )
+            return
+
         for pull in pull_requests_to_refresh:
             utils.async_run(
                 github_events.send_refresh(
@@ -216,3 +395,28 @@ class Queue:
                     }  # type: ignore
                 )
             )
+
+
+async def migrate_queues_index(redis_cache: aredis.StrictRedis) -> None:
+    """Build the indexes of the queues created before they existed."""
+    if await redis_cache.exists(QUEUES_INDEX_MIGRATED_KEY):
+        return
+
+    migrated = 0
+    async for queue_key in redis_cache.scan_iter(match="merge-queue~*"):
+        _, owner_id, repo_id, ref = queue_key.split("~", 3)
+        pipe = await redis_cache.pipeline()
+        await pipe.sadd(get_redis_owner_queues_key(int(owner_id)), f"{repo_id}~{ref}")
+        for pull_number in await redis_cache.zrange(queue_key, 0, -1):
+            await pipe.sadd(
+                get_redis_pull_queues_key(
+                    int(owner_id),
+                    int(repo_id),
+                    typing.cast(github_types.GitHubPullRequestNumber, int(pull_number)),
+                ),
+                ref,
+            )
+        await pipe.execute()
+        migrated += 1
+    await redis_cache.set(QUEUES_INDEX_MIGRATED_KEY, "1")
+    LOG.info("merge queues indexed", count=migrated)
@@ -15,13 +15,17 @@
 # under the License.
 
 import base64
+import collections
+import copy
 import dataclasses
 import functools
 import itertools
 import operator
+import threading
 import typing
 
 import daiquiri
+from datadog import statsd
 import voluptuous
 import yaml
 
@@ -178,6 +182,16 @@ class PullRequestRules:
     def __iter__(self):
         return iter(self.rules)
 
+    def get_condition_attribute_names(self) -> typing.Set[str]:
+        return {
+            condition.get_attribute_name()
+            for rule in self.rules
+            for condition in rule.conditions
+        }
+
+    def get_action_names(self) -> typing.Set[str]:
+        return {name for rule in self.rules for name in rule.actions}
+
     def get_pull_request_rule(self, pull_request: context.Context) -> RulesEvaluator:
         return RulesEvaluator(self.rules, pull_request, EvaluatedRule, True)
 
@@ -310,25 +324,44 @@ MERGIFY_CONFIG_FILENAMES = [
 ]
 
 
+CONFIG_CACHE_EXPIRATION = 60 * 60 * 24 * 31  # ~ 1 Month
+PARSED_CONFIG_CACHE_SIZE = 128
+
+
 def get_config_location_cache_key(owner, repo):
     return f"config-location~{owner}~{repo}"
 
 
-def get_mergify_config_content(client, repo, ref=None):
-    """Get the Mergify configuration file content.
+def get_config_content_cache_key(owner, repo):
+    return f"config-content~{owner}~{repo}"
 
-    :return: The filename and its content.
+
+def clear_config_cache(owner, repo):
+    with utils.get_redis_for_cache() as redis:
+        redis.delete(
+            get_config_location_cache_key(owner, repo),
+            get_config_content_cache_key(owner, repo),
+        )
+
+
+def _get_mergify_config_file(client, repo, ref=None):
+    """Get the Mergify configuration file.
+
+    :return: The filename, its blob sha and its content.
     """
 
     config_location_cache = get_config_location_cache_key(client.auth.owner, repo)
+    config_content_cache = get_config_content_cache_key(client.auth.owner, repo)
 
-    kwargs = {}
+    params = {}
     if ref:
-        kwargs["ref"] = ref
+        params["ref"] = ref
         cached_filename = None
+        cached_content = {}
     else:
         with utils.get_redis_for_cache() as redis:
             cached_filename = redis.get(config_location_cache)
+            cached_content = redis.hgetall(config_content_cache)
 
     filenames = MERGIFY_CONFIG_FILENAMES.copy()
     if cached_filename:
@@ -336,29 +369,108 @@ def get_mergify_config_content(client, repo, ref=None):
         filenames.insert(0, cached_filename)
 
     for filename in filenames:
+        headers = {}
+        if cached_content.get("filename") == filename:
+            headers["If-None-Match"] = cached_content["etag"]
+
         try:
-            content = client.item(
-                f"/repos/{client.auth.owner}/{repo}/contents/{filename}", **kwargs
-            )["content"]
+            response = client.get(
+                f"/repos/{client.auth.owner}/{repo}/contents/{filename}",
+                params=params,
+                headers=headers,
+            )
         except http.HTTPNotFound:
             continue
+
         if ref is None and filename != cached_filename:
             with utils.get_redis_for_cache() as redis:
-                redis.set(config_location_cache, filename, ex=60 * 60 * 24 * 31)
+                redis.set(config_location_cache, filename, ex=CONFIG_CACHE_EXPIRATION)
+
+        if response.status_code == 304:
+            return (
+                filename,
+                cached_content["sha"],
+                base64.b64decode(cached_content["content"]),
+            )
+
+        data = response.json()
+        if ref is None and "ETag" in response.headers:
+            with utils.get_redis_for_cache() as redis:
+                with redis.pipeline() as pipe:
+                    pipe.delete(config_content_cache)
+                    pipe.hset(
+                        config_content_cache,
+                        mapping={
+                            "filename": filename,
+                            "etag": response.headers["ETag"],
+                            "sha": data["sha"],
+                            "content": data["content"],
+                        },
+                    )
+                    pipe.expire(config_content_cache, CONFIG_CACHE_EXPIRATION)
+                    pipe.execute()
+
+        return (
+            filename,
+            data["sha"],
+            base64.b64decode(bytearray(data["content"], "utf-8")),
+        )
 
-        return filename, base64.b64decode(bytearray(content, "utf-8"))
     with utils.get_redis_for_cache() as redis:
-        redis.delete(config_location_cache)
+        redis.delete(config_location_cache, config_content_cache)
     raise NoRules()
 
 
+def get_mergify_config_content(client, repo, ref=None):
+    """Get the Mergify configuration file content.
+
+    :return: The filename and its content.
+    """
+    filename, _, content = _get_mergify_config_file(client, repo, ref)
+    return filename, content
+
+
 class MergifyConfig(typing.TypedDict):
     pull_request_rules: PullRequestRules
 
 
+# Conditions get the Context attached while being evaluated, so the parsed
+# configurations are never shared between engine threads.
+_PARSED_CONFIGS = threading.local()
+
+T_ParsedConfigCache = typing.OrderedDict[typing.Tuple[str, str, str], MergifyConfig]
+
+
+def _get_parsed_config_cache() -> T_ParsedConfigCache:
+    if not hasattr(_PARSED_CONFIGS, "cache"):
+        _PARSED_CONFIGS.cache = collections.OrderedDict()
+    return typing.cast(T_ParsedConfigCache, _PARSED_CONFIGS.cache)
+
+
+def _copy_config(mergify_config: MergifyConfig) -> MergifyConfig:
+    # The engine appends the default rules to the returned configuration
+    pull_request_rules = copy.copy(mergify_config["pull_request_rules"])
+    pull_request_rules.rules = list(pull_request_rules.rules)
+    return MergifyConfig(pull_request_rules=pull_request_rules)
+
+
 def get_mergify_config(client, repo, ref=None):
-    filename, content = get_mergify_config_content(client, repo, ref)
+    filename, sha, content = _get_mergify_config_file(client, repo, ref)
+
+    cache = _get_parsed_config_cache()
+    cache_key = (client.auth.owner, repo, sha)
+    if cache_key in cache:
+        statsd.increment("engine.config_cache.hit")
+        cache.move_to_end(cache_key)
+        return filename, _copy_config(cache[cache_key])
+
+    statsd.increment("engine.config_cache.miss")
     try:
-        return filename, typing.cast(MergifyConfig, UserConfigurationSchema(content))
+        mergify_config = typing.cast(MergifyConfig, UserConfigurationSchema(content))
     except voluptuous.Invalid as e:
         raise InvalidRules(e, filename)
+
+    cache[cache_key] = mergify_config
+    if len(cache) > PARSED_CONFIG_CACHE_SIZE:
+        cache.popitem(last=False)
+    return filename, _copy_config(mergify_config)
@@ -557,7 +557,7 @@ class FunctionalTestBase(unittest.TestCase):
 
         started_at = None
         while True:
-            if w._redis is None or (await w._redis.zcard("streams")) > 0:
+            if w._redis is None or (await worker.count_streams(w._redis)) > 0:
                 started_at = None
             elif started_at is None:
                 started_at = time.monotonic()
@@ -266,8 +266,11 @@ def test_queue_summary_subscription(active, summary):
     }
     q = mock.Mock(installation_id=12345)
     q.get_pulls.return_value = [1, 2, 3, 4, 5, 6, 7, 8, 9]
-    q.get_config.side_effect = gen_config(
-        [4000, 3000, 3000, 3000, 2000, 2000, 1000, 1000, 1000]
+    q.get_configs.return_value = dict(
+        zip(
+            q.get_pulls.return_value,
+            gen_config([4000, 3000, 3000, 3000, 2000, 2000, 1000, 1000, 1000]),
+        )
     )
     with mock.patch.object(merge.queue.Queue, "from_context", return_value=q):
         action = merge.MergeAction(voluptuous.Schema(merge.MergeAction.validator)({}))
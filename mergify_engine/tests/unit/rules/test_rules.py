@@ -30,6 +30,17 @@ def pull_request_rule_from_list(lst):
     return voluptuous.Schema(rules.PullRequestRulesSchema)(lst)
 
 
+def _content_response(content, etag=None, status=200, sha=None):
+    response = mock.Mock()
+    response.status_code = status
+    response.headers = {} if etag is None else {"ETag": etag}
+    response.json.return_value = {
+        "sha": sha or str(hash(content)),
+        "content": encodebytes(content.encode()).decode(),
+    }
+    return response
+
+
 def test_valid_condition():
     c = rules.RuleCondition("head~=bar")
     assert str(c) == "head~=bar"
@@ -175,7 +186,7 @@ def test_jinja_with_wrong_syntax():
 )
 def test_get_mergify_config(valid):
     client = mock.Mock()
-    client.item.return_value = {"content": encodebytes(valid.encode()).decode()}
+    client.get.return_value = _content_response(valid)
     filename, schema = get_mergify_config(client, "xyz")
     assert isinstance(schema, dict)
     assert "pull_request_rules" in schema
@@ -184,34 +195,91 @@ def test_get_mergify_config(valid):
 def test_get_mergify_config_location_from_cache():
     client = mock.Mock()
     client.auth.owner = "foo"
-    client.item.side_effect = [
+    rules.clear_config_cache("foo", "bar")
+    client.get.side_effect = [
         http.HTTPNotFound("Not Found", request=mock.Mock(), response=mock.Mock()),
         http.HTTPNotFound("Not Found", request=mock.Mock(), response=mock.Mock()),
-        {"content": encodebytes("whatever".encode()).decode()},
+        _content_response("whatever"),
     ]
     filename, content = rules.get_mergify_config_content(client, "bar")
-    assert client.item.call_count == 3
-    client.item.assert_has_calls(
+    assert client.get.call_count == 3
+    client.get.assert_has_calls(
         [
-            mock.call("/repos/foo/bar/contents/.mergify.yml"),
-            mock.call("/repos/foo/bar/contents/.mergify/config.yml"),
-            mock.call("/repos/foo/bar/contents/.github/mergify.yml"),
+            mock.call("/repos/foo/bar/contents/.mergify.yml", params={}, headers={}),
+            mock.call(
+                "/repos/foo/bar/contents/.mergify/config.yml", params={}, headers={}
+            ),
+            mock.call(
+                "/repos/foo/bar/contents/.github/mergify.yml", params={}, headers={}
+            ),
         ]
     )
 
-    client.item.reset_mock()
-    client.item.side_effect = [
-        {"content": encodebytes("whatever".encode()).decode()},
+    client.get.reset_mock()
+    client.get.side_effect = [
+        _content_response("whatever"),
     ]
     filename, content = rules.get_mergify_config_content(client, "bar")
-    assert client.item.call_count == 1
-    client.item.assert_has_calls(
+    assert client.get.call_count == 1
+    client.get.assert_has_calls(
         [
-            mock.call("/repos/foo/bar/contents/.github/mergify.yml"),
+            mock.call(
+                "/repos/foo/bar/contents/.github/mergify.yml", params={}, headers={}
+            ),
         ]
     )
 
 
+def test_get_mergify_config_etag_and_parsed_cache():
+    config = """
+pull_request_rules:
+  - name: hello
+    conditions:
+      - base=main
+    actions:
+      comment:
+        message: hello
+"""
+    client = mock.Mock()
+    client.auth.owner = "foo"
+    rules.clear_config_cache("foo", "etag")
+    client.get.return_value = _content_response(config, etag='"123"', sha="abc")
+    with mock.patch.object(
+        rules, "UserConfigurationSchema", wraps=rules.UserConfigurationSchema
+    ) as schema:
+        filename, mergify_config = get_mergify_config(client, "etag")
+        assert filename == ".mergify.yml"
+        assert schema.call_count == 1
+        assert len(mergify_config["pull_request_rules"].rules) == 1
+        mergify_config["pull_request_rules"].rules.append(mock.Mock())
+
+        client.get.reset_mock()
+        client.get.return_value = _content_response("", status=304)
+        filename, mergify_config = get_mergify_config(client, "etag")
+        assert filename == ".mergify.yml"
+        client.get.assert_called_once_with(
+            "/repos/foo/etag/contents/.mergify.yml",
+            params={},
+            headers={"If-None-Match": '"123"'},
+        )
+        assert schema.call_count == 1
+        assert len(mergify_config["pull_request_rules"].rules) == 1
+
+        filename, content = rules.get_mergify_config_content(client, "etag")
+        assert content == config.encode()
+
+        # Invalidated by a push
+        rules.clear_config_cache("foo", "etag")
+        client.get.reset_mock()
+        client.get.return_value = _content_response(config, etag='"456"', sha="abc")
+        filename, mergify_config = get_mergify_config(client, "etag")
+        client.get.assert_called_once_with(
+            "/repos/foo/etag/contents/.mergify.yml", params={}, headers={}
+        )
+        # Same blob, no need to parse it again
+        assert schema.call_count == 1
+
+
 @pytest.mark.parametrize(
     "invalid",
     (
@@ -243,7 +311,7 @@ def test_get_mergify_config_location_from_cache():
 def test_get_mergify_config_invalid(invalid):
     with pytest.raises(InvalidRules):
         client = mock.Mock()
-        client.item.return_value = {"content": encodebytes(invalid.encode()).decode()}
+        client.get.return_value = _content_response(invalid)
         filename, schema = get_mergify_config(client, "xyz")
 
 
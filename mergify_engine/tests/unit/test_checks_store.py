@@ -0,0 +1,164 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from unittest import mock
+
+import aredis
+import pytest
+
+from mergify_engine import check_api
+from mergify_engine import checks_store
+from mergify_engine import config
+from mergify_engine import github_events
+from mergify_engine import utils
+
+
+@pytest.fixture(autouse=True)
+def enable_checks_store():
+    with mock.patch.object(config, "CHECKS_STORE", True):
+        yield
+    with utils.get_redis_for_cache() as redis:
+        for key in redis.keys("*~owner~repo~sha"):
+            redis.delete(key)
+
+
+def make_check_run(id, name, status="completed", conclusion="success"):
+    return {
+        "id": id,
+        "name": name,
+        "head_sha": "sha",
+        "status": status,
+        "conclusion": conclusion if status == "completed" else None,
+    }
+
+
+def make_ctxt(check_runs, statuses):
+    def items(url, list_items=None, **kwargs):
+        if url == "/repos/owner/repo/commits/sha/check-runs":
+            return check_runs
+        elif url == "/repos/owner/repo/commits/sha/status":
+            return statuses
+        raise ValueError(f"Unknown test URL `{url}`")
+
+    ctxt = mock.Mock(
+        base_url="/repos/owner/repo",
+        pull={"base": {"user": {"login": "owner"}, "repo": {"name": "repo"}}},
+    )
+    ctxt.client.items.side_effect = items
+    return ctxt
+
+
+def test_checks_store_listing_then_updates():
+    ctxt = make_ctxt(
+        [make_check_run(1, "tests", "in_progress"), make_check_run(2, "lint")],
+        [{"id": 10, "context": "ci/ext", "state": "pending"}],
+    )
+    assert [c["name"] for c in check_api.get_checks_for_ref(ctxt, "sha")] == [
+        "tests",
+        "lint",
+    ]
+    assert check_api.get_statuses_for_ref(ctxt, "sha") == [
+        {"id": 10, "context": "ci/ext", "state": "pending"}
+    ]
+    assert ctxt.client.items.call_count == 2
+
+    # Out of order updates of the same check run are ignored
+    checks_store.store(
+        checks_store.CHECK_RUNS,
+        "owner",
+        "repo",
+        "sha",
+        [make_check_run(1, "tests"), make_check_run(1, "tests", "queued")],
+    )
+    checks_store.store(
+        checks_store.STATUSES,
+        "owner",
+        "repo",
+        "sha",
+        [
+            {"id": 12, "context": "ci/ext", "state": "success"},
+            {"id": 11, "context": "ci/ext", "state": "failure"},
+        ],
+    )
+
+    checks = check_api.get_checks_for_ref(ctxt, "sha")
+    assert [(c["name"], c["conclusion"]) for c in checks] == [
+        ("tests", "success"),
+        ("lint", "success"),
+    ]
+    checks = check_api.get_checks_for_ref(ctxt, "sha", check_name="lint")
+    assert [c["id"] for c in checks] == [2]
+    assert check_api.get_statuses_for_ref(ctxt, "sha") == [
+        {"id": 12, "context": "ci/ext", "state": "success"}
+    ]
+    # Served by the store
+    assert ctxt.client.items.call_count == 2
+
+
+def test_checks_store_not_synced():
+    checks_store.store(
+        checks_store.CHECK_RUNS, "owner", "repo", "sha", [make_check_run(3, "tests")]
+    )
+    ctxt = make_ctxt([make_check_run(1, "tests"), make_check_run(2, "lint")], [])
+    checks = check_api.get_checks_for_ref(ctxt, "sha")
+    assert ctxt.client.items.call_count == 1
+    assert [c["id"] for c in checks] == [1, 2]
+    # The listing did not replace the more recent check run
+    checks = check_api.get_checks_for_ref(ctxt, "sha")
+    assert ctxt.client.items.call_count == 1
+    assert [c["id"] for c in checks] == [2, 3]
+
+
+@pytest.mark.asyncio
+async def test_checks_store_webhooks():
+    ctxt = make_ctxt([], [])
+    assert check_api.get_checks_for_ref(ctxt, "sha") == []
+    assert check_api.get_statuses_for_ref(ctxt, "sha") == []
+
+    repository = {"owner": {"login": "owner"}, "name": "repo", "archived": False}
+    redis = aredis.StrictRedis.from_url(config.STORAGE_URL, decode_responses=True)
+    try:
+        with mock.patch.object(utils, "get_aredis_for_cache", return_value=redis):
+            await github_events._store_check_run(
+                "owner",
+                "repo",
+                {"repository": repository, "check_run": make_check_run(5, "tests")},
+            )
+            await github_events._store_status(
+                "owner",
+                "repo",
+                {
+                    "repository": repository,
+                    "sha": "sha",
+                    "id": 6,
+                    "context": "ci/ext",
+                    "state": "failure",
+                    "description": None,
+                    "target_url": None,
+                    "created_at": "2021-01-01T00:00:00Z",
+                    "updated_at": "2021-01-01T00:00:00Z",
+                    "sender": {"login": "ci", "id": 1, "type": "Bot"},
+                },
+            )
+    finally:
+        redis.connection_pool.max_idle_time = 0
+        redis.connection_pool.disconnect()
+        await utils.stop_pending_aredis_tasks()
+
+    assert [c["id"] for c in check_api.get_checks_for_ref(ctxt, "sha")] == [5]
+    assert [s["state"] for s in check_api.get_statuses_for_ref(ctxt, "sha")] == [
+        "failure"
+    ]
+    assert ctxt.client.items.call_count == 2
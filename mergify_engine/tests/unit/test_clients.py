@@ -15,6 +15,7 @@
 # under the License.
 
 import datetime
+import json
 from unittest import mock
 
 import pytest
@@ -23,10 +24,20 @@ from werkzeug.http import http_date
 from werkzeug.wrappers import Response
 
 from mergify_engine import exceptions
+from mergify_engine import utils
 from mergify_engine.clients import github
+from mergify_engine.clients import github_app
 from mergify_engine.clients import http
 
 
+@pytest.fixture(autouse=True)
+def clear_installation_cache():
+    redis = utils.get_redis_for_cache()
+    for pattern in ("installation-cache~*", "installation-token*"):
+        for key in redis.scan_iter(pattern):
+            redis.delete(key)
+
+
 @mock.patch.object(github.CachedToken, "STORAGE", {})
 def test_client_installation_token(httpserver: httpserver.HTTPServer) -> None:
     with mock.patch(
@@ -375,3 +386,377 @@ def test_client_abuse_403_no_header(httpserver: httpserver.HTTPServer) -> None:
     assert len(httpserver.log) == 3
 
     httpserver.check_assertions()
+
+
+@mock.patch.object(github.CachedToken, "STORAGE", {})
+def test_client_installation_cached(httpserver: httpserver.HTTPServer) -> None:
+    installation = {
+        "id": 12345,
+        "target_type": "User",
+        "permissions": {
+            "checks": "write",
+            "contents": "write",
+            "pull_requests": "write",
+        },
+        "account": {"login": "owner", "id": 12345},
+    }
+    httpserver.expect_oneshot_request("/users/owner/installation").respond_with_json(
+        installation
+    )
+    httpserver.expect_request(
+        "/app/installations/12345/access_tokens"
+    ).respond_with_json({"token": "<token>", "expires_at": "2100-12-31T23:59:59Z"})
+    httpserver.expect_request("/").respond_with_json({"work": True}, status=200)
+
+    with mock.patch(
+        "mergify_engine.config.GITHUB_API_URL",
+        httpserver.url_for("/")[:-1],
+    ):
+        with github.get_client("owner") as client:
+            client.get(httpserver.url_for("/"))
+        assert github_app.get_installation_from_cache("OwNeR") == installation
+
+        with github.get_client("owner") as client:
+            client.get(httpserver.url_for("/"))
+            assert client.auth.installation == installation
+            assert client.auth.owner_id == 12345
+
+    assert [r.path for r, _ in httpserver.log] == [
+        "/users/owner/installation",
+        "/app/installations/12345/access_tokens",
+        "/",
+        "/",
+    ]
+    httpserver.check_assertions()
+
+
+@pytest.mark.asyncio
+async def test_installation_cache_invalidation() -> None:
+    installation = {"id": 12345, "account": {"login": "owner", "id": 12345}}
+    await github_app.acache_installation("owner", installation)  # type: ignore[arg-type]
+    assert await github_app.aget_installation_from_cache("owner") == installation
+    await github_app.invalidate_installation_cache("Owner")
+    assert await github_app.aget_installation_from_cache("owner") is None
+
+
+def _expect_installation_and_token(
+    httpserver: httpserver.HTTPServer, expires_at: str = "2100-12-31T23:59:59Z"
+) -> None:
+    httpserver.expect_request("/users/owner/installation").respond_with_json(
+        {
+            "id": 12345,
+            "target_type": "User",
+            "permissions": {
+                "checks": "write",
+                "contents": "write",
+                "pull_requests": "write",
+            },
+            "account": {"login": "owner", "id": 12345},
+        }
+    )
+    httpserver.expect_oneshot_request(
+        "/app/installations/12345/access_tokens"
+    ).respond_with_json({"token": "<token>", "expires_at": expires_at})
+    httpserver.expect_request("/").respond_with_json({"work": True}, status=200)
+
+
+@mock.patch.object(github.CachedToken, "STORAGE", {})
+def test_client_access_token_shared_between_processes(
+    httpserver: httpserver.HTTPServer,
+) -> None:
+    _expect_installation_and_token(httpserver)
+
+    with mock.patch(
+        "mergify_engine.config.GITHUB_API_URL",
+        httpserver.url_for("/")[:-1],
+    ):
+        with github.get_client("owner") as client:
+            client.get(httpserver.url_for("/"))
+
+        # Simulate another process
+        github.CachedToken.STORAGE.clear()
+
+        with github.get_client("owner") as client:
+            client.get(httpserver.url_for("/"))
+            assert client.auth.get_access_token() == "<token>"  # type: ignore[union-attr]
+
+    assert [r.path for r, _ in httpserver.log] == [
+        "/users/owner/installation",
+        "/app/installations/12345/access_tokens",
+        "/",
+        "/",
+    ]
+    assert not utils.get_redis_for_cache().exists("installation-token-lock~12345")
+
+
+@mock.patch.object(github.CachedToken, "STORAGE", {})
+def test_client_access_token_refreshed_before_expiration(
+    httpserver: httpserver.HTTPServer,
+) -> None:
+    expires_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=2)
+    github.CachedToken(12345, "<old-token>", expires_at).save()  # type: ignore[arg-type]
+    _expect_installation_and_token(httpserver)
+
+    with mock.patch(
+        "mergify_engine.config.GITHUB_API_URL",
+        httpserver.url_for("/")[:-1],
+    ):
+        with github.get_client("owner") as client:
+            client.get(httpserver.url_for("/"))
+            assert client.auth.get_access_token() == "<token>"  # type: ignore[union-attr]
+
+    assert [r.path for r, _ in httpserver.log] == [
+        "/users/owner/installation",
+        "/app/installations/12345/access_tokens",
+        "/",
+    ]
+    assert httpserver.log[-1][0].headers["Authorization"] == "token <token>"
+    assert github.CachedToken.get_from_redis(12345).token == "<token>"  # type: ignore[union-attr]
+
+
+@mock.patch.object(github.CachedToken, "STORAGE", {})
+def test_client_access_token_refresh_locked_by_another_process(
+    httpserver: httpserver.HTTPServer,
+) -> None:
+    expires_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=2)
+    github.CachedToken(12345, "<old-token>", expires_at).save()  # type: ignore[arg-type]
+    assert github.CachedToken.acquire_refresh_lock(12345)
+    _expect_installation_and_token(httpserver)
+
+    with mock.patch(
+        "mergify_engine.config.GITHUB_API_URL",
+        httpserver.url_for("/")[:-1],
+    ):
+        with github.get_client("owner") as client:
+            client.get(httpserver.url_for("/"))
+
+    # The token is still valid, the process that owns the lock refreshes it
+    assert [r.path for r, _ in httpserver.log] == [
+        "/users/owner/installation",
+        "/",
+    ]
+    assert httpserver.log[-1][0].headers["Authorization"] == "token <old-token>"
+    github.CachedToken.release_refresh_lock(12345)
+
+
+@mock.patch.object(github.CachedToken, "STORAGE", {})
+@mock.patch.object(github.CachedToken, "LOCK_TIMEOUT", 0.3)
+def test_client_access_token_lock_timeout(httpserver: httpserver.HTTPServer) -> None:
+    assert github.CachedToken.acquire_refresh_lock(12345)
+    _expect_installation_and_token(httpserver)
+
+    with mock.patch(
+        "mergify_engine.config.GITHUB_API_URL",
+        httpserver.url_for("/")[:-1],
+    ):
+        with github.get_client("owner") as client:
+            client.get(httpserver.url_for("/"))
+
+    assert [r.path for r, _ in httpserver.log] == [
+        "/users/owner/installation",
+        "/app/installations/12345/access_tokens",
+        "/",
+    ]
+
+
+def _etag_handler(payload, etag, headers=None):
+    def handler(request):
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status=304, headers={"ETag": etag})
+        return Response(
+            json.dumps(payload),
+            200,
+            headers={"ETag": etag, **(headers or {})},
+            content_type="application/json",
+        )
+
+    return handler
+
+
+@pytest.mark.parametrize(
+    "response_cache",
+    (http.LocalResponseCache(10), http.RedisResponseCache()),
+    ids=("local", "redis"),
+)
+def test_client_response_cache(
+    httpserver: httpserver.HTTPServer, response_cache: http.ResponseCache
+) -> None:
+    for key in utils.get_redis_for_cache().scan_iter("http-cache~*"):
+        utils.get_redis_for_cache().delete(key)
+
+    httpserver.expect_request("/pulls/1").respond_with_handler(
+        _etag_handler({"number": 1}, '"abc"')
+    )
+
+    with mock.patch.object(http, "statsd") as statsd:
+        with http.Client(response_cache=response_cache) as client:
+            assert client.get(httpserver.url_for("/pulls/1")).json() == {"number": 1}
+            reply = client.get(httpserver.url_for("/pulls/1"))
+            assert reply.status_code == 200
+            assert reply.json() == {"number": 1}
+            assert http.is_cached_response(reply)
+
+    assert [r.headers.get("If-None-Match") for r, _ in httpserver.log] == [
+        None,
+        '"abc"',
+    ]
+    assert [c.kwargs["tags"][-1] for c in statsd.increment.call_args_list] == [
+        "result:miss",
+        "result:hit",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_async_client_response_cache(httpserver: httpserver.HTTPServer) -> None:
+    httpserver.expect_request("/pulls/1").respond_with_handler(
+        _etag_handler({"number": 1}, '"abc"')
+    )
+
+    response_cache = http.LocalResponseCache(10)
+    async with http.AsyncClient(response_cache=response_cache) as client:
+        assert (await client.get(httpserver.url_for("/pulls/1"))).json() == {
+            "number": 1
+        }
+        reply = await client.get(httpserver.url_for("/pulls/1"))
+        assert reply.json() == {"number": 1}
+        assert http.is_cached_response(reply)
+
+    assert len(httpserver.log) == 2
+
+
+def test_client_response_cache_not_used_for_other_methods(
+    httpserver: httpserver.HTTPServer,
+) -> None:
+    httpserver.expect_request("/pulls/1").respond_with_handler(
+        _etag_handler({"number": 1}, '"abc"')
+    )
+
+    response_cache = http.LocalResponseCache(10)
+    with http.Client(response_cache=response_cache) as client:
+        client.post(httpserver.url_for("/pulls/1"), json={})
+        client.post(httpserver.url_for("/pulls/1"), json={})
+
+    assert [r.headers.get("If-None-Match") for r, _ in httpserver.log] == [None, None]
+
+
+def test_local_response_cache_is_bounded() -> None:
+    response_cache = http.LocalResponseCache(2)
+    for key in ("a", "b", "c"):
+        response_cache.set(key, http.CachedResponse({"ETag": key}, "{}"))
+    assert response_cache.get("a") is None
+    assert response_cache.get("b") is not None
+    assert response_cache.get("c") is not None
+
+
+@mock.patch.object(github.CachedToken, "STORAGE", {})
+def test_client_response_cache_paginated_items(
+    httpserver: httpserver.HTTPServer,
+) -> None:
+    _expect_installation_and_token(httpserver)
+    next_url = httpserver.url_for("/repos/owner/repo/pulls/1/files") + "?page=2"
+    httpserver.expect_request(
+        "/repos/owner/repo/pulls/1/files", query_string="page=2"
+    ).respond_with_handler(_etag_handler([{"filename": "b"}], '"page2"'))
+    httpserver.expect_request(
+        "/repos/owner/repo/pulls/1/files", query_string=""
+    ).respond_with_handler(
+        _etag_handler(
+            [{"filename": "a"}],
+            '"page1"',
+            headers={"Link": f'<{next_url}>; rel="next"'},
+        )
+    )
+
+    with mock.patch(
+        "mergify_engine.config.GITHUB_API_URL",
+        httpserver.url_for("/")[:-1],
+    ), mock.patch.object(
+        http, "get_response_cache", return_value=http.LocalResponseCache(10)
+    ):
+        with github.get_client("owner") as client:
+            for _ in range(2):
+                files = list(client.items("/repos/owner/repo/pulls/1/files"))
+                assert files == [{"filename": "a"}, {"filename": "b"}]
+
+    assert [
+        (r.path, r.headers.get("If-None-Match"))
+        for r, _ in httpserver.log
+        if r.path.endswith("/files")
+    ] == [
+        ("/repos/owner/repo/pulls/1/files", None),
+        ("/repos/owner/repo/pulls/1/files", None),
+        ("/repos/owner/repo/pulls/1/files", '"page1"'),
+        ("/repos/owner/repo/pulls/1/files", '"page2"'),
+    ]
+
+
+@pytest.mark.parametrize(
+    "url,endpoint",
+    (
+        ("/repos/jd/foo/pulls/42", "/repos/{owner}/{repo}/pulls/{number}"),
+        (
+            "https://api.github.com/repos/jd/foo/pulls/42/reviews?per_page=100",
+            "/repos/{owner}/{repo}/pulls/{number}/reviews",
+        ),
+        (
+            "/repos/jd/foo/commits/2a0ac9cbb9da6bf3d6e8c2e9b8f6b7a6c1d5e4f3/check-runs",
+            "/repos/{owner}/{repo}/commits/{sha}/check-runs",
+        ),
+        (
+            "/repos/jd/foo/collaborators/sileht/permission",
+            "/repos/{owner}/{repo}/collaborators/{username}/permission",
+        ),
+        (
+            "/repos/jd/foo/branches/feature/foo/protection",
+            "/repos/{owner}/{repo}/branches/{branch}",
+        ),
+        ("/users/jd/installation", "/users/{username}/installation"),
+    ),
+)
+def test_get_endpoint(url: str, endpoint: str) -> None:
+    assert http.get_endpoint(url) == endpoint
+
+
+@mock.patch.object(github.CachedToken, "STORAGE", {})
+def test_client_graphql(httpserver: httpserver.HTTPServer) -> None:
+    with mock.patch(
+        "mergify_engine.config.GITHUB_API_URL",
+        httpserver.url_for("/api/v3"),
+    ):
+        assert github.get_graphql_url() == httpserver.url_for("/api/graphql")
+
+        httpserver.expect_request("/api/v3/users/owner/installation").respond_with_json(
+            {
+                "id": 12345,
+                "target_type": "User",
+                "permissions": {
+                    "checks": "write",
+                    "contents": "write",
+                    "pull_requests": "write",
+                },
+                "account": {"login": "testing", "id": 12345},
+            }
+        )
+        httpserver.expect_request(
+            "/api/v3/app/installations/12345/access_tokens"
+        ).respond_with_json(
+            {"token": "<app_token>", "expires_at": "2100-12-31T23:59:59Z"}
+        )
+        httpserver.expect_oneshot_request(
+            "/api/graphql",
+            method="POST",
+            json={"query": "query { viewer { login } }", "variables": {}},
+        ).respond_with_json({"data": {"viewer": {"login": "mergify"}}})
+        httpserver.expect_oneshot_request(
+            "/api/graphql", method="POST"
+        ).respond_with_json({"data": None, "errors": [{"message": "boom"}]})
+
+        with github.GithubInstallationClient(github.get_auth("owner")) as client:
+            assert client.graphql("query { viewer { login } }") == {
+                "viewer": {"login": "mergify"}
+            }
+            with pytest.raises(github.GraphQLError) as e:
+                client.graphql("query { viewer { name } }")
+            assert str(e.value) == "boom"
+
+    httpserver.check_assertions()
@@ -13,10 +13,13 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+from unittest import mock
 
-
+from mergify_engine import config
+from mergify_engine import utils
 from mergify_engine.actions.backport import BackportAction
 from mergify_engine.actions.rebase import RebaseAction
+from mergify_engine.engine import commands_runner
 from mergify_engine.engine.commands_runner import load_action
 
 
@@ -54,3 +57,44 @@ def test_command_loader():
         "ignore_conflicts": True,
         "label_conflicts": "conflicts",
     }
+
+
+@mock.patch.object(config, "PENDING_COMMANDS_STORE", True)
+def test_pending_commands_store():
+    ctxt = mock.Mock(
+        pull={
+            "number": 1,
+            "base": {"user": {"login": "owner"}, "repo": {"name": "repo"}},
+        }
+    )
+    ctxt.client.items.return_value = [
+        {
+            "user": {"id": config.BOT_USER_ID},
+            "body": "**Command `rebase`: pending**",
+        },
+        {
+            "user": {"id": config.BOT_USER_ID},
+            "body": "**Command `backport stable`: pending**",
+        },
+        {"user": {"id": 12345}, "body": "**Command `copy stable`: pending**"},
+        {
+            "user": {"id": config.BOT_USER_ID},
+            "body": "**Command `rebase`: success**",
+        },
+    ]
+    redis = utils.get_redis_for_cache()
+    redis.delete(commands_runner._get_pending_commands_key(ctxt))
+
+    try:
+        assert commands_runner.get_pending_commands(ctxt) == {"backport stable"}
+        assert commands_runner.get_pending_commands(ctxt) == {"backport stable"}
+        assert ctxt.client.items.call_count == 1
+
+        commands_runner._set_command_state(ctxt, "rebase", "pending")
+        commands_runner._set_command_state(ctxt, "backport stable", "success")
+        assert commands_runner.get_pending_commands(ctxt) == {"rebase"}
+        commands_runner._set_command_state(ctxt, "rebase", "failure")
+        assert commands_runner.get_pending_commands(ctxt) == set()
+        assert ctxt.client.items.call_count == 1
+    finally:
+        redis.delete(commands_runner._get_pending_commands_key(ctxt))
@@ -19,6 +19,45 @@ from mergify_engine import subscription
 from mergify_engine.clients import github
 
 
+def make_pr(
+    repo: github_types.GitHubRepository, owner: github_types.GitHubAccount
+) -> github_types.GitHubPullRequest:
+    return github_types.GitHubPullRequest(
+        {
+            "id": github_types.GitHubPullRequestId(github_types.GitHubIssueId(0)),
+            "maintainer_can_modify": False,
+            "head": {
+                "user": owner,
+                "label": "",
+                "ref": github_types.GitHubRefType(""),
+                "sha": github_types.SHAType(""),
+                "repo": repo,
+            },
+            "user": owner,
+            "number": github_types.GitHubPullRequestNumber(
+                github_types.GitHubIssueNumber(0)
+            ),
+            "rebaseable": False,
+            "draft": False,
+            "merge_commit_sha": None,
+            "html_url": "",
+            "state": "closed",
+            "mergeable_state": "unknown",
+            "merged_by": None,
+            "merged": False,
+            "merged_at": None,
+            "labels": [],
+            "base": {
+                "ref": github_types.GitHubRefType("main"),
+                "sha": github_types.SHAType(""),
+                "label": "",
+                "repo": repo,
+                "user": owner,
+            },
+        }
+    )
+
+
 def test_user_permission_cache() -> None:
     class FakeClient(github.GithubInstallationClient):
         called: int
@@ -70,44 +109,6 @@ def test_user_permission_cache() -> None:
         }
     )
 
-    def make_pr(
-        repo: github_types.GitHubRepository, owner: github_types.GitHubAccount
-    ) -> github_types.GitHubPullRequest:
-        return github_types.GitHubPullRequest(
-            {
-                "id": github_types.GitHubPullRequestId(github_types.GitHubIssueId(0)),
-                "maintainer_can_modify": False,
-                "head": {
-                    "user": owner,
-                    "label": "",
-                    "ref": github_types.GitHubRefType(""),
-                    "sha": github_types.SHAType(""),
-                    "repo": repo,
-                },
-                "user": owner,
-                "number": github_types.GitHubPullRequestNumber(
-                    github_types.GitHubIssueNumber(0)
-                ),
-                "rebaseable": False,
-                "draft": False,
-                "merge_commit_sha": None,
-                "html_url": "",
-                "state": "closed",
-                "mergeable_state": "unknown",
-                "merged_by": None,
-                "merged": False,
-                "merged_at": None,
-                "labels": [],
-                "base": {
-                    "ref": github_types.GitHubRefType("main"),
-                    "sha": github_types.SHAType(""),
-                    "label": "",
-                    "repo": repo,
-                    "user": owner,
-                },
-            }
-        )
-
     user_1 = github_types.GitHubAccount(
         {
             "id": github_types.GitHubAccountIdType(1),
@@ -182,3 +183,224 @@ def test_user_permission_cache() -> None:
     context.Context.clear_user_permission_cache_for_user(owner, repo, user_2)
     assert c.has_write_permission(user_2)
     assert client.called == 7
+
+
+def test_team_members_cache() -> None:
+    class FakeClient(github.GithubInstallationClient):
+        called: int
+
+        def __init__(self):
+            super().__init__(auth=None)
+            self.called = 0
+
+        def items(self, url, *args, **kwargs):
+            self.called += 1
+            if url == "/orgs/jd/teams/team1/members":
+                yield {"login": "foo"}
+                yield {"login": "bar"}
+            elif url == "/orgs/other/teams/team2/members":
+                yield {"login": "baz"}
+            else:
+                raise ValueError(f"Unknown test URL `{url}`")
+
+    owner = github_types.GitHubAccount(
+        {
+            "id": github_types.GitHubAccountIdType(123),
+            "login": github_types.GitHubLogin("jd"),
+            "type": "User",
+        }
+    )
+    other = github_types.GitHubAccount(
+        {
+            "id": github_types.GitHubAccountIdType(456),
+            "login": github_types.GitHubLogin("other"),
+            "type": "Organization",
+        }
+    )
+    repo = github_types.GitHubRepository(
+        {
+            "id": github_types.GitHubRepositoryIdType(0),
+            "owner": owner,
+            "full_name": "",
+            "archived": False,
+            "url": "",
+            "default_branch": github_types.GitHubRefType(""),
+            "name": "test",
+            "private": False,
+        }
+    )
+    team1 = github_types.GitHubTeam({"id": 1, "slug": "team1"})
+    team2 = github_types.GitHubTeam({"id": 2, "slug": "team2"})
+    context.Context.clear_team_members_cache_for_team(owner, team1)
+    context.Context.clear_team_members_cache_for_team(other, team2)
+
+    sub = subscription.Subscription(0, False, "", {}, frozenset())
+    client = FakeClient()
+    c = context.Context(client, make_pr(repo, owner), sub)
+    assert c.resolve_teams(["@team1", "@other/team2", "user"]) == [
+        "foo",
+        "bar",
+        "baz",
+        "user",
+    ]
+    assert client.called == 2
+    assert c.resolve_teams(["@jd/team1", "@other/team2"]) == ["foo", "bar", "baz"]
+    assert client.called == 2
+
+    # New engine run, served by redis
+    c = context.Context(client, make_pr(repo, owner), sub)
+    assert c.resolve_teams("@team1") == ["foo", "bar"]
+    assert client.called == 2
+
+    context.Context.clear_team_members_cache_for_team(owner, team1)
+    c = context.Context(client, make_pr(repo, owner), sub)
+    assert c.resolve_teams(["@team1", "@other/team2"]) == ["foo", "bar", "baz"]
+    assert client.called == 3
+
+    context.Context.clear_team_members_cache_for_org(other)
+    c = context.Context(client, make_pr(repo, owner), sub)
+    assert c.resolve_teams(["@team1", "@other/team2"]) == ["foo", "bar", "baz"]
+    assert client.called == 4
+
+
+def test_prefetch() -> None:
+    class FakeClient(github.GithubInstallationClient):
+        def __init__(self):
+            super().__init__(auth=None)
+            self.queries = []
+
+        def graphql(self, query, variables=None):
+            self.queries.append((query, variables))
+            if "pullRequest" in query:
+                return {
+                    "repository": {
+                        "pullRequest": {
+                            "reviews": {
+                                "pageInfo": {"hasNextPage": False},
+                                "nodes": [
+                                    {
+                                        "databaseId": 10,
+                                        "state": "APPROVED",
+                                        "body": "",
+                                        "author": {
+                                            "__typename": "User",
+                                            "login": "foo",
+                                            "databaseId": 1,
+                                        },
+                                    },
+                                    {
+                                        "databaseId": 11,
+                                        "state": "COMMENTED",
+                                        "body": "",
+                                        "author": None,
+                                    },
+                                ],
+                            },
+                            "files": {
+                                "pageInfo": {"hasNextPage": False},
+                                "nodes": [
+                                    {"path": "setup.py", "additions": 1, "deletions": 0}
+                                ],
+                            },
+                            "commits": {
+                                "pageInfo": {"hasNextPage": True},
+                                "nodes": [],
+                            },
+                        },
+                        "headCommit": {
+                            "status": {
+                                "contexts": [{"context": "ci/ext", "state": "FAILURE"}]
+                            },
+                            "checkSuites": {
+                                "pageInfo": {"hasNextPage": False},
+                                "nodes": [
+                                    {
+                                        "checkRuns": {
+                                            "pageInfo": {"hasNextPage": False},
+                                            "nodes": [
+                                                {
+                                                    "name": "tests",
+                                                    "conclusion": "SUCCESS",
+                                                },
+                                                {"name": "lint", "conclusion": None},
+                                            ],
+                                        }
+                                    }
+                                ],
+                            },
+                        },
+                    }
+                }
+            return {
+                "repository": {
+                    "user0": {
+                        "edges": [
+                            {"permission": "READ", "node": {"login": "foobar"}},
+                            {"permission": "WRITE", "node": {"login": "foo"}},
+                        ]
+                    },
+                    "user1": {"edges": []},
+                }
+            }
+
+        def item(self, url, *args, **kwargs):
+            raise ValueError(f"Unexpected REST call `{url}`")
+
+        def items(self, url, *args, **kwargs):
+            if url == "/repos/jd/test/pulls/0/commits":
+                return [{"sha": "abc", "parents": [], "commit": {"message": ""}}]
+            raise ValueError(f"Unexpected REST call `{url}`")
+
+    owner = github_types.GitHubAccount(
+        {
+            "id": github_types.GitHubAccountIdType(123),
+            "login": github_types.GitHubLogin("jd"),
+            "type": "User",
+        }
+    )
+    repo = github_types.GitHubRepository(
+        {
+            "id": github_types.GitHubRepositoryIdType(42),
+            "owner": owner,
+            "full_name": "jd/test",
+            "archived": False,
+            "url": "",
+            "default_branch": github_types.GitHubRefType(""),
+            "name": "test",
+            "private": False,
+        }
+    )
+    sub = subscription.Subscription(0, False, "", {}, frozenset())
+    client = FakeClient()
+    c = context.Context(client, make_pr(repo, owner), sub)
+
+    groups = c.get_prefetch_groups(["approved-reviews-by", "files", "label"])
+    assert groups == {"reviews", "files"}
+    c.prefetch(groups | {"commits", "checks"})
+
+    # One query for the pull request, one for the users permission
+    assert len(client.queries) == 2
+    assert client.queries[1][1]["login0"] == "foo"
+    assert client.queries[1][1]["login1"] == "jd"
+
+    assert [r["state"] for r in c.reviews] == ["APPROVED", "COMMENTED"]
+    assert c.reviews[0]["user"] == {"id": 1, "login": "foo", "type": "User"}
+    assert c.reviews[1]["user"] is None
+    assert c.files == [
+        {
+            "filename": "setup.py",
+            "additions": 1,
+            "deletions": 0,
+            "contents_url": "https://api.github.com/repos/jd/test/contents/setup.py?ref=",
+        }
+    ]
+    assert c.checks == {"tests": "success", "lint": None, "ci/ext": "failure"}
+    # Served by the permission cache
+    assert c.has_write_permission(c.reviews[0]["user"])
+    assert c.pull_request.__getattr__("approved-reviews-by") == ["foo"]
+    # Too many commits for one page, loaded with the REST API
+    assert c.commits == [{"sha": "abc", "parents": [], "commit": {"message": ""}}]
+
+    # Already loaded, nothing to do
+    c.prefetch(groups)
+    assert len(client.queries) == 2
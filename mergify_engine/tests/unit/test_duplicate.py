@@ -13,10 +13,13 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import os
 from unittest import mock
 
+from mergify_engine import config
 from mergify_engine import context
 from mergify_engine import duplicate_pull
+from mergify_engine import utils
 
 
 def fake_get_github_pulls_from_sha(url, api_version=None):
@@ -131,3 +134,154 @@ def test_get_commits_to_cherry_pick_merge(commits):
     merge_commit = {"sha": "merge_commit", "parents": [base_branch, c2]}
 
     assert duplicate_pull._get_commits_to_cherrypick(ctxt, merge_commit) == [c1, c2]
+
+
+def test_sort_commits():
+    c1 = {"sha": "c1", "parents": [{"sha": "base"}]}
+    c2 = {"sha": "c2", "parents": [{"sha": "c1"}]}
+    c3 = {"sha": "c3", "parents": [{"sha": "base"}]}
+    c4 = {"sha": "c4", "parents": [{"sha": "c2"}, {"sha": "c3"}]}
+    c5 = {"sha": "c5", "parents": [{"sha": "c4"}]}
+    assert duplicate_pull._sort_commits([c5, c4, c3, c2, c1]) == [c3, c1, c2, c4, c5]
+    assert duplicate_pull._sort_commits([c1, c2, c3, c4, c5]) == [c1, c3, c2, c4, c5]
+
+
+def make_history_node(sha, parents, pull_numbers):
+    return {
+        "oid": sha,
+        "message": f"commit {sha}",
+        "parents": {"nodes": [{"oid": p} for p in parents]},
+        "associatedPullRequests": {
+            "nodes": [
+                {"number": n, "baseRepository": {"nameWithOwner": "user/ref"}}
+                for n in pull_numbers
+            ]
+        },
+    }
+
+
+@mock.patch.object(config, "GRAPHQL_COMMITS_HISTORY", True)
+def test_get_commits_to_cherry_pick_rebase_graphql():
+    pages = [
+        {
+            "repository": {
+                "object": {
+                    "history": {
+                        "pageInfo": {"hasNextPage": True, "endCursor": "cursor"},
+                        "nodes": [
+                            make_history_node("rebased_c3", ["rebased_c2"], [6]),
+                            make_history_node("rebased_c2", ["rebased_c1"], [6]),
+                        ],
+                    }
+                }
+            }
+        },
+        {
+            "repository": {
+                "object": {
+                    "history": {
+                        "pageInfo": {"hasNextPage": True, "endCursor": "cursor2"},
+                        "nodes": [
+                            make_history_node("rebased_c1", ["base_branch"], [6]),
+                            make_history_node("base_branch", ["older"], [5]),
+                        ],
+                    }
+                }
+            }
+        },
+    ]
+    queries_variables = []
+
+    def graphql(query, variables):
+        queries_variables.append(dict(variables))
+        return pages.pop(0)
+
+    client = mock.Mock()
+    client.graphql.side_effect = graphql
+    ctxt = mock.Mock(
+        client=client,
+        pull={
+            "number": 6,
+            "commits": 3,
+            "base": {
+                "user": {"login": "user"},
+                "repo": {"full_name": "user/ref", "name": "ref"},
+            },
+        },
+    )
+    merge_commit = {"sha": "rebased_c3", "parents": [{"sha": "rebased_c2"}]}
+
+    commits = duplicate_pull._get_commits_to_cherrypick(ctxt, merge_commit)
+    assert [c["sha"] for c in commits] == ["rebased_c1", "rebased_c2", "rebased_c3"]
+    assert [(v["count"], v["after"]) for v in queries_variables] == [
+        (4, None),
+        (100, "cursor"),
+    ]
+    client.item.assert_not_called()
+    client.items.assert_not_called()
+
+
+def test_duplicate_many(tmp_path):
+    remote = utils.Gitter(mock.Mock())
+    os.rmdir(remote.tmp)
+    remote.tmp = str(tmp_path / "owner" / "repo")
+    os.makedirs(remote.tmp)
+    remote("init", "--quiet", "--initial-branch=master")
+    remote.configure()
+    with open(os.path.join(remote.tmp, "file"), "w") as f:
+        f.write("base\n")
+    remote("add", "file")
+    remote("commit", "--quiet", "-m", "base")
+    remote("branch", "stable1")
+    remote("branch", "stable2")
+    remote("branch", "stable3")
+    remote("checkout", "--quiet", "stable3")
+    with open(os.path.join(remote.tmp, "file"), "w") as f:
+        f.write("conflict\n")
+    remote("commit", "--quiet", "-am", "conflict")
+    remote("checkout", "--quiet", "master")
+    with open(os.path.join(remote.tmp, "file"), "w") as f:
+        f.write("fix\n")
+    remote("commit", "--quiet", "-am", "fix")
+    fix_sha = remote("rev-parse", "HEAD").stdout.strip()
+    remote("update-ref", "refs/pull/1/head", fix_sha)
+
+    client = mock.Mock()
+    client.item.return_value = {"size": 1}
+    client.post.side_effect = lambda url, json: mock.Mock(
+        json=mock.Mock(return_value={"base": json["base"], "head": json["head"]})
+    )
+    ctxt = mock.Mock(
+        client=client,
+        pull={
+            "number": 1,
+            "title": "fix",
+            "merge_commit_sha": fix_sha,
+            "base": {"ref": "master", "repo": {"full_name": "owner/repo"}},
+        },
+    )
+
+    with mock.patch.object(
+        config, "GITHUB_URL", f"file://{tmp_path}"
+    ), mock.patch.object(
+        duplicate_pull,
+        "_get_commits_to_cherrypick",
+        return_value=[{"sha": fix_sha}],
+    ):
+        results = duplicate_pull.duplicate_many(
+            ctxt, ["stable1", "stable2", "stable3"], kind=duplicate_pull.BACKPORT
+        )
+
+    assert results["stable1"] == {
+        "base": "stable1",
+        "head": "mergify/bp/stable1/pr-1",
+    }
+    assert results["stable2"] == {
+        "base": "stable2",
+        "head": "mergify/bp/stable2/pr-1",
+    }
+    assert isinstance(results["stable3"], duplicate_pull.DuplicateFailed)
+    assert remote(
+        "for-each-ref", "--format=%(refname:short)", "refs/heads/mergify"
+    ).stdout.splitlines() == ["mergify/bp/stable1/pr-1", "mergify/bp/stable2/pr-1"]
+    assert remote("show", "mergify/bp/stable2/pr-1:file").stdout == "fix\n"
@@ -0,0 +1,90 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import threading
+from unittest import mock
+
+import pytest
+
+from mergify_engine import config
+from mergify_engine import git_jobs
+
+
+def make_ctxt(sha="azertyuiop"):
+    return mock.Mock(
+        pull={
+            "number": 1,
+            "head": {"sha": sha},
+            "base": {
+                "user": {"login": "owner"},
+                "repo": {"name": "repo", "full_name": "owner/repo"},
+            },
+        }
+    )
+
+
+def test_git_jobs_disabled():
+    func = mock.Mock(return_value=42)
+    ctxt = make_ctxt()
+    assert git_jobs.run(ctxt, "job", func) == 42
+    func.assert_called_once_with(ctxt)
+
+
+@mock.patch.object(config, "GIT_JOBS_WORKERS", 1)
+@mock.patch("mergify_engine.git_jobs.context.Context")
+@mock.patch("mergify_engine.git_jobs.github.get_client")
+@mock.patch("mergify_engine.git_jobs.github_events.send_refresh")
+def test_git_jobs(send_refresh, get_client, Context):
+    refreshed = threading.Event()
+
+    async def refresh(pull):
+        refreshed.set()
+
+    send_refresh.side_effect = refresh
+
+    release = threading.Event()
+    calls = []
+
+    def rebase(ctxt):
+        release.wait()
+        calls.append(ctxt)
+        if len(calls) == 2:
+            raise RuntimeError("rebase failed")
+        return "rebased"
+
+    ctxt = make_ctxt()
+    with pytest.raises(git_jobs.JobPending):
+        git_jobs.run(ctxt, "rebase", rebase)
+    # Still running, the job is not submitted again
+    with pytest.raises(git_jobs.JobPending):
+        git_jobs.run(ctxt, "rebase", rebase)
+
+    release.set()
+    assert refreshed.wait(5)
+    send_refresh.assert_called_once_with(ctxt.pull)
+    assert calls == [Context.return_value]
+
+    assert git_jobs.run(ctxt, "rebase", rebase) == "rebased"
+    assert git_jobs._JOBS == {}
+
+    # The result has been consumed, the job is run again and its error is
+    # raised
+    refreshed.clear()
+    with pytest.raises(git_jobs.JobPending):
+        git_jobs.run(ctxt, "rebase", rebase)
+    assert refreshed.wait(5)
+    with pytest.raises(RuntimeError):
+        git_jobs.run(ctxt, "rebase", rebase)
+    assert len(calls) == 2
@@ -0,0 +1,96 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+import os
+from unittest import mock
+
+import pytest
+
+from mergify_engine import config
+from mergify_engine import git_mirrors
+from mergify_engine import utils
+
+
+@pytest.fixture()
+def remote():
+    git = utils.Gitter(mock.Mock())
+    git("init", "--quiet", "--initial-branch=master")
+    git.configure()
+    for i in range(3):
+        git("commit", "--quiet", "--allow-empty", "-m", f"commit {i}")
+    try:
+        yield git
+    finally:
+        git.cleanup()
+
+
+@pytest.fixture()
+def mirrors_dir(tmp_path):
+    with mock.patch.object(config, "GIT_MIRRORS_DIR", str(tmp_path)):
+        yield tmp_path
+
+
+def count_objects(git):
+    out = git("count-objects", "-v").stdout
+    stats = dict(line.split(": ") for line in out.splitlines())
+    return int(stats["count"]) + int(stats["in-pack"])
+
+
+def fetch_with_mirror(remote, repo_full_name="owner/repo"):
+    git = utils.Gitter(mock.Mock())
+    try:
+        git("init", "--quiet")
+        git("remote", "add", "origin", remote.tmp)
+        with git_mirrors.use(git, repo_full_name) as mirrored:
+            git("fetch", "--quiet", "origin", "master")
+        return mirrored, count_objects(git)
+    finally:
+        git.cleanup()
+
+
+def test_git_mirror_disabled(remote):
+    assert fetch_with_mirror(remote) == (False, 4)
+
+
+def test_git_mirror(remote, mirrors_dir):
+    # The first fetch fills the mirror, the next ones borrow its objects
+    assert fetch_with_mirror(remote) == (True, 4)
+    assert os.path.isdir(mirrors_dir / "owner" / "repo.git")
+    assert fetch_with_mirror(remote) == (True, 0)
+
+    remote("commit", "--quiet", "--allow-empty", "-m", "new commit")
+    assert fetch_with_mirror(remote) == (True, 1)
+
+
+def test_git_mirror_eviction(remote, mirrors_dir):
+    fetch_with_mirror(remote, "owner/old")
+    fetch_with_mirror(remote, "owner/used")
+
+    # Both mirrors fit
+    git_mirrors.evict()
+    assert sorted(os.listdir(mirrors_dir / "owner")) == [
+        "old.git",
+        "old.git.update",
+        "old.git.use",
+        "used.git",
+        "used.git.update",
+        "used.git.use",
+    ]
+
+    os.utime(mirrors_dir / "owner" / "old.git" / git_mirrors.LAST_USED_FILE, (0, 0))
+    with mock.patch.object(config, "GIT_MIRRORS_MAX_SIZE_MB", 0):
+        git_mirrors.evict(exclude=str(mirrors_dir / "owner" / "used.git"))
+    assert not os.path.exists(mirrors_dir / "owner" / "old.git")
+    assert os.path.exists(mirrors_dir / "owner" / "used.git")
@@ -92,3 +92,18 @@ async def test_filter_and_dispatch(
         assert e.event_type == event_type
         assert e.event_id == event_id
         assert isinstance(e.reason, str)
+
+
+def test_push_touches_mergify_config() -> None:
+    def make_push(*filenames):
+        return {
+            "commits": [
+                {"id": "1", "added": [], "removed": [], "modified": ["README"]},
+                {"id": "2", "added": [], "removed": [], "modified": list(filenames)},
+            ]
+        }
+
+    assert not github_events._push_touches_mergify_config(make_push())
+    assert not github_events._push_touches_mergify_config(make_push("mergify.yml"))
+    assert github_events._push_touches_mergify_config(make_push(".mergify.yml"))
+    assert github_events._push_touches_mergify_config(make_push(".github/mergify.yml"))
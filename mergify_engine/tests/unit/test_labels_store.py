@@ -0,0 +1,122 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from unittest import mock
+
+import aredis
+import pytest
+import voluptuous
+
+from mergify_engine import config
+from mergify_engine import github_events
+from mergify_engine import labels_store
+from mergify_engine import utils
+from mergify_engine.actions import label
+
+
+@pytest.fixture(autouse=True)
+def enable_labels_store():
+    with mock.patch.object(config, "LABELS_STORE", True):
+        yield
+    with utils.get_redis_for_cache() as redis:
+        redis.delete(*labels_store._get_keys("owner", "repo"))
+
+
+def make_ctxt(labels, pull_labels=()):
+    ctxt = mock.Mock(
+        base_url="/repos/owner/repo",
+        pull={
+            "number": 1,
+            "labels": [{"name": name} for name in pull_labels],
+            "base": {"user": {"login": "owner"}, "repo": {"name": "repo"}},
+        },
+    )
+    ctxt.client.items.return_value = [{"name": name} for name in labels]
+    return ctxt
+
+
+@pytest.mark.asyncio
+async def test_labels_store_webhooks():
+    ctxt = make_ctxt(["bug", "feature"])
+    assert labels_store.get_names(ctxt) == {"bug", "feature"}
+    assert labels_store.get_names(ctxt) == {"bug", "feature"}
+    assert ctxt.client.items.call_count == 1
+
+    repository = {"owner": {"login": "owner"}, "name": "repo", "archived": False}
+    redis = aredis.StrictRedis.from_url(config.STORAGE_URL, decode_responses=True)
+    try:
+        with mock.patch.object(utils, "get_aredis_for_cache", return_value=redis):
+            await github_events._store_label(
+                "owner",
+                "repo",
+                {
+                    "action": "created",
+                    "repository": repository,
+                    "label": {"name": "docs"},
+                },
+            )
+            await github_events._store_label(
+                "owner",
+                "repo",
+                {
+                    "action": "edited",
+                    "repository": repository,
+                    "label": {"name": "bugfix"},
+                    "changes": {"name": {"from": "bug"}},
+                },
+            )
+            await github_events._store_label(
+                "owner",
+                "repo",
+                {
+                    "action": "deleted",
+                    "repository": repository,
+                    "label": {"name": "feature"},
+                },
+            )
+    finally:
+        redis.connection_pool.max_idle_time = 0
+        redis.connection_pool.disconnect()
+        await utils.stop_pending_aredis_tasks()
+
+    assert labels_store.get_names(ctxt) == {"bugfix", "docs"}
+    assert ctxt.client.items.call_count == 1
+
+
+def test_label_action():
+    action = label.LabelAction(
+        voluptuous.Schema(label.LabelAction.validator)(
+            {"add": ["bug", "new"], "remove": ["wontfix", "unknown"]}
+        )
+    )
+
+    ctxt = make_ctxt(["bug", "wontfix"], ["bug", "wontfix"])
+    action.run(ctxt, None)
+    assert ctxt.client.post.call_args_list == [
+        mock.call("/repos/owner/repo/labels", json={"name": "new", "color": mock.ANY}),
+        mock.call("/repos/owner/repo/issues/1/labels", json={"labels": ["new"]}),
+    ]
+    ctxt.client.delete.assert_called_once_with(
+        "/repos/owner/repo/issues/1/labels/wontfix"
+    )
+    assert labels_store.get_names(ctxt) == {"bug", "new", "wontfix"}
+    assert ctxt.client.items.call_count == 1
+
+    # Nothing to change
+    ctxt = make_ctxt(["bug", "new"], ["bug", "new"])
+    action.run(ctxt, None)
+    ctxt.client.items.assert_not_called()
+    ctxt.client.post.assert_not_called()
+    ctxt.client.delete.assert_not_called()
@@ -0,0 +1,159 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from unittest import mock
+
+import aredis
+import pytest
+
+from mergify_engine import config
+from mergify_engine import github_events
+from mergify_engine import opened_pulls
+from mergify_engine import utils
+
+
+async def _cleanup(r):
+    keys = await r.keys("*~owner~repo*")
+    if keys:
+        await r.delete(*keys)
+
+
+@pytest.fixture()
+async def redis():
+    r = aredis.StrictRedis.from_url(config.STORAGE_URL, decode_responses=True)
+    await _cleanup(r)
+    try:
+        yield r
+    finally:
+        await _cleanup(r)
+        r.connection_pool.max_idle_time = 0
+        r.connection_pool.disconnect()
+        await utils.stop_pending_aredis_tasks()
+
+
+def make_pull(number, state="open", ref="main", sha="sha"):
+    repo = {
+        "id": 1,
+        "name": "repo",
+        "full_name": "owner/repo",
+        "owner": {"id": 2, "login": "owner"},
+    }
+    return {
+        "number": number,
+        "state": state,
+        "title": "a pull request",
+        "base": {"ref": ref, "sha": "base-sha", "repo": repo},
+        "head": {"ref": f"feature-{number}", "sha": sha, "repo": None},
+    }
+
+
+def make_client(pulls):
+    async def items(url):
+        assert url == "/repos/owner/repo/pulls"
+        for pull in pulls:
+            yield pull
+
+    client = mock.Mock(auth=mock.Mock(owner="owner"))
+    client.items = mock.Mock(side_effect=items)
+    return client
+
+
+@pytest.mark.asyncio
+async def test_opened_pulls_reconciliation_and_updates(redis):
+    client = make_client([make_pull(2, sha="a"), make_pull(1, ref="stable")])
+
+    pulls = await opened_pulls.get(redis, client, "repo")
+    assert client.items.call_count == 1
+    assert [p["number"] for p in pulls] == [2, 1]
+    assert pulls[0] == {
+        "number": 2,
+        "state": "open",
+        "base": {
+            "ref": "main",
+            "repo": {
+                "id": 1,
+                "name": "repo",
+                "owner": {"id": 2, "login": "owner"},
+            },
+        },
+        "head": {"ref": "feature-2", "sha": "a", "repo": None},
+    }
+
+    await opened_pulls.update(redis, make_pull(3, sha="b"))
+    await opened_pulls.update(redis, make_pull(2, sha="c"))
+    await opened_pulls.update(redis, make_pull(1, state="closed"))
+
+    pulls = await opened_pulls.get(redis, client, "repo")
+    # Served by the index
+    assert client.items.call_count == 1
+    assert [(p["number"], p["head"]["sha"]) for p in pulls] == [(3, "b"), (2, "c")]
+
+    # The index is rebuilt when the reconciliation is due
+    await redis.delete(opened_pulls.get_reconciliation_key("owner", "repo"))
+    pulls = await opened_pulls.get(redis, client, "repo")
+    assert client.items.call_count == 2
+    assert [(p["number"], p["head"]["sha"]) for p in pulls] == [(2, "a"), (1, "sha")]
+
+
+@pytest.mark.asyncio
+async def test_opened_pulls_resolves_events_without_api_calls(redis):
+    client = make_client([make_pull(2, sha="a"), make_pull(1, ref="stable", sha="b")])
+    await opened_pulls.reconcile(redis, client, "repo")
+    pulls = await opened_pulls.get(redis, client, "repo")
+    assert client.items.call_count == 1
+
+    assert await github_events.extract_pull_numbers_from_event(
+        client, "repo", "push", {"ref": "refs/heads/stable"}, pulls
+    ) == [1]
+    assert await github_events.extract_pull_numbers_from_event(
+        client, "repo", "refresh", {"ref": None}, pulls
+    ) == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_opened_pulls_by_sha(redis):
+    async def get_pull_numbers(sha):
+        return await opened_pulls.get_pull_numbers_for_sha(redis, "owner", "repo", sha)
+
+    client = make_client([make_pull(2, sha="a"), make_pull(1, sha="a")])
+    await opened_pulls.reconcile(redis, client, "repo")
+    assert await get_pull_numbers("a") == [1, 2]
+
+    # synchronize
+    await opened_pulls.update(redis, make_pull(2, sha="b"))
+    assert await get_pull_numbers("a") == [1]
+    assert await get_pull_numbers("b") == [2]
+
+    # closed, then a pull request from a fork opened on the same sha
+    await opened_pulls.update(redis, make_pull(1, sha="a", state="closed"))
+    fork_pull = make_pull(3, sha="b")
+    fork_pull["head"]["repo"] = {"id": 42, "full_name": "fork/repo"}
+    await opened_pulls.update(redis, fork_pull)
+    assert await get_pull_numbers("a") == []
+    assert await get_pull_numbers("b") == [2, 3]
+
+    check_run = {"check_run": {"head_sha": "b", "pull_requests": []}}
+    with mock.patch.object(utils, "get_aredis_for_cache", return_value=redis):
+        for event_type, data in (("status", {"sha": "b"}), ("check_run", check_run)):
+            pull_numbers = await github_events.extract_pull_numbers_from_event(
+                client, "repo", event_type, data, []
+            )
+            assert pull_numbers == [2, 3]
+
+    # A reconciliation drops the shas of the previous index
+    client = make_client([make_pull(4, sha="c")])
+    await opened_pulls.reconcile(redis, client, "repo")
+    assert await get_pull_numbers("b") == []
+    assert await get_pull_numbers("c") == [4]
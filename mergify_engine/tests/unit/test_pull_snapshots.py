@@ -0,0 +1,109 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from unittest import mock
+
+import aredis
+from freezegun import freeze_time
+import pytest
+
+from mergify_engine import config
+from mergify_engine import pull_snapshots
+from mergify_engine import utils
+from mergify_engine import worker
+
+
+@pytest.fixture()
+async def redis():
+    r = aredis.StrictRedis.from_url(config.STORAGE_URL, decode_responses=True)
+    await r.delete(pull_snapshots.get_pull_snapshot_key("owner", "repo", 1))
+    try:
+        with mock.patch.object(config, "PULL_SNAPSHOT_MAX_AGE", 60):
+            yield r
+    finally:
+        await r.delete(pull_snapshots.get_pull_snapshot_key("owner", "repo", 1))
+        r.connection_pool.max_idle_time = 0
+        r.connection_pool.disconnect()
+        await utils.stop_pending_aredis_tasks()
+
+
+def make_pull(updated_at, mergeable_state="clean", title="title"):
+    return {
+        "number": 1,
+        "title": title,
+        "updated_at": updated_at,
+        "state": "open",
+        "mergeable_state": mergeable_state,
+        "merged_by": None,
+        "merged": False,
+        "merged_at": None,
+    }
+
+
+COMMENT = [{"event_type": "issue_comment", "data": {}, "timestamp": ""}]
+CHECK_RUN = [{"event_type": "check_run", "data": {}, "timestamp": ""}]
+
+
+@pytest.mark.asyncio
+async def test_pull_snapshots(redis):
+    with freeze_time("2021-01-01T00:00:00", tick=False) as frozen_time:
+        assert await pull_snapshots.get(redis, "owner", "repo", 1, COMMENT) is None
+
+        await pull_snapshots.store(
+            redis, "owner", "repo", make_pull("2021-01-01T00:00:02Z", title="new")
+        )
+        # An older version is ignored
+        await pull_snapshots.store(
+            redis, "owner", "repo", make_pull("2021-01-01T00:00:01Z", title="old")
+        )
+        snapshot = await pull_snapshots.get(redis, "owner", "repo", 1, COMMENT)
+        assert snapshot is not None
+        assert snapshot["title"] == "new"
+
+        # These events may have changed the mergeable_state
+        assert await pull_snapshots.get(redis, "owner", "repo", 1, CHECK_RUN) is None
+
+        # Stale
+        frozen_time.tick(61)
+        assert await pull_snapshots.get(redis, "owner", "repo", 1, COMMENT) is None
+
+        # Incomplete
+        await pull_snapshots.store(
+            redis, "owner", "repo", make_pull("2021-01-01T00:00:03Z", "unknown")
+        )
+        assert await pull_snapshots.get(redis, "owner", "repo", 1, COMMENT) is None
+
+
+@pytest.mark.asyncio
+@mock.patch("mergify_engine.subscription.Subscription.get_subscription")
+@mock.patch("mergify_engine.clients.github.aget_client")
+async def test_get_pull_for_engine_uses_snapshot(aget_client, get_subscription, redis):
+    client = mock.Mock(auth=mock.Mock(owner_id=123))
+    client.__aenter__ = mock.AsyncMock(return_value=client)
+    client.__aexit__ = mock.AsyncMock()
+    client.item = mock.AsyncMock(return_value=make_pull("2021-01-01T00:00:00Z"))
+    aget_client.return_value = client
+    get_subscription.return_value = "sub"
+
+    with mock.patch.object(utils, "get_aredis_for_cache", return_value=redis):
+        logger = mock.Mock()
+        for sources in (COMMENT, COMMENT, CHECK_RUN):
+            sub, pull = await worker.get_pull_for_engine(
+                "owner", "repo", 1, logger, sources
+            )
+            assert pull["updated_at"] == "2021-01-01T00:00:00Z"
+
+    # The first comment and the check run needed the API
+    assert client.item.call_count == 2
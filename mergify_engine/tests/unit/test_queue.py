@@ -0,0 +1,186 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+from unittest import mock
+
+import aredis
+import pytest
+
+from mergify_engine import config
+from mergify_engine import json
+from mergify_engine import queue
+from mergify_engine import utils
+
+
+@pytest.fixture()
+def redis():
+    r = utils.get_redis_for_cache()
+
+    def cleanup():
+        keys = r.keys("merge-*")
+        if keys:
+            r.delete(*keys)
+
+    cleanup()
+    try:
+        yield r
+    finally:
+        cleanup()
+
+
+@pytest.fixture()
+def refresh_pulls():
+    with mock.patch.object(queue.Queue, "_refresh_pulls") as refresh_pulls:
+        yield refresh_pulls
+
+
+def make_queue(redis, ref="main"):
+    return queue.Queue(redis, 1, "owner", 10, "repo", ref)
+
+
+def make_ctxt(pull_number, ref="main"):
+    return mock.Mock(pull={"number": pull_number, "base": {"ref": ref}})
+
+
+def make_config(priority):
+    return queue.QueueConfig(
+        {
+            "strict_method": "merge",
+            "priority": priority,
+            "effective_priority": priority,
+            "bot_account": None,
+            "update_bot_account": None,
+        }
+    )
+
+
+def test_queue_add_and_remove_pulls(redis, refresh_pulls):
+    q = make_queue(redis)
+    q.add_pull(make_ctxt(1), make_config(2000))
+    q.add_pull(make_ctxt(2), make_config(2000))
+    q.add_pull(make_ctxt(3), make_config(3000))
+
+    assert q.get_pulls() == [3, 1, 2]
+    assert q.is_first_pull(make_ctxt(3))
+    assert not q.is_first_pull(make_ctxt(1))
+    assert [q.get_position(make_ctxt(p)) for p in (1, 2, 3, 4)] == [1, 2, 0, None]
+    assert {p: c["priority"] for p, c in q.get_configs([1, 2, 3, 4]).items()} == {
+        1: 2000,
+        2: 2000,
+        3: 3000,
+        4: 2000,
+    }
+
+    q.remove_pull(make_ctxt(3))
+    assert q.get_pulls() == [1, 2]
+    assert q.get_config(3) == queue.DEFAULT_QUEUE_CONFIG
+    assert sorted(redis.hkeys(queue.get_redis_queue_configs_key(1, 10, "main"))) == [
+        "1",
+        "2",
+    ]
+
+    q.delete()
+    assert q.get_pulls() == []
+    assert redis.keys("merge-*") == []
+
+
+def test_queue_legacy_configs(redis, refresh_pulls):
+    redis.zadd(queue.get_redis_queue_key(1, 10, "main"), {"1": 1})
+    redis.set(
+        "merge-config~1~10~1", json.dumps({"strict_method": "rebase", "priority": 1000})
+    )
+
+    q = make_queue(redis)
+    assert q.get_config(1) == {
+        "strict_method": "rebase",
+        "priority": 1000,
+        "effective_priority": 1000,
+        "bot_account": None,
+        "update_bot_account": None,
+    }
+
+    q.remove_pull(make_ctxt(1))
+    assert redis.keys("merge-*") == []
+
+
+def test_queue_base_branch_changed(redis, refresh_pulls):
+    main = make_queue(redis)
+    stable = make_queue(redis, "stable")
+    main.add_pull(make_ctxt(1), make_config(2000))
+    main.add_pull(make_ctxt(2), make_config(2000))
+    assert redis.smembers(queue.get_redis_owner_queues_key(1)) == {"10~main"}
+
+    stable.add_pull(make_ctxt(1, ref="stable"), make_config(2000))
+    assert main.get_pulls() == [2]
+    assert stable.get_pulls() == [1]
+    assert redis.smembers(queue.get_redis_pull_queues_key(1, 10, 1)) == {"stable"}
+    assert redis.smembers(queue.get_redis_owner_queues_key(1)) == {
+        "10~main",
+        "10~stable",
+    }
+
+    # An empty queue is removed from the owner queues
+    stable.remove_pull(make_ctxt(1, ref="stable"))
+    assert redis.smembers(queue.get_redis_owner_queues_key(1)) == {"10~main"}
+    main.delete()
+    assert redis.keys("merge-*") == []
+
+
+@pytest.mark.asyncio
+async def test_migrate_queues_index(redis, refresh_pulls):
+    redis.zadd(queue.get_redis_queue_key(1, 10, "main"), {"1": 1, "2": 2})
+    redis.zadd(queue.get_redis_queue_key(1, 20, "feature/foo"), {"3": 1})
+
+    redis_cache = aredis.StrictRedis.from_url(config.STORAGE_URL, decode_responses=True)
+    try:
+        await queue.migrate_queues_index(redis_cache)
+    finally:
+        redis_cache.connection_pool.disconnect()
+
+    assert redis.smembers(queue.get_redis_owner_queues_key(1)) == {
+        "10~main",
+        "20~feature/foo",
+    }
+    assert redis.smembers(queue.get_redis_pull_queues_key(1, 10, 2)) == {"main"}
+    assert redis.smembers(queue.get_redis_pull_queues_key(1, 20, 3)) == {"feature/foo"}
+
+    stable = make_queue(redis, "stable")
+    stable.add_pull(make_ctxt(2, ref="stable"), make_config(2000))
+    assert make_queue(redis).get_pulls() == [1]
+
+
+@mock.patch.object(config, "QUEUE_REFRESH_BATCHING", True)
+def test_queue_refresh_batching(redis):
+    q = make_queue(redis)
+    for pull_number in (1, 2, 3):
+        q.add_pull(make_ctxt(pull_number), make_config(2000))
+    # Added at the end of the queue, the others keep their position
+    assert queue.pop_pending_refreshes() == []
+
+    q.add_pull(make_ctxt(4), make_config(3000))
+    assert queue.pop_pending_refreshes() == [
+        ("owner", "repo", 1),
+        ("owner", "repo", 2),
+        ("owner", "repo", 3),
+    ]
+
+    q.remove_pull(make_ctxt(2))
+    q.remove_pull(make_ctxt(4))
+    assert q.get_pulls() == [1, 3]
+    assert queue.pop_pending_refreshes() == [
+        ("owner", "repo", 1),
+        ("owner", "repo", 3),
+    ]
+    assert queue.pop_pending_refreshes() == []
@@ -12,6 +12,9 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import asyncio
+import concurrent.futures
+
 import pytest
 
 from mergify_engine import utils
@@ -97,3 +100,70 @@ def test_to_ordinal_numeric():
 
     assert utils.to_ordinal_numeric(4567) == "4567th"
     assert utils.to_ordinal_numeric(5743) == "5743rd"
+
+
+def _in_thread(func):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(func).result()
+
+
+def test_thread_event_loop_reused():
+    async def get_loop():
+        return asyncio.get_running_loop()
+
+    def run():
+        try:
+            loop = utils.get_thread_event_loop()
+            assert utils.run_coroutine(get_loop()) is loop
+            assert utils.run_coroutine(get_loop()) is loop
+            assert utils.async_run(get_loop()) == [loop]
+            return loop
+        finally:
+            utils.close_thread_event_loop()
+
+    loop = _in_thread(run)
+    assert loop.is_closed()
+    other_loop = _in_thread(run)
+    assert other_loop is not loop
+
+
+def test_thread_event_loop_recreated_after_close():
+    def run():
+        try:
+            loop = utils.get_thread_event_loop()
+            utils.close_thread_event_loop()
+            assert loop.is_closed()
+            new_loop = utils.get_thread_event_loop()
+            assert new_loop is not loop
+            assert not new_loop.is_closed()
+        finally:
+            utils.close_thread_event_loop()
+
+    _in_thread(run)
+
+
+def test_run_coroutine_without_thread_event_loop():
+    async def get_loop():
+        return asyncio.get_running_loop()
+
+    def run():
+        first = utils.run_coroutine(get_loop())
+        second = utils.run_coroutine(get_loop())
+        assert first.is_closed()
+        assert first is not second
+
+    _in_thread(run)
+
+
+def test_close_thread_event_loop_cancels_pending_tasks():
+    async def spawn():
+        return asyncio.create_task(asyncio.sleep(1000))
+
+    def run():
+        utils.get_thread_event_loop()
+        task = utils.run_coroutine(spawn())
+        assert not task.done()
+        utils.close_thread_event_loop()
+        return task
+
+    assert _in_thread(run).cancelled()
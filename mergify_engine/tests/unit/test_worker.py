@@ -15,15 +15,19 @@
 import asyncio
 import datetime
 import json
+import threading
 import time
 from unittest import mock
 
 from freezegun import freeze_time
 import httpx
+import msgpack
 import pytest
 
+from mergify_engine import config
 from mergify_engine import exceptions
 from mergify_engine import logs
+from mergify_engine import queue
 from mergify_engine import utils
 from mergify_engine import worker
 from mergify_engine.clients import http
@@ -47,7 +51,7 @@ async def run_worker(test_timeout=10, **kwargs):
     w.start()
     started_at = time.monotonic()
     while (
-        w._redis is None or (await w._redis.zcard("streams")) > 0
+        w._redis is None or (await worker.count_streams(w._redis)) > 0
     ) and time.monotonic() - started_at < test_timeout:
         await asyncio.sleep(0.5)
     w.stop()
@@ -74,7 +78,7 @@ async def test_worker_with_waiting_tasks(run_engine, redis, logger_checker):
                 )
 
     # Check everything we push are in redis
-    assert 8 == (await redis.zcard("streams"))
+    assert 8 == (await worker.count_streams(redis))
     assert 8 == len(await redis.keys("stream~*"))
     for stream_name in stream_names:
         assert 6 == (await redis.xlen(stream_name))
@@ -82,7 +86,7 @@ async def test_worker_with_waiting_tasks(run_engine, redis, logger_checker):
     await run_worker()
 
     # Check redis is empty
-    assert 0 == (await redis.zcard("streams"))
+    assert 0 == (await worker.count_streams(redis))
     assert 0 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
 
@@ -156,14 +160,14 @@ async def test_worker_expanded_events(
         {"payload": "foobar"},
     )
 
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 2 == (await redis.xlen("stream~owner"))
 
     await run_worker()
 
     # Check redis is empty
-    assert 0 == (await redis.zcard("streams"))
+    assert 0 == (await worker.count_streams(redis))
     assert 0 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
 
@@ -232,14 +236,14 @@ async def test_worker_with_one_task(run_engine, redis, logger_checker):
         {"payload": "foobar"},
     )
 
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 2 == (await redis.xlen("stream~owner"))
 
     await run_worker()
 
     # Check redis is empty
-    assert 0 == (await redis.zcard("streams"))
+    assert 0 == (await worker.count_streams(redis))
     assert 0 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
 
@@ -292,7 +296,7 @@ async def test_consume_good_stream(run_engine, redis, logger_checker):
         {"payload": "foobar"},
     )
 
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 2 == await redis.xlen("stream~owner")
     assert 0 == len(await redis.hgetall("attempts"))
@@ -320,7 +324,7 @@ async def test_consume_good_stream(run_engine, redis, logger_checker):
     )
 
     # Check redis is empty
-    assert 0 == (await redis.zcard("streams"))
+    assert 0 == (await worker.count_streams(redis))
     assert 0 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
 
@@ -358,7 +362,7 @@ async def test_stream_processor_retrying_pull(run_engine, logger_class, redis):
         {"payload": "foobar"},
     )
 
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 2 == await redis.xlen("stream~owner")
     assert 0 == len(await redis.hgetall("attempts"))
@@ -395,7 +399,7 @@ async def test_stream_processor_retrying_pull(run_engine, logger_class, redis):
     ]
 
     # Check stream still there and attempts recorded
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert {
         b"pull~owner~repo~42": b"1",
@@ -403,7 +407,7 @@ async def test_stream_processor_retrying_pull(run_engine, logger_class, redis):
     } == await redis.hgetall("attempts")
 
     await p.consume("stream~owner")
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 1 == len(await redis.hgetall("attempts"))
     assert len(run_engine.mock_calls) == 4
@@ -424,7 +428,7 @@ async def test_stream_processor_retrying_pull(run_engine, logger_class, redis):
     assert logger.error.mock_calls[0].args == (
         "failed to process pull request, abandoning",
     )
-    assert 0 == (await redis.zcard("streams"))
+    assert 0 == (await worker.count_streams(redis))
     assert 0 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
 
@@ -459,7 +463,7 @@ async def test_stream_processor_retrying_stream_recovered(run_engine, logger, re
         {"payload": "foobar"},
     )
 
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 2 == await redis.xlen("stream~owner")
     assert 0 == len(await redis.hgetall("attempts"))
@@ -487,7 +491,7 @@ async def test_stream_processor_retrying_stream_recovered(run_engine, logger, re
     )
 
     # Check stream still there and attempts recorded
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 1 == len(await redis.hgetall("attempts"))
 
@@ -497,7 +501,7 @@ async def test_stream_processor_retrying_stream_recovered(run_engine, logger, re
 
     await p.consume("stream~owner")
     assert len(run_engine.mock_calls) == 2
-    assert 0 == (await redis.zcard("streams"))
+    assert 0 == (await worker.count_streams(redis))
     assert 0 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
 
@@ -536,7 +540,7 @@ async def test_stream_processor_retrying_stream_failure(run_engine, logger, redi
         {"payload": "foobar"},
     )
 
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 2 == await redis.xlen("stream~owner")
     assert 0 == len(await redis.hgetall("attempts"))
@@ -564,7 +568,7 @@ async def test_stream_processor_retrying_stream_failure(run_engine, logger, redi
     )
 
     # Check stream still there and attempts recorded
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 1 == len(await redis.hgetall("attempts"))
 
@@ -583,7 +587,7 @@ async def test_stream_processor_retrying_stream_failure(run_engine, logger, redi
     assert logger.info.mock_calls[0].args == ("failed to process stream, retrying",)
     assert logger.info.mock_calls[1].args == ("failed to process stream, retrying",)
     assert logger.info.mock_calls[2].args == ("failed to process stream, retrying",)
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 1 == len(await redis.hgetall("attempts"))
 
@@ -615,7 +619,7 @@ async def test_stream_processor_pull_unexpected_error(run_engine, logger_class,
     assert len(logger.error.mock_calls) == 2
     assert logger.error.mock_calls[0].args == ("failed to process pull request",)
     assert logger.error.mock_calls[1].args == ("failed to process pull request",)
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
 
@@ -647,7 +651,7 @@ async def test_stream_processor_date_scheduling(run_engine, redis, logger_checke
         )
         wanted_owner_id = "owner2"
 
-    assert 2 == (await redis.zcard("streams"))
+    assert 2 == (await worker.count_streams(redis))
     assert 2 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
 
@@ -666,7 +670,7 @@ async def test_stream_processor_date_scheduling(run_engine, redis, logger_checke
         assert stream_name is not None
         await p.consume(stream_name)
 
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
     assert received == [wanted_owner_id]
@@ -675,7 +679,7 @@ async def test_stream_processor_date_scheduling(run_engine, redis, logger_checke
         stream_name = await s.next_stream()
         assert stream_name is None
 
-    assert 1 == (await redis.zcard("streams"))
+    assert 1 == (await worker.count_streams(redis))
     assert 1 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
     assert received == [wanted_owner_id]
@@ -686,7 +690,7 @@ async def test_stream_processor_date_scheduling(run_engine, redis, logger_checke
         assert stream_name is not None
         await p.consume(stream_name)
 
-    assert 0 == (await redis.zcard("streams"))
+    assert 0 == (await worker.count_streams(redis))
     assert 0 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
     assert received == [wanted_owner_id, unwanted_owner_id]
@@ -756,7 +760,7 @@ async def test_stream_processor_ignore_503(run_engine, redis, logger_checker):
     await run_worker()
 
     # Check redis is empty
-    assert 0 == (await redis.zcard("streams"))
+    assert 0 == (await worker.count_streams(redis))
     assert 0 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
 
@@ -781,7 +785,7 @@ async def test_worker_with_multiple_workers(run_engine, redis, logger_checker):
                 )
 
     # Check everything we push are in redis
-    assert 100 == (await redis.zcard("streams"))
+    assert 100 == (await worker.count_streams(redis))
     assert 100 == len(await redis.keys("stream~*"))
     for stream_name in stream_names:
         assert 6 == (await redis.xlen(stream_name))
@@ -801,7 +805,7 @@ async def test_worker_with_multiple_workers(run_engine, redis, logger_checker):
     )
 
     # Check redis is empty
-    assert 0 == (await redis.zcard("streams"))
+    assert 0 == (await worker.count_streams(redis))
     assert 0 == len(await redis.keys("stream~*"))
     assert 0 == len(await redis.hgetall("attempts"))
 
@@ -822,16 +826,14 @@ async def test_worker_reschedule(run_engine, redis, logger_checker, monkeypatch)
         {"payload": "whatever"},
     )
 
-    score = (await redis.zrange("streams", 0, -1, withscores=True))[0][1]
+    score = (await worker.get_streams(redis))[0][1]
     planned_for = datetime.datetime.utcfromtimestamp(score)
 
     monkeypatch.setattr("sys.argv", ["mergify-worker-rescheduler", "other"])
     ret = await worker.async_reschedule_now()
     assert ret == 1
 
-    score_not_rescheduled = (await redis.zrange("streams", 0, -1, withscores=True))[0][
-        1
-    ]
+    score_not_rescheduled = (await worker.get_streams(redis))[0][1]
     planned_for_not_rescheduled = datetime.datetime.utcfromtimestamp(
         score_not_rescheduled
     )
@@ -841,7 +843,7 @@ async def test_worker_reschedule(run_engine, redis, logger_checker, monkeypatch)
     ret = await worker.async_reschedule_now()
     assert ret == 0
 
-    score_rescheduled = (await redis.zrange("streams", 0, -1, withscores=True))[0][1]
+    score_rescheduled = (await worker.get_streams(redis))[0][1]
     planned_for_rescheduled = datetime.datetime.utcfromtimestamp(score_rescheduled)
     assert planned_for > planned_for_rescheduled
 
@@ -860,3 +862,397 @@ async def test_worker_stuck_shutdown(run_engine, redis, logger_checker):
         {"payload": "whatever"},
     )
     await run_worker(test_timeout=2, shutdown_timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_thread_runner():
+    runner = worker.ThreadRunner()
+    try:
+        assert await runner.exec(lambda a, b=0: a + b, 1, b=2) == 3
+        with pytest.raises(ZeroDivisionError):
+            await runner.exec(lambda: 1 / 0)
+
+        thread_loop = await runner.exec(utils.get_thread_event_loop)
+        assert not thread_loop.is_closed()
+    finally:
+        runner.close()
+
+    assert not runner.is_alive()
+    assert thread_loop.is_closed()
+
+
+@pytest.mark.asyncio
+async def test_stream_selector_shards(redis):
+    with freeze_time("2020-01-01"):
+        for owner in range(20):
+            await worker.push(
+                redis, f"owner-{owner}", "repo", 123, "pull_request", {"payload": 1}
+            )
+
+    selectors = [worker.StreamSelector(redis, worker_id, 3) for worker_id in range(3)]
+    selected = []
+    with freeze_time("2020-01-02"):
+        for selector in selectors:
+            while True:
+                stream_name = await selector.next_stream()
+                if stream_name is None:
+                    break
+                assert selector.get_worker_id_for(stream_name.encode()) == (
+                    selector.worker_id
+                )
+                selected.append(stream_name)
+                await redis.zrem(worker.get_stream_shard_key(stream_name), stream_name)
+
+    assert sorted(selected) == sorted(f"stream~owner-{owner}" for owner in range(20))
+    assert 0 == (await worker.count_streams(redis))
+
+
+@pytest.mark.asyncio
+async def test_stream_selector_picks_oldest_stream(redis):
+    for day, owner in ((3, "owner-a"), (1, "owner-b"), (2, "owner-c")):
+        with freeze_time(f"2020-01-0{day}"):
+            await worker.push(redis, owner, "repo", 123, "pull_request", {"payload": 1})
+
+    selector = worker.StreamSelector(redis, 0, 1)
+    with freeze_time("2020-01-01"):
+        assert await selector.next_stream() is None
+    with freeze_time("2020-01-10"):
+        assert await selector.next_stream() == "stream~owner-b"
+
+
+@pytest.mark.asyncio
+async def test_migrate_legacy_streams(redis):
+    for owner in range(5):
+        await redis.zadd(worker.LEGACY_STREAMS_KEY, **{f"stream~owner-{owner}": owner})
+    # Already scheduled in its shard, the score must not be updated
+    await redis.zadd(
+        worker.get_stream_shard_key("stream~owner-0"), **{"stream~owner-0": 42}
+    )
+
+    assert await worker.migrate_legacy_streams(redis, batch_size=2) == 5
+    assert not await redis.exists(worker.LEGACY_STREAMS_KEY)
+    assert await worker.get_streams(redis) == [
+        (b"stream~owner-1", 1),
+        (b"stream~owner-2", 2),
+        (b"stream~owner-3", 3),
+        (b"stream~owner-4", 4),
+        (b"stream~owner-0", 42),
+    ]
+    assert await worker.migrate_legacy_streams(redis) == 0
+
+
+@pytest.mark.asyncio
+async def test_push_wakes_up_worker_once(redis):
+    wakeup_key = worker.get_stream_wakeup_key(worker.get_stream_shard("stream~owner"))
+
+    await worker.push(redis, "owner", "repo", 123, "pull_request", {"payload": 1})
+    assert await redis.lrange(wakeup_key, 0, -1) == [b"1"]
+    await redis.delete(wakeup_key)
+
+    # Already scheduled, the worker already knows about it
+    await worker.push(redis, "owner", "repo", 123, "pull_request", {"payload": 2})
+    assert await redis.lrange(wakeup_key, 0, -1) == []
+
+
+@pytest.mark.asyncio
+async def test_stream_selector_wait_for_stream(redis, monkeypatch):
+    monkeypatch.setattr("mergify_engine.worker.WORKER_PROCESSING_DELAY", 3000)
+    selector = worker.StreamSelector(redis, 0, 1)
+
+    # Nothing scheduled, wait for the timeout
+    assert await selector.next_stream() is None
+    started_at = time.monotonic()
+    await selector.wait_for_stream(0.2)
+    assert 0.2 <= time.monotonic() - started_at < 1
+
+    # Woken up by a push
+    waiter = asyncio.create_task(selector.wait_for_stream(10))
+    await asyncio.sleep(0.1)
+    assert not waiter.done()
+    await worker.push(redis, "owner", "repo", 123, "pull_request", {"payload": 1})
+    await asyncio.wait_for(waiter, timeout=2)
+
+    # The stream is due in 3000 seconds
+    assert await selector.next_stream() is None
+    assert selector._next_schedule_at is not None
+    assert selector._next_schedule_at - time.time() > 2990
+
+
+@pytest.mark.asyncio
+async def test_worker_idle_shutdown(redis, logger_checker):
+    w = worker.Worker(idle_block_time=60)
+    w.start()
+    await asyncio.sleep(1)
+    started_at = time.monotonic()
+    w.stop()
+    await w.wait_shutdown_complete()
+    assert time.monotonic() - started_at < 5
+
+
+def _pull_request_event(repo_id, pull_number, with_base=True):
+    data = {"repository": {"id": repo_id, "owner": {"id": 1}}}
+    if with_base:
+        data["pull_request"] = {
+            "number": pull_number,
+            "base": {"ref": "main", "repo": {"id": repo_id}},
+        }
+    return data
+
+
+def _record_engine_runs(run_engine):
+    runs = {}
+    lock = threading.Lock()
+
+    def fake_engine(owner, repo, pull_number, sources):
+        with lock:
+            runs[(repo, pull_number)] = [time.monotonic(), None]
+        time.sleep(0.3)
+        with lock:
+            runs[(repo, pull_number)][1] = time.monotonic()
+
+    run_engine.side_effect = fake_engine
+    return runs
+
+
+def _overlap(runs, a, b):
+    return runs[a][0] < runs[b][1] and runs[b][0] < runs[a][1]
+
+
+@pytest.mark.asyncio
+@mock.patch("mergify_engine.worker.run_engine")
+async def test_stream_processor_concurrency(run_engine, redis, logger_checker):
+    runs = _record_engine_runs(run_engine)
+    redis_cache = utils.get_redis_for_cache()
+    redis_cache.zadd("merge-queue~1~10~main", {"1": 1, "2": 2})
+    try:
+        for repo, repo_id, pull_number in (
+            ("repo", 10, 1),
+            ("repo", 10, 2),
+            ("repo", 10, 3),
+            ("other", 20, 1),
+        ):
+            await worker.push(
+                redis,
+                "owner",
+                repo,
+                pull_number,
+                "pull_request",
+                _pull_request_event(repo_id, pull_number),
+            )
+
+        p = worker.StreamProcessor(redis, concurrency=4)
+        try:
+            await p.consume("stream~owner")
+        finally:
+            p.close()
+    finally:
+        redis_cache.delete("merge-queue~1~10~main")
+
+    assert len(runs) == 4
+    # Pulls in the same merge queue are processed in order
+    assert runs[("repo", 1)][1] <= runs[("repo", 2)][0]
+    # Others don't wait
+    assert _overlap(runs, ("repo", 1), ("repo", 3))
+    assert _overlap(runs, ("repo", 1), ("other", 1))
+    assert 0 == (await worker.count_streams(redis))
+    assert 0 == len(await redis.keys("stream~*"))
+
+
+@pytest.mark.asyncio
+@mock.patch("mergify_engine.worker.run_engine")
+async def test_stream_processor_concurrency_unknown_base(
+    run_engine, redis, logger_checker
+):
+    runs = _record_engine_runs(run_engine)
+    for repo, repo_id, pull_number, with_base in (
+        ("repo", 10, 1, False),
+        ("repo", 10, 2, True),
+        ("other", 20, 1, True),
+    ):
+        await worker.push(
+            redis,
+            "owner",
+            repo,
+            pull_number,
+            "pull_request",
+            _pull_request_event(repo_id, pull_number, with_base),
+        )
+
+    p = worker.StreamProcessor(redis, concurrency=4)
+    try:
+        await p.consume("stream~owner")
+    finally:
+        p.close()
+
+    # The base branch of repo#1 is unknown, all pulls of repo are serialized
+    assert runs[("repo", 1)][1] <= runs[("repo", 2)][0]
+    assert _overlap(runs, ("repo", 1), ("other", 1))
+    # Only one thread per lane is needed
+    assert len(p._threads) == 2
+
+
+@pytest.mark.asyncio
+@mock.patch("mergify_engine.worker.run_engine")
+@mock.patch("mergify_engine.clients.github.aget_client")
+@mock.patch("mergify_engine.github_events.extract_pull_numbers_from_event")
+async def test_stream_processor_redis_round_trips(
+    extract_pull_numbers_from_event,
+    aget_client,
+    run_engine,
+    redis,
+    logger_checker,
+):
+    client = mock.Mock(auth=mock.Mock(owner="owner"))
+    client.__aenter__ = mock.AsyncMock(return_value=client)
+    client.__aexit__ = mock.AsyncMock()
+    client.items.return_value = mock.AsyncMock()
+    aget_client.return_value = client
+    extract_pull_numbers_from_event.return_value = [1, 2, 3]
+
+    for pull_number in range(1, 6):
+        await worker.push(
+            redis, "owner", "repo", pull_number, "pull_request", {"payload": 1}
+        )
+    await worker.push(redis, "owner", "repo", None, "push", {"payload": 2})
+    await redis.hset("attempts", "pull~owner~repo~1", 2)
+
+    p = worker.StreamProcessor(redis)
+    try:
+        with mock.patch.object(worker, "statsd") as statsd:
+            await p.consume("stream~owner")
+    finally:
+        p.close()
+
+    assert len(run_engine.mock_calls) == 5
+    # XRANGE, the expansion of the push event and the final cleanup
+    statsd.histogram.assert_any_call("engine.streams.redis_round_trips", 3)
+    assert 0 == (await worker.count_streams(redis))
+    assert 0 == len(await redis.keys("stream~*"))
+    assert 0 == len(await redis.hgetall("attempts"))
+
+
+@pytest.mark.asyncio
+@mock.patch("mergify_engine.worker.run_engine")
+async def test_stream_processor_ack_before_stream_retry(
+    run_engine, redis, logger_checker
+):
+    def fake_engine(owner, repo, pull_number, sources):
+        if pull_number == 2:
+            raise httpx.ReadError("boom", request=mock.Mock())
+
+    run_engine.side_effect = fake_engine
+    for pull_number in (1, 2, 3):
+        await worker.push(
+            redis, "owner", "repo", pull_number, "pull_request", {"payload": 1}
+        )
+
+    p = worker.StreamProcessor(redis)
+    try:
+        await p.consume("stream~owner")
+    finally:
+        p.close()
+
+    # The first pull is acknowledged, the stream is retried later
+    assert len(run_engine.mock_calls) == 2
+    assert 2 == (await redis.xlen("stream~owner"))
+    assert {b"stream~owner": b"1"} == (await redis.hgetall("attempts"))
+    score = (await worker.get_streams(redis))[0][1]
+    assert score > time.time()
+
+
+@pytest.mark.asyncio
+@mock.patch.object(config, "MERGEABLE_STATE_REQUEUE_DELAY", 5)
+@mock.patch("mergify_engine.worker.run_engine")
+async def test_stream_processor_delays_pull_with_unknown_mergeable_state(
+    run_engine, redis, logger_checker
+):
+    def fake_engine(owner, repo, pull_number, sources):
+        if pull_number == 1:
+            raise exceptions.MergeableStateUnknown(mock.Mock())
+
+    run_engine.side_effect = fake_engine
+    for pull_number in (1, 2):
+        await worker.push(
+            redis, "owner", "repo", pull_number, "pull_request", {"payload": 1}
+        )
+
+    p = worker.StreamProcessor(redis)
+    try:
+        await p.consume("stream~owner")
+    finally:
+        p.close()
+
+    # Both pulls are processed, the first one is parked with its events
+    assert len(run_engine.mock_calls) == 2
+    assert 0 == (await worker.count_streams(redis))
+    assert 0 == (await redis.xlen("stream~owner"))
+    assert {b"pull~owner~repo~1": b"1"} == (await redis.hgetall("attempts"))
+    delayed = await redis.zrange(worker.DELAYED_PULLS_KEY, 0, -1, withscores=True)
+    assert [b"owner~repo~1"] == [member for member, _ in delayed]
+    assert delayed[0][1] == pytest.approx(time.time() + 5, abs=1)
+
+    # Not due yet
+    assert 0 == (await worker.requeue_due_delayed_pulls(redis))
+
+    with freeze_time(datetime.datetime.utcnow() + datetime.timedelta(seconds=10)):
+        assert 1 == (await worker.requeue_due_delayed_pulls(redis))
+    assert 0 == (await redis.zcard(worker.DELAYED_PULLS_KEY))
+    assert 1 == (await worker.count_streams(redis))
+    messages = await redis.xrange("stream~owner")
+    assert 1 == len(messages)
+
+    # The original event is processed again
+    p = worker.StreamProcessor(redis)
+    try:
+        await p.consume("stream~owner")
+    finally:
+        p.close()
+    assert run_engine.mock_calls[2] == mock.call(
+        "owner",
+        "repo",
+        1,
+        [{"event_type": "pull_request", "data": {"payload": 1}, "timestamp": mock.ANY}],
+    )
+    assert 1 == (await redis.zcard(worker.DELAYED_PULLS_KEY))
+    assert {b"pull~owner~repo~1": b"2"} == (await redis.hgetall("attempts"))
+
+    # A webhook with the computed state requeues it immediately
+    assert await worker.requeue_delayed_pull(redis, "owner", "repo", 1)
+    assert not await worker.requeue_delayed_pull(redis, "owner", "repo", 1)
+    assert 1 == (await redis.xlen("stream~owner"))
+
+
+@pytest.mark.asyncio
+@mock.patch.object(config, "QUEUE_REFRESH_BATCHING", True)
+@mock.patch("mergify_engine.worker.run_engine")
+async def test_stream_processor_pushes_queue_refreshes(
+    run_engine, redis, logger_checker
+):
+    def fake_engine(owner, repo, pull_number, sources):
+        q = queue.Queue(mock.Mock(), 1, owner, 10, repo, "main")
+        q._refresh_pulls([2, 3])
+
+    run_engine.side_effect = fake_engine
+    for pull_number in (1, 2):
+        await worker.push(
+            redis, "owner", "repo", pull_number, "pull_request", {"payload": 1}
+        )
+
+    p = worker.StreamProcessor(redis)
+    try:
+        await p.consume("stream~owner")
+    finally:
+        p.close()
+
+    # The refreshes of both engine runs are pushed once
+    assert len(run_engine.mock_calls) == 2
+    assert [] == queue.pop_pending_refreshes()
+    events = [
+        msgpack.unpackb(message[b"event"], raw=False)
+        for _, message in await redis.xrange("stream~owner")
+    ]
+    assert [(e["pull_number"], e["source"]["event_type"]) for e in events] == [
+        (2, "refresh"),
+        (3, "refresh"),
+    ]
+    assert 1 == (await worker.count_streams(redis))
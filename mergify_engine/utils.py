@@ -21,6 +21,7 @@ import shutil
 import socket
 import subprocess
 import tempfile
+import threading
 import typing
 import urllib.parse
 
@@ -105,14 +106,70 @@ def compute_hmac(data):
 
 async def async_main(*awaitables):
     # NOTE(sileht): This looks useless but
-    #   asyncio.run(asyncio.gather(...))
+    #   loop.run_until_complete(asyncio.gather(...))
     # does not work, because when the gather() coroutine is created, it need the current
-    # loop but asyncio.run() haven't create it yet, so it doesn't work.
+    # loop but the loop isn't running yet, so it doesn't work.
     return await asyncio.gather(*awaitables, return_exceptions=True)
 
 
+T = typing.TypeVar("T")
+
+_THREAD_LOCAL = threading.local()
+
+
+def get_thread_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop of the current thread, creating it if needed.
+
+    asyncio.run() creates and tears down a new event loop on each call, which
+    is expensive when the engine thread runs dozens of coroutines per pull
+    request. Once a thread has called this method, run_coroutine() reuses
+    this loop until close_thread_event_loop() is called. Tasks left behind by
+    a coroutine (e.g. aredis idle connection reapers) only make progress
+    during the next run_coroutine() call and are cancelled on close.
+
+    The loop is not installed with asyncio.set_event_loop(), so it never
+    conflicts with a loop owned by the caller.
+    """
+    loop: typing.Optional[asyncio.AbstractEventLoop] = getattr(
+        _THREAD_LOCAL, "loop", None
+    )
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _THREAD_LOCAL.loop = loop
+    return loop
+
+
+def close_thread_event_loop() -> None:
+    loop = getattr(_THREAD_LOCAL, "loop", None)
+    if loop is None:
+        return
+
+    _THREAD_LOCAL.loop = None
+    if loop.is_closed():
+        return
+
+    try:
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+    finally:
+        loop.close()
+
+
+def run_coroutine(coro: typing.Coroutine[typing.Any, typing.Any, T]) -> T:
+    loop: typing.Optional[asyncio.AbstractEventLoop] = getattr(
+        _THREAD_LOCAL, "loop", None
+    )
+    if loop is None or loop.is_closed():
+        return asyncio.run(coro)
+    return loop.run_until_complete(coro)
+
+
 def async_run(*awaitables):
-    return asyncio.run(async_main(*awaitables))
+    return run_coroutine(async_main(*awaitables))
 
 
 class Gitter(object):
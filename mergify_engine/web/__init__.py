@@ -29,6 +29,7 @@ from mergify_engine import config
 from mergify_engine import exceptions
 from mergify_engine import github_events
 from mergify_engine import github_types
+from mergify_engine import queue
 from mergify_engine import subscription
 from mergify_engine import utils
 from mergify_engine.clients import github
@@ -318,10 +319,11 @@ async def marketplace_handler(
 async def queues(installation_id):
     installation = await github_app.get_installation_from_id(installation_id)
     queues = collections.defaultdict(dict)
-    async for queue in _AREDIS_CACHE.scan_iter(
-        match=f"merge-queue~{installation['account']['id']}~*"
+    owner_id = installation["account"]["id"]
+    for queue_name in await _AREDIS_CACHE.smembers(
+        queue.get_redis_owner_queues_key(owner_id)
     ):
-        _, _, repo_id, branch = queue.split("~")
+        repo_id, branch = queue_name.split("~", 1)
         owner = installation["account"]["login"]
         async with await github.aget_client(owner) as client:
             try:
@@ -334,7 +336,10 @@ async def queues(installation_id):
                     },
                 )
             queues[owner + "/" + repo["name"]][branch] = [
-                int(pull) async for pull, _ in _AREDIS_CACHE.zscan_iter(queue)
+                int(pull)
+                async for pull, _ in _AREDIS_CACHE.zscan_iter(
+                    queue.get_redis_queue_key(owner_id, int(repo_id), branch)
+                )
             ]
 
     return responses.JSONResponse(status_code=200, content=queues)
@@ -15,6 +15,8 @@
 import argparse
 import asyncio
 import collections
+import concurrent.futures
+import contextlib
 import dataclasses
 import datetime
 import functools
@@ -22,12 +24,14 @@ import hashlib
 import itertools
 import logging
 import os
+from queue import SimpleQueue
 import signal
 import threading
 import time
 import typing
 
 import aredis
+import aredis.scripting
 import daiquiri
 from datadog import statsd
 import msgpack
@@ -40,6 +44,9 @@ from mergify_engine import exceptions
 from mergify_engine import github_events
 from mergify_engine import github_types
 from mergify_engine import logs
+from mergify_engine import opened_pulls
+from mergify_engine import pull_snapshots
+from mergify_engine import queue
 from mergify_engine import subscription
 from mergify_engine import utils
 from mergify_engine.clients import github
@@ -53,7 +60,6 @@ except ImportError:
     class vcr_errors_CannotOverwriteExistingCassetteException(Exception):
         pass
 
-
 else:
     vcr_errors_CannotOverwriteExistingCassetteException: Exception = (  # type: ignore
         vcr.errors.CannotOverwriteExistingCassetteException
@@ -67,6 +73,104 @@ MAX_RETRIES: int = 3
 WORKER_PROCESSING_DELAY: float = 30
 STREAM_ATTEMPTS_LOGGING_THRESHOLD: int = 20
 
+# NOTE: Streams are spread over a fixed number of sorted sets, each worker
+# owns the shards where `shard % worker_count == worker_id`. This number must
+# be greater than the number of workers and must not change without migrating
+# the existing shards.
+STREAM_SHARDS: int = 128
+# Sorted set used before streams were sharded, see migrate_legacy_streams()
+LEGACY_STREAMS_KEY = "streams"
+
+# NOTE: Pull requests with an unknown mergeable_state are parked in this
+# sorted set, scored by the date they must be processed again, while GitHub
+# computes it. Their events are kept in a list per pull request and pushed
+# back to the stream when due. See MERGEABLE_STATE_REQUEUE_DELAY.
+DELAYED_PULLS_KEY = "delayed-pulls"
+DELAYED_PULL_MAX_ATTEMPTS: int = 10
+DELAYED_PULL_MAX_DELAY: float = 300
+
+
+def get_stream_shard(stream_name: typing.Union[str, bytes]) -> int:
+    if isinstance(stream_name, str):
+        stream_name = stream_name.encode()
+    return int(hashlib.md5(stream_name).hexdigest(), 16) % STREAM_SHARDS
+
+
+def get_stream_shard_key(stream_name: typing.Union[str, bytes]) -> str:
+    return f"streams~{get_stream_shard(stream_name)}"
+
+
+def get_stream_shard_keys() -> typing.List[str]:
+    return [f"streams~{shard}" for shard in range(STREAM_SHARDS)]
+
+
+def get_worker_shards(worker_id: int, worker_count: int) -> typing.List[int]:
+    return [
+        shard for shard in range(STREAM_SHARDS) if shard % worker_count == worker_id
+    ]
+
+
+# NOTE: Idle workers block on the wake-up lists of their shards, a message is
+# pushed when the schedule of a shard changes. Lists are trimmed to a single
+# message, as one is enough to wake up the worker.
+def get_stream_wakeup_key(shard: int) -> str:
+    return f"streams-wakeup~{shard}"
+
+
+async def wakeup_shards(
+    redis: aredis.StrictRedis, shards: typing.Iterable[int]
+) -> None:
+    pipe = await redis.pipeline()
+    for shard in shards:
+        await pipe.rpush(get_stream_wakeup_key(shard), 1)
+        await pipe.ltrim(get_stream_wakeup_key(shard), 0, 0)
+    await pipe.execute()
+
+
+async def get_streams(
+    redis: aredis.StrictRedis, max_score: typing.Union[float, str] = "+inf"
+) -> typing.List[typing.Tuple[bytes, float]]:
+    """Return all scheduled streams of all shards, sorted by score."""
+    pipe = await redis.pipeline()
+    for key in get_stream_shard_keys():
+        await pipe.zrangebyscore(key, min=0, max=max_score, withscores=True)
+    streams = itertools.chain.from_iterable(await pipe.execute())
+    return sorted(streams, key=lambda item: item[1])
+
+
+async def count_streams(redis: aredis.StrictRedis) -> int:
+    pipe = await redis.pipeline()
+    for key in get_stream_shard_keys():
+        await pipe.zcard(key)
+    return sum(await pipe.execute())
+
+
+async def migrate_legacy_streams(
+    redis: aredis.StrictRedis, batch_size: int = 1000
+) -> int:
+    """Move the streams of the legacy `streams` key to their shard.
+
+    Processes that are not yet upgraded may still schedule streams in the
+    legacy key, so this is safe to call repeatedly.
+    """
+    migrated = 0
+    while True:
+        streams = await redis.zrange(
+            LEGACY_STREAMS_KEY, 0, batch_size - 1, withscores=True
+        )
+        if not streams:
+            return migrated
+        pipe = await redis.pipeline()
+        for stream_name, score in streams:
+            await pipe.zaddoption(
+                get_stream_shard_key(stream_name), "NX", **{stream_name.decode(): score}
+            )
+        await pipe.zrem(LEGACY_STREAMS_KEY, *(stream for stream, _ in streams))
+        await pipe.execute()
+        await wakeup_shards(redis, {get_stream_shard(s) for s, _ in streams})
+        migrated += len(streams)
+        LOG.info("legacy streams migrated", count=migrated)
+
 
 class IgnoredException(Exception):
     pass
@@ -92,6 +196,12 @@ class StreamUnused(Exception):
     stream_name: str
 
 
+@dataclasses.dataclass
+class PullDelayed(Exception):
+    attempts: int
+    retry_at: datetime.datetime
+
+
 T_Payload = typing.Dict[bytes, bytes]
 
 
@@ -102,6 +212,20 @@ class T_PayloadEvent(typing.TypedDict):
     source: context.T_PayloadEventSource
 
 
+# Schedule the stream and wake up its worker if it was not already scheduled
+SCHEDULE_STREAM_SCRIPT = """
+local shard_key = KEYS[1]
+local wakeup_key = KEYS[2]
+local score = ARGV[1]
+local stream_name = ARGV[2]
+
+if redis.call("ZADD", shard_key, "NX", score, stream_name) == 1 then
+    redis.call("RPUSH", wakeup_key, 1)
+    redis.call("LTRIM", wakeup_key, 0, 0)
+end
+"""
+
+
 @tenacity.retry(
     wait=tenacity.wait_exponential(multiplier=0.2),
     stop=tenacity.stop_after_attempt(5),
@@ -115,54 +239,201 @@ async def push(
     event_type: github_types.GitHubEventType,
     data: github_types.GitHubEvent,
 ) -> typing.Tuple[bool, T_Payload]:
-    stream_name = f"stream~{owner}"
-    scheduled_at = utils.utcnow() + datetime.timedelta(seconds=WORKER_PROCESSING_DELAY)
-    score = scheduled_at.timestamp()
     transaction = await redis.pipeline()
-    # NOTE(sileht): Add this event to the pull request stream
-    payload = {
-        b"event": msgpack.packb(
+    payload = await _push_to_pipeline(
+        transaction, owner, repo, pull_number, event_type, data
+    )
+    ret = await transaction.execute()
+    LOG.debug(
+        "pushed to worker",
+        gh_owner=owner,
+        gh_repo=repo,
+        gh_pull=pull_number,
+        event_type=event_type,
+    )
+    return (ret[0], payload)
+
+
+def _pack_event(
+    owner: str,
+    repo: str,
+    pull_number: typing.Optional[int],
+    source: context.T_PayloadEventSource,
+) -> bytes:
+    return typing.cast(
+        bytes,
+        msgpack.packb(
             {
                 "owner": owner,
                 "repo": repo,
                 "pull_number": pull_number,
-                "source": {
-                    "event_type": event_type,
-                    "data": data,
-                    "timestamp": datetime.datetime.utcnow().isoformat(),
-                },
+                "source": source,
             },
             use_bin_type=True,
         ),
+    )
+
+
+async def _push_to_pipeline(
+    transaction: aredis.pipeline.StrictPipeline,
+    owner: str,
+    repo: str,
+    pull_number: typing.Optional[int],
+    event_type: github_types.GitHubEventType,
+    data: github_types.GitHubEvent,
+) -> T_Payload:
+    """Add the commands that push an event to the pipeline.
+
+    The first result of the pipeline for these commands is the message id.
+    """
+    stream_name = f"stream~{owner}"
+    scheduled_at = utils.utcnow() + datetime.timedelta(seconds=WORKER_PROCESSING_DELAY)
+    score = scheduled_at.timestamp()
+    # NOTE(sileht): Add this event to the pull request stream
+    payload = {
+        b"event": _pack_event(
+            owner,
+            repo,
+            pull_number,
+            {
+                "event_type": event_type,
+                "data": data,
+                "timestamp": datetime.datetime.utcnow().isoformat(),
+            },
+        ),
     }
 
     await transaction.xadd(stream_name, payload)
     # NOTE(sileht): Add pull request stream to process to the list, only if it
     # does not exists, to not update the score(date)
-    await transaction.zaddoption("streams", "NX", **{stream_name: score})
-    ret = await transaction.execute()
-    LOG.debug(
-        "pushed to worker",
-        gh_owner=owner,
-        gh_repo=repo,
-        gh_pull=pull_number,
-        event_type=event_type,
+    shard = get_stream_shard(stream_name)
+    await transaction.eval(
+        SCHEDULE_STREAM_SCRIPT,
+        2,
+        f"streams~{shard}",
+        get_stream_wakeup_key(shard),
+        score,
+        stream_name,
     )
-    return (ret[0], payload)
+    return payload
+
+
+def get_delayed_pull_events_key(owner: str, repo: str, pull_number: int) -> str:
+    return f"delayed-pull-events~{owner}~{repo}~{pull_number}"
+
+
+async def delay_pull(
+    redis: aredis.StrictRedis,
+    owner: str,
+    repo: str,
+    pull_number: int,
+    sources: typing.List[context.T_PayloadEventSource],
+    attempts: int,
+) -> datetime.datetime:
+    """Park the pull request and its events until the returned date."""
+    retry_in = min(
+        config.MERGEABLE_STATE_REQUEUE_DELAY * 2 ** (attempts - 1),
+        DELAYED_PULL_MAX_DELAY,
+    )
+    retry_at: datetime.datetime = utils.utcnow() + datetime.timedelta(seconds=retry_in)
+    events_key = get_delayed_pull_events_key(owner, repo, pull_number)
+    transaction = await redis.pipeline()
+    await transaction.delete(events_key)
+    await transaction.rpush(
+        events_key,
+        *(_pack_event(owner, repo, pull_number, source) for source in sources),
+    )
+    await transaction.zadd(
+        DELAYED_PULLS_KEY, **{f"{owner}~{repo}~{pull_number}": retry_at.timestamp()}
+    )
+    await transaction.execute()
+    return retry_at
+
+
+# Move the events of a delayed pull request back to its stream and schedule
+# the stream now. Nothing is done if the pull request is not delayed anymore,
+# so concurrent requeues of the same pull request are harmless.
+REQUEUE_DELAYED_PULL_SCRIPT = """
+local delayed_pulls_key = KEYS[1]
+local events_key = KEYS[2]
+local stream_name = KEYS[3]
+local shard_key = KEYS[4]
+local wakeup_key = KEYS[5]
+local delayed_pull = ARGV[1]
+local score = ARGV[2]
+
+if redis.call("ZREM", delayed_pulls_key, delayed_pull) == 0 then
+    return 0
+end
+
+local events = redis.call("LRANGE", events_key, 0, -1)
+for _, event in ipairs(events) do
+    redis.call("XADD", stream_name, "*", "event", event)
+end
+redis.call("DEL", events_key)
+
+if #events > 0 and redis.call("ZADD", shard_key, "NX", score, stream_name) == 1 then
+    redis.call("RPUSH", wakeup_key, 1)
+    redis.call("LTRIM", wakeup_key, 0, 0)
+end
+return 1
+"""
+
+
+async def requeue_delayed_pull(
+    redis: aredis.StrictRedis, owner: str, repo: str, pull_number: int
+) -> bool:
+    """Push back the events of a delayed pull request to its stream."""
+    stream_name = f"stream~{owner}"
+    requeued = await redis.eval(
+        REQUEUE_DELAYED_PULL_SCRIPT,
+        5,
+        DELAYED_PULLS_KEY,
+        get_delayed_pull_events_key(owner, repo, pull_number),
+        stream_name,
+        get_stream_shard_key(stream_name),
+        get_stream_wakeup_key(get_stream_shard(stream_name)),
+        f"{owner}~{repo}~{pull_number}",
+        time.time(),
+    )
+    return bool(requeued)
+
+
+async def requeue_due_delayed_pulls(redis: aredis.StrictRedis) -> int:
+    requeued = 0
+    for delayed_pull in await redis.zrangebyscore(
+        DELAYED_PULLS_KEY, min=0, max=time.time()
+    ):
+        owner, repo, pull_number = delayed_pull.decode().split("~")
+        if await requeue_delayed_pull(redis, owner, repo, int(pull_number)):
+            requeued += 1
+    if requeued:
+        statsd.increment("engine.delayed_pulls.requeued", requeued)
+    return requeued
 
 
 async def get_pull_for_engine(
-    owner: str, repo: str, pull_number: int, logger: logging.LoggerAdapter
+    owner: str,
+    repo: str,
+    pull_number: int,
+    logger: logging.LoggerAdapter,
+    sources: typing.Optional[typing.List[context.T_PayloadEventSource]] = None,
 ) -> typing.Optional[
     typing.Tuple[subscription.Subscription, github_types.GitHubPullRequest]
 ]:
+    redis_cache = await utils.get_aredis_for_cache()
     async with await github.aget_client(owner) as client:
-        try:
-            pull = await client.item(f"/repos/{owner}/{repo}/pulls/{pull_number}")
-        except http.HTTPNotFound:
-            # NOTE(sileht): Don't fail if we received even on repo/pull that doesn't exists anymore
-            logger.debug("pull request doesn't exists, skipping it")
-            return None
+        pull = await pull_snapshots.get(
+            redis_cache, owner, repo, pull_number, sources or []
+        )
+        if pull is None:
+            try:
+                pull = await client.item(f"/repos/{owner}/{repo}/pulls/{pull_number}")
+            except http.HTTPNotFound:
+                # NOTE(sileht): Don't fail if we received even on repo/pull that doesn't exists anymore
+                logger.debug("pull request doesn't exists, skipping it")
+                return None
+            await pull_snapshots.store(redis_cache, owner, repo, pull)
 
         if client.auth.owner_id is None:
             raise RuntimeError("owner_id is None")
@@ -183,7 +454,9 @@ def run_engine(
     )
     logger.debug("engine in thread start")
     try:
-        result = asyncio.run(get_pull_for_engine(owner, repo, pull_number, logger))
+        result = utils.run_coroutine(
+            get_pull_for_engine(owner, repo, pull_number, logger, sources)
+        )
         if result:
             subscription, pull = result
             with github.get_client(owner) as client:
@@ -197,53 +470,38 @@ class ThreadRunner(threading.Thread):
 
     def __init__(self):
         super().__init__(daemon=True)
-        self._method = None
-        self._args = None
-        self._kwargs = None
-        self._result = None
-        self._exception = None
-
-        self._stopping = threading.Event()
-        self._process = threading.Event()
+        self._jobs: SimpleQueue = SimpleQueue()
         self.start()
 
     async def exec(self, method, *args, **kwargs):
-        self._method = method
-        self._args = args
-        self._kwargs = kwargs
-        self._result = None
-        self._exception = None
-
-        self._process.set()
-        while self._process.is_set():
-            await asyncio.sleep(0.01)
-
-        if self._stopping.is_set():
-            return
-
-        if self._exception:
-            raise self._exception
-
-        return self._result
+        # The worker loop awaits a future instead of polling the thread state,
+        # so it's woken up as soon as the engine returns.
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._jobs.put((future, method, args, kwargs))
+        return await asyncio.wrap_future(future)
 
     def close(self):
-        self._stopping.set()
-        self._process.set()
+        self._jobs.put(None)
         self.join()
 
     def run(self):
-        while not self._stopping.is_set():
-            self._process.wait()
-            if self._stopping.is_set():
-                self._process.clear()
-                return
+        utils.get_thread_event_loop()
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    return
 
-            try:
-                self._result = self._method(*self._args, **self._kwargs)
-            except BaseException as e:
-                self._exception = e
-            finally:
-                self._process.clear()
+                future, method, args, kwargs = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                try:
+                    future.set_result(method(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            utils.close_thread_event_loop()
 
 
 PullsToConsume = typing.NewType(
@@ -254,6 +512,18 @@ PullsToConsume = typing.NewType(
     ],
 )
 
+PullToConsume = typing.Tuple[
+    typing.Tuple[str, str, int],
+    typing.Tuple[typing.List[str], typing.List[context.T_PayloadEventSource]],
+]
+
+OpenedPullsByRepo = typing.Dict[
+    typing.Tuple[str, str], typing.List[github_types.GitHubPullRequest]
+]
+
+# owner id, repo id, base branch
+PullBase = typing.Tuple[int, int, str]
+
 
 @dataclasses.dataclass
 class StreamSelector:
@@ -261,33 +531,122 @@ class StreamSelector:
     worker_id: int
     worker_count: int
 
-    def get_worker_id_for(self, stream: bytes) -> int:
-        return int(hashlib.md5(stream).hexdigest(), 16) % self.worker_count
+    _shard_keys: typing.List[str] = dataclasses.field(init=False)
+    _wakeup_keys: typing.List[str] = dataclasses.field(init=False)
+    _next_stream_script: aredis.scripting.Script = dataclasses.field(init=False)
+    _next_schedule_at: typing.Optional[float] = dataclasses.field(
+        init=False, default=None
+    )
 
-    def _is_stream_for_me(self, stream: bytes) -> bool:
-        return self.get_worker_id_for(stream) == self.worker_id
+    # Return the stream with the lowest score among the shards of this worker
+    # if it is due, and the lowest score
+    NEXT_STREAM_SCRIPT = """
+local now = tonumber(ARGV[1])
+local selected = false
+local selected_score = false
+
+for _, key in ipairs(KEYS) do
+    local streams = redis.call("ZRANGE", key, 0, 0, "WITHSCORES")
+    if streams[1] then
+        if not selected_score or tonumber(streams[2]) < tonumber(selected_score) then
+            selected = streams[1]
+            selected_score = streams[2]
+        end
+    end
+end
+
+if selected_score and tonumber(selected_score) <= now then
+    return {selected, selected_score}
+end
+return {false, selected_score}
+"""
+
+    def __post_init__(self):
+        shards = get_worker_shards(self.worker_id, self.worker_count)
+        self._shard_keys = [f"streams~{shard}" for shard in shards]
+        self._wakeup_keys = [get_stream_wakeup_key(shard) for shard in shards]
+        self._next_stream_script = self.redis.register_script(self.NEXT_STREAM_SCRIPT)
+
+    def get_worker_id_for(self, stream: bytes) -> int:
+        return get_stream_shard(stream) % self.worker_count
 
     async def next_stream(self):
-        now = time.time()
-        for stream in await self.redis.zrangebyscore(
-            "streams",
-            min=0,
-            max=now,
-        ):
-            if self._is_stream_for_me(stream):
-                statsd.increment(
-                    "engine.streams.selected", tags=[f"worker_id:{self.worker_id}"]
-                )
-                return stream.decode()
+        if not self._shard_keys:
+            return None
+
+        stream, score = await self._next_stream_script.execute(
+            keys=self._shard_keys, args=[time.time()]
+        )
+        self._next_schedule_at = None if score is None else float(score)
+        if stream:
+            statsd.increment(
+                "engine.streams.selected", tags=[f"worker_id:{self.worker_id}"]
+            )
+            return stream.decode()
+
+    async def wait_for_stream(self, timeout: float) -> None:
+        """Wait until a stream may be due or the schedule of our shards changes.
+
+        The caller must call next_stream() again once this returns.
+        """
+        if self._next_schedule_at is not None:
+            timeout = min(timeout, self._next_schedule_at - time.time())
+
+        if timeout <= 0:
+            return
+        elif timeout < 1 or not self._wakeup_keys:
+            # BLPOP timeout has a one second resolution
+            await asyncio.sleep(timeout)
+        else:
+            await self.redis.blpop(self._wakeup_keys, timeout=int(timeout))
 
 
 @dataclasses.dataclass
 class StreamProcessor:
     redis: aredis.StrictRedis
-    _thread: ThreadRunner = dataclasses.field(init=False, default_factory=ThreadRunner)
+    # Maximum number of pull requests of a stream processed at the same time
+    concurrency: int = config.STREAM_PULLS_CONCURRENCY
+
+    _threads: typing.List[ThreadRunner] = dataclasses.field(
+        init=False, default_factory=list
+    )
+    _idle_threads: "asyncio.Queue[ThreadRunner]" = dataclasses.field(
+        init=False, default_factory=asyncio.Queue
+    )
+
+    # NOTE: Acknowledgements and attempts resets of the stream being consumed,
+    # flushed in a single call at the end of consume(). If the process dies
+    # before, the events are processed again.
+    _acked_message_ids: typing.List[str] = dataclasses.field(
+        init=False, default_factory=list
+    )
+    _reset_attempts: typing.Set[str] = dataclasses.field(
+        init=False, default_factory=set
+    )
+    _redis_round_trips: int = dataclasses.field(init=False, default=0)
 
     def close(self):
-        self._thread.close()
+        for thread in self._threads:
+            thread.close()
+
+    @contextlib.asynccontextmanager
+    async def _get_thread(self) -> typing.AsyncIterator[ThreadRunner]:
+        if self._idle_threads.empty() and len(self._threads) < self.concurrency:
+            thread = ThreadRunner()
+            self._threads.append(thread)
+        else:
+            thread = await self._idle_threads.get()
+        try:
+            yield thread
+        finally:
+            self._idle_threads.put_nowait(thread)
+
+    def _reset_attempts_of(
+        self, stream_name: str, attempts_key: typing.Optional[str] = None
+    ) -> None:
+        if attempts_key:
+            self._reset_attempts.add(attempts_key)
+        self._reset_attempts.add(stream_name)
 
     async def _translate_exception_to_retries(
         self,
@@ -296,9 +655,7 @@ class StreamProcessor:
         attempts_key: typing.Optional[str] = None,
     ) -> Exception:
         if isinstance(e, exceptions.MergifyNotInstalled):
-            if attempts_key:
-                await self.redis.hdel("attempts", attempts_key)
-            await self.redis.hdel("attempts", stream_name)
+            self._reset_attempts_of(stream_name, attempts_key)
             return StreamUnused(stream_name)
 
         if isinstance(e, github.TooManyPages):
@@ -306,24 +663,21 @@ class StreamProcessor:
             # appropriate check-runs to inform user the PR is too big to be handled
             # by Mergify, but this need a bit of refactory to do it, so in the
             # meantimes...
-            if attempts_key:
-                await self.redis.hdel("attempts", attempts_key)
-            await self.redis.hdel("attempts", stream_name)
+            self._reset_attempts_of(stream_name, attempts_key)
             return IgnoredException()
 
         if exceptions.should_be_ignored(e):
-            if attempts_key:
-                await self.redis.hdel("attempts", attempts_key)
-            await self.redis.hdel("attempts", stream_name)
+            self._reset_attempts_of(stream_name, attempts_key)
             return IgnoredException()
 
         if isinstance(e, exceptions.RateLimited):
             retry_at = utils.utcnow() + e.countdown
             score = retry_at.timestamp()
-            if attempts_key:
-                await self.redis.hdel("attempts", attempts_key)
-            await self.redis.hdel("attempts", stream_name)
-            await self.redis.zaddoption("streams", "XX", **{stream_name: score})
+            self._reset_attempts_of(stream_name, attempts_key)
+            self._redis_round_trips += 1
+            await self.redis.zaddoption(
+                get_stream_shard_key(stream_name), "XX", **{stream_name: score}
+            )
             return StreamRetry(stream_name, 0, retry_at)
 
         backoff = exceptions.need_retry(e)
@@ -332,11 +686,15 @@ class StreamProcessor:
             # without increasing the attempts
             return e
 
+        self._reset_attempts.discard(stream_name)
+        self._redis_round_trips += 2
         attempts = await self.redis.hincrby("attempts", stream_name)
         retry_in = 3 ** min(attempts, 3) * backoff
         retry_at = utils.utcnow() + retry_in
         score = retry_at.timestamp()
-        await self.redis.zaddoption("streams", "XX", **{stream_name: score})
+        await self.redis.zaddoption(
+            get_stream_shard_key(stream_name), "XX", **{stream_name: score}
+        )
         return StreamRetry(stream_name, attempts, retry_at)
 
     async def _run_engine_and_translate_exception_to_retries(
@@ -349,22 +707,35 @@ class StreamProcessor:
     ) -> None:
         attempts_key = f"pull~{owner}~{repo}~{pull_number}"
         try:
-            await self._thread.exec(
-                run_engine,
-                owner,
-                repo,
-                pull_number,
-                sources,
-            )
-            await self.redis.hdel("attempts", attempts_key)
+            async with self._get_thread() as thread:
+                await thread.exec(
+                    run_engine,
+                    owner,
+                    repo,
+                    pull_number,
+                    sources,
+                )
+            self._reset_attempts.add(attempts_key)
         # Translate in more understandable exception
         except exceptions.MergeableStateUnknown as e:
+            self._redis_round_trips += 1
             attempts = await self.redis.hincrby("attempts", attempts_key)
-            if attempts < MAX_RETRIES:
-                raise PullRetry(attempts) from e
+            if config.MERGEABLE_STATE_REQUEUE_DELAY:
+                max_attempts = DELAYED_PULL_MAX_ATTEMPTS
             else:
-                await self.redis.hdel("attempts", attempts_key)
+                max_attempts = MAX_RETRIES
+
+            if attempts >= max_attempts:
+                self._reset_attempts.add(attempts_key)
                 raise MaxPullRetry(attempts) from e
+            elif config.MERGEABLE_STATE_REQUEUE_DELAY:
+                self._redis_round_trips += 1
+                retry_at = await delay_pull(
+                    self.redis, owner, repo, pull_number, sources, attempts
+                )
+                raise PullDelayed(attempts, retry_at) from e
+            else:
+                raise PullRetry(attempts) from e
 
         except Exception as e:
             raise await self._translate_exception_to_retries(
@@ -373,12 +744,19 @@ class StreamProcessor:
 
     async def consume(self, stream_name: str) -> None:
         owner = stream_name.split("~", 1)[1]
+        self._acked_message_ids = []
+        self._reset_attempts = set()
+        self._redis_round_trips = 0
+        reschedule = True
 
         try:
-            pulls = await self._extract_pulls_from_stream(stream_name)
-            await self._consume_pulls(stream_name, pulls)
+            pulls, opened_pulls_by_repo = await self._extract_pulls_from_stream(
+                stream_name
+            )
+            await self._consume_pulls(stream_name, pulls, opened_pulls_by_repo)
         except StreamUnused:
             LOG.info("unused stream, dropping it", gh_owner=owner, exc_info=True)
+            self._redis_round_trips += 1
             await self.redis.delete(stream_name)
         except StreamRetry as e:
             log_method = (
@@ -393,7 +771,8 @@ class StreamProcessor:
                 gh_owner=owner,
                 exc_info=True,
             )
-            return
+            # The stream has already been rescheduled
+            reschedule = False
         except vcr_errors_CannotOverwriteExistingCassetteException:
             messages = await self.redis.xrange(
                 stream_name, count=config.STREAM_MAX_BATCH
@@ -406,38 +785,95 @@ class StreamProcessor:
             # Ignore it, it will retried later
             LOG.error("failed to process stream", gh_owner=owner, exc_info=True)
 
+        if config.QUEUE_REFRESH_BATCHING:
+            try:
+                await self._push_pending_refreshes()
+            except Exception:
+                LOG.error("failed to push queue refreshes", exc_info=True)
+
         LOG.debug("cleanup stream start", stream_name=stream_name)
+        self._redis_round_trips += 1
         await self.redis.eval(
-            self.ATOMIC_CLEAN_STREAM_SCRIPT, 1, stream_name.encode(), time.time()
+            self.ATOMIC_CLEAN_STREAM_SCRIPT,
+            2,
+            stream_name.encode(),
+            get_stream_shard_key(stream_name),
+            time.time(),
+            int(reschedule),
+            len(self._acked_message_ids),
+            *self._acked_message_ids,
+            *self._reset_attempts,
         )
         LOG.debug("cleanup stream end", stream_name=stream_name)
+        statsd.histogram("engine.streams.redis_round_trips", self._redis_round_trips)
+
+    async def _push_pending_refreshes(self) -> None:
+        refreshes = queue.pop_pending_refreshes()
+        if not refreshes:
+            return
+
+        transaction = await self.redis.pipeline()
+        for owner, repo, pull_number in refreshes:
+            await _push_to_pipeline(
+                transaction,
+                owner,
+                repo,
+                pull_number,
+                "refresh",
+                {
+                    "action": "user",
+                    "ref": None,
+                    "sender": {
+                        "login": github_types.GitHubLogin("<internal>"),
+                        "id": github_types.GitHubAccountIdType(0),
+                        "type": "User",
+                    },
+                },  # type: ignore[typeddict-item]
+            )
+        self._redis_round_trips += 1
+        await transaction.execute()
+        statsd.increment("engine.queue.refreshes", len(refreshes))
 
-    # NOTE(sileht): If the stream still have messages, we update the score to reschedule the
-    # pull later
+    # NOTE(sileht): Acknowledge the processed messages and reset the attempts,
+    # then if the stream still have messages, we update the score to reschedule
+    # the pull later
     ATOMIC_CLEAN_STREAM_SCRIPT = """
 local stream_name = KEYS[1]
+local shard_key = KEYS[2]
 local score = ARGV[1]
+local reschedule = ARGV[2]
+local acked_count = tonumber(ARGV[3])
 
-redis.call("HDEL", "attempts", stream_name)
+for i = 4, 3 + acked_count do
+    redis.call("XDEL", stream_name, ARGV[i])
+end
+for i = 4 + acked_count, #ARGV do
+    redis.call("HDEL", "attempts", ARGV[i])
+end
 
-local len = tonumber(redis.call("XLEN", stream_name))
-if len == 0 then
-    redis.call("ZREM", "streams", stream_name)
-    redis.call("DEL", stream_name)
-else
-    redis.call("ZADD", "streams", score, stream_name)
+if reschedule == "1" then
+    redis.call("HDEL", "attempts", stream_name)
+
+    local len = tonumber(redis.call("XLEN", stream_name))
+    if len == 0 then
+        redis.call("ZREM", shard_key, stream_name)
+        redis.call("DEL", stream_name)
+    else
+        redis.call("ZADD", shard_key, score, stream_name)
+    end
 end
 """
 
-    async def _extract_pulls_from_stream(self, stream_name: str) -> PullsToConsume:
+    async def _extract_pulls_from_stream(
+        self, stream_name: str
+    ) -> typing.Tuple[PullsToConsume, OpenedPullsByRepo]:
+        self._redis_round_trips += 1
         messages = await self.redis.xrange(stream_name, count=config.STREAM_MAX_BATCH)
         LOG.debug("read stream", stream_name=stream_name, messages_count=len(messages))
         statsd.histogram("engine.streams.size", len(messages))
         statsd.gauge("engine.streams.max_size", config.STREAM_MAX_BATCH)
 
-        opened_pulls_by_repo: typing.Dict[
-            typing.Tuple[str, str], typing.List[github_types.GitHubPullRequest]
-        ] = {}
+        opened_pulls_by_repo: OpenedPullsByRepo = {}
 
         # Groups stream by pull request
         pulls: PullsToConsume = PullsToConsume(collections.OrderedDict())
@@ -464,7 +900,9 @@ end
                     except IgnoredException:
                         opened_pulls_by_repo[(owner, repo)] = []
 
-                converted_messages = await self._convert_event_to_messages(
+                converted_messages, deleted = await self._convert_event_to_messages(
+                    stream_name,
+                    message_id,
                     owner,
                     repo,
                     source,
@@ -473,13 +911,13 @@ end
 
                 logger.debug("event unpacked into %s messages", len(converted_messages))
                 messages.extend(converted_messages)
-                deleted = await self.redis.xdel(stream_name, message_id)
                 if deleted != 1:
                     # FIXME(sileht): During shutdown, heroku may have already started
                     # another worker that have already take the lead of this stream_name
                     # This can create duplicate events in the streams but that should not
                     # be a big deal as the engine will not been ran by the worker that's
                     # shutdowning.
+                    self._redis_round_trips += 1
                     contents = await self.redis.xrange(
                         stream_name, start=message_id, end=message_id
                     )
@@ -491,34 +929,35 @@ end
                             deleted,
                             contents,
                         )
-        return pulls
+        return pulls, opened_pulls_by_repo
 
     async def _get_pulls_for(
         self, stream_name: str, owner: str, repo: str
     ) -> typing.List[github_types.GitHubPullRequest]:
         try:
+            redis_cache = await utils.get_aredis_for_cache()
             async with await github.aget_client(owner) as client:
-                return [
-                    p
-                    async for p in client.items(
-                        f"/repos/{client.auth.owner}/{repo}/pulls"
-                    )
-                ]
+                return await opened_pulls.get(redis_cache, client, repo)
         except Exception as e:
             raise await self._translate_exception_to_retries(e, stream_name)
 
     async def _convert_event_to_messages(
         self,
+        stream_name: str,
+        message_id: str,
         owner: str,
         repo: str,
         source: context.T_PayloadEventSource,
         pulls: typing.List[github_types.GitHubPullRequest],
-    ) -> typing.List[typing.Tuple[bool, T_Payload]]:
+    ) -> typing.Tuple[typing.List[typing.Tuple[str, T_Payload]], int]:
         # NOTE(sileht): the event is incomplete (push, refresh, checks, status)
         # So we get missing pull numbers, add them to the stream to
         # handle retry later, add them to message to run engine on them now,
         # and delete the current message_id as we have unpack this incomplete event into
         # multiple complete event
+        #
+        # All of this is done in a single transaction, so a crash can't lose or
+        # duplicate the event.
         async with await github.aget_client(owner) as client:
             pull_numbers = await github_events.extract_pull_numbers_from_event(
                 client,
@@ -528,16 +967,17 @@ end
                 pulls,
             )
 
-        messages = []
+        transaction = await self.redis.pipeline()
+        payloads = []
         for pull_number in pull_numbers:
             if pull_number is None:
                 # NOTE(sileht): even it looks not possible, this is a safeguard to ensure
                 # we didn't generate a ending loop of events, because when pull_number is
                 # None, this method got called again and again.
                 raise RuntimeError("Got an empty pull number")
-            messages.append(
-                await push(
-                    self.redis,
+            payloads.append(
+                await _push_to_pipeline(
+                    transaction,
                     owner,
                     repo,
                     pull_number,
@@ -545,64 +985,198 @@ end
                     source["data"],
                 )
             )
-        return messages
+        await transaction.xdel(stream_name, message_id)
+        self._redis_round_trips += 1
+        results = await transaction.execute()
+
+        # Each push adds two commands: XADD and the scheduling script
+        message_ids = results[:-1:2]
+        return list(zip(message_ids, payloads)), results[-1]
 
     async def _consume_pulls(
         self,
         stream_name: str,
-        pulls: collections.OrderedDict[
-            typing.Tuple[str, str, int],
-            typing.Tuple[typing.List[str], typing.List[context.T_PayloadEventSource]],
-        ],
+        pulls: PullsToConsume,
+        opened_pulls_by_repo: typing.Optional[OpenedPullsByRepo] = None,
     ) -> None:
         LOG.debug("stream contains %d pulls", len(pulls), stream_name=stream_name)
-        for (owner, repo, pull_number), (message_ids, sources) in pulls.items():
-
-            statsd.histogram("engine.streams.batch-size", len(sources))
-            for source in sources:
-                if "timestamp" in source:
-                    statsd.histogram(
-                        "engine.streams.events.latency",
-                        (
-                            datetime.datetime.utcnow()
-                            - datetime.datetime.fromisoformat(source["timestamp"])
-                        ).total_seconds(),
-                    )
+        if self.concurrency <= 1:
+            lanes = [list(pulls.items())]
+        else:
+            lanes = await self._get_lanes(pulls, opened_pulls_by_repo or {})
 
-            logger = daiquiri.getLogger(
-                __name__, gh_repo=repo, gh_owner=owner, gh_pull=pull_number
-            )
+        stopping = asyncio.Event()
+        results = await asyncio.gather(
+            *(self._consume_lane(stream_name, lane, stopping) for lane in lanes),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
 
+    async def _consume_lane(
+        self,
+        stream_name: str,
+        lane: typing.List[PullToConsume],
+        stopping: asyncio.Event,
+    ) -> None:
+        for (owner, repo, pull_number), (message_ids, sources) in lane:
+            # Another lane needs the whole stream to be retried
+            if stopping.is_set():
+                return
             try:
-                await self._run_engine_and_translate_exception_to_retries(
-                    stream_name, owner, repo, pull_number, sources
+                await self._consume_pull(
+                    stream_name, owner, repo, pull_number, message_ids, sources
                 )
-                await self.redis.execute_command("XDEL", stream_name, *message_ids)
-            except IgnoredException:
-                await self.redis.execute_command("XDEL", stream_name, *message_ids)
-                logger.debug("failed to process pull request, ignoring", exc_info=True)
-            except MaxPullRetry as e:
-                await self.redis.execute_command("XDEL", stream_name, *message_ids)
-                logger.error(
-                    "failed to process pull request, abandoning",
-                    attempts=e.attempts,
-                    exc_info=True,
+            except BaseException:
+                stopping.set()
+                raise
+
+    @staticmethod
+    def _get_pull_base(
+        pull_number: int,
+        sources: typing.List[context.T_PayloadEventSource],
+        opened_pulls: typing.List[github_types.GitHubPullRequest],
+    ) -> typing.Optional[PullBase]:
+        for pull in opened_pulls:
+            if pull["number"] == pull_number:
+                return (
+                    pull["base"]["repo"]["owner"]["id"],
+                    pull["base"]["repo"]["id"],
+                    pull["base"]["ref"],
                 )
-            except PullRetry as e:
-                logger.info(
-                    "failed to process pull request, retrying",
-                    attempts=e.attempts,
-                    exc_info=True,
+
+        for source in sources:
+            data = typing.cast(typing.Dict[str, typing.Any], source["data"])
+            repository = data.get("repository") or {}
+            owner_id = (repository.get("owner") or {}).get("id")
+            repo_id = repository.get("id")
+            if owner_id is None or repo_id is None:
+                continue
+
+            candidates = [data.get("pull_request") or {}]
+            for event_type in ("check_run", "check_suite"):
+                if event_type in data:
+                    candidates.extend(data[event_type].get("pull_requests", []))
+
+            for candidate in candidates:
+                base = candidate.get("base") or {}
+                if (
+                    candidate.get("number") == pull_number
+                    and base.get("ref")
+                    and (base.get("repo") or {}).get("id", repo_id) == repo_id
+                ):
+                    return (owner_id, repo_id, base["ref"])
+        return None
+
+    async def _get_lanes(
+        self, pulls: PullsToConsume, opened_pulls_by_repo: OpenedPullsByRepo
+    ) -> typing.List[typing.List[PullToConsume]]:
+        """Group pulls that must be processed sequentially.
+
+        Pulls in the merge queue of the same branch are processed in order.
+        When the base branch of a pull is unknown, all pulls of its repository
+        are processed in order.
+        """
+        bases = {
+            (owner, repo, pull_number): self._get_pull_base(
+                pull_number, sources, opened_pulls_by_repo.get((owner, repo), [])
+            )
+            for (owner, repo, pull_number), (_, sources) in pulls.items()
+        }
+        repos_with_unknown_base = {
+            (owner, repo) for (owner, repo, _), b in bases.items() if b is None
+        }
+
+        known_bases = list({b for b in bases.values() if b is not None})
+        queued_pulls: typing.Dict[PullBase, typing.Set[str]] = {}
+        if known_bases:
+            redis_cache = await utils.get_aredis_for_cache()
+            pipe = await redis_cache.pipeline()
+            for known_base in known_bases:
+                await pipe.zrange(queue.get_redis_queue_key(*known_base), 0, -1)
+            for known_base, queued in zip(known_bases, await pipe.execute()):
+                queued_pulls[known_base] = set(queued)
+
+        lanes: collections.OrderedDict[
+            typing.Tuple[typing.Any, ...], typing.List[PullToConsume]
+        ] = collections.OrderedDict()
+        for key, value in pulls.items():
+            owner, repo, pull_number = key
+            base = bases[key]
+            lane_key: typing.Tuple[typing.Any, ...]
+            if base is None or (owner, repo) in repos_with_unknown_base:
+                lane_key = (owner, repo)
+            elif str(pull_number) in queued_pulls[base]:
+                lane_key = (owner, repo, base[2])
+            else:
+                lane_key = key
+            lanes.setdefault(lane_key, []).append((key, value))
+        return list(lanes.values())
+
+    async def _consume_pull(
+        self,
+        stream_name: str,
+        owner: str,
+        repo: str,
+        pull_number: int,
+        message_ids: typing.List[str],
+        sources: typing.List[context.T_PayloadEventSource],
+    ) -> None:
+        statsd.histogram("engine.streams.batch-size", len(sources))
+        for source in sources:
+            if "timestamp" in source:
+                statsd.histogram(
+                    "engine.streams.events.latency",
+                    (
+                        datetime.datetime.utcnow()
+                        - datetime.datetime.fromisoformat(source["timestamp"])
+                    ).total_seconds(),
                 )
-            except StreamRetry:
-                raise
-            except StreamUnused:
-                raise
-            except vcr_errors_CannotOverwriteExistingCassetteException:
-                raise
-            except Exception:
-                # Ignore it, it will retried later
-                logger.error("failed to process pull request", exc_info=True)
+
+        logger = daiquiri.getLogger(
+            __name__, gh_repo=repo, gh_owner=owner, gh_pull=pull_number
+        )
+
+        try:
+            await self._run_engine_and_translate_exception_to_retries(
+                stream_name, owner, repo, pull_number, sources
+            )
+            self._acked_message_ids.extend(message_ids)
+        except IgnoredException:
+            self._acked_message_ids.extend(message_ids)
+            logger.debug("failed to process pull request, ignoring", exc_info=True)
+        except PullDelayed as e:
+            # NOTE: the events have been copied aside with the pull request,
+            # they are pushed back to the stream when it is due
+            self._acked_message_ids.extend(message_ids)
+            logger.info(
+                "mergeable state unknown, pull request delayed",
+                attempts=e.attempts,
+                retry_at=e.retry_at,
+            )
+        except MaxPullRetry as e:
+            self._acked_message_ids.extend(message_ids)
+            logger.error(
+                "failed to process pull request, abandoning",
+                attempts=e.attempts,
+                exc_info=True,
+            )
+        except PullRetry as e:
+            logger.info(
+                "failed to process pull request, retrying",
+                attempts=e.attempts,
+                exc_info=True,
+            )
+        except StreamRetry:
+            raise
+        except StreamUnused:
+            raise
+        except vcr_errors_CannotOverwriteExistingCassetteException:
+            raise
+        except Exception:
+            # Ignore it, it will retried later
+            logger.error("failed to process pull request", exc_info=True)
 
 
 def get_process_index_from_env() -> int:
@@ -616,6 +1190,10 @@ def get_process_index_from_env() -> int:
 @dataclasses.dataclass
 class Worker:
     idle_sleep_time: float = 0.42
+    # Maximum time an idle worker blocks waiting for a stream
+    idle_block_time: float = 60
+    # Interval between two checks of the due delayed pull requests
+    delayed_pulls_poll_interval: float = 1
     shutdown_timeout: float = 25
     worker_per_process: int = config.STREAM_WORKERS_PER_PROCESS
     process_count: int = config.STREAM_PROCESSES
@@ -667,9 +1245,9 @@ class Worker:
                             worker_id,
                             stream_name,
                         )
-                else:
-                    LOG.debug("worker %s has nothing to do, sleeping a bit", worker_id)
-                    await self._sleep_or_stop()
+                elif not self._stopping.is_set():
+                    LOG.debug("worker %s has nothing to do, waiting", worker_id)
+                    await stream_selector.wait_for_stream(self.idle_block_time)
             except asyncio.CancelledError:
                 # NOTE(sileht): We don't wait for the thread and just return, the thread
                 # will be killed when the program exits.
@@ -690,16 +1268,25 @@ class Worker:
         except (asyncio.TimeoutError, asyncio.CancelledError):
             pass
 
+    async def delayed_pulls_task(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await requeue_due_delayed_pulls(self._redis)
+            except asyncio.CancelledError:
+                LOG.debug("delayed pulls task killed")
+                return
+            except Exception:
+                LOG.error("delayed pulls task failed", exc_info=True)
+
+            await self._sleep_or_stop(self.delayed_pulls_poll_interval)
+
     async def monitoring_task(self) -> None:
         while not self._stopping.is_set():
             try:
+                await migrate_legacy_streams(self._redis)
+
                 now = time.time()
-                streams = await self._redis.zrangebyscore(
-                    "streams",
-                    min=0,
-                    max=now,
-                    withscores=True,
-                )
+                streams = await get_streams(self._redis, max_score=now)
                 # NOTE(sileht): The latency may not be exact with the next StreamSelector
                 # based on hash+modulo
                 if len(streams) > self.worker_count:
@@ -734,6 +1321,8 @@ class Worker:
         self._stopping.clear()
 
         self._redis = await utils.create_aredis_for_stream()
+        await migrate_legacy_streams(self._redis)
+        await queue.migrate_queues_index(await utils.get_aredis_for_cache())
 
         if "stream" in self.enabled_services:
             worker_ids = self.get_worker_ids()
@@ -743,6 +1332,11 @@ class Worker:
                 )
             LOG.info("workers %s started", ", ".join(map(str, worker_ids)))
 
+            if config.MERGEABLE_STATE_REQUEUE_DELAY:
+                self._worker_tasks.append(
+                    asyncio.create_task(self.delayed_pulls_task())
+                )
+
         if "stream-monitoring" in self.enabled_services:
             self._stream_monitoring_task = asyncio.create_task(self.monitoring_task())
 
@@ -752,6 +1346,16 @@ class Worker:
 
         await self._start_task
 
+        if "stream" in self.enabled_services:
+            # Wake up idle workers so they notice we are stopping
+            await wakeup_shards(
+                self._redis,
+                itertools.chain.from_iterable(
+                    get_worker_shards(worker_id, self.worker_count)
+                    for worker_id in worker_ids
+                ),
+            )
+
         tasks = []
         if "stream" in self.enabled_services:
             tasks.extend(self._worker_tasks)
@@ -826,10 +1430,7 @@ async def async_status() -> None:
         stream, score = item
         return stream_selector.get_worker_id_for(stream)
 
-    streams = sorted(
-        await redis.zrangebyscore("streams", min=0, max="+inf", withscores=True),
-        key=sorter,
-    )
+    streams = sorted(await get_streams(redis), key=sorter)
 
     for worker_id, streams_by_worker in itertools.groupby(streams, key=sorter):
         for stream, score in streams_by_worker:
@@ -849,15 +1450,20 @@ async def async_reschedule_now() -> int:
     args = parser.parse_args()
 
     redis = await utils.create_aredis_for_stream()
-    streams = await redis.zrangebyscore("streams", min=0, max="+inf")
+    streams = await get_streams(redis)
     expected_stream = f"stream~{args.org.lower()}"
-    for stream in streams:
+    for stream, _ in streams:
         if expected_stream == stream.decode().lower():
             scheduled_at = utils.utcnow()
             score = scheduled_at.timestamp()
             transaction = await redis.pipeline()
             await transaction.hdel("attempts", stream)
-            await transaction.zadd("streams", **{stream.decode(): score})
+            await transaction.zadd(
+                get_stream_shard_key(stream), **{stream.decode(): score}
+            )
+            shard = get_stream_shard(stream)
+            await transaction.rpush(get_stream_wakeup_key(shard), 1)
+            await transaction.ltrim(get_stream_wakeup_key(shard), 0, 0)
             # NOTE(sileht): Do we need to cleanup the per PR attempt?
             # await transaction.hdel("attempts", attempts_key)
             await transaction.execute()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Compare the generation of the merge queue summary when the configurations
+# are read with one GET per queued pull request, as with the legacy
+# `merge-config~` keys, and with one HMGET on the configurations hash.
+#
+# Usage: benchmark-queue-summary.py redis://localhost:6379?db=15
+#
+# WARNING: the Redis database is flushed
+
+import argparse
+import time
+from unittest import mock
+
+import redis
+import voluptuous
+
+# NOTE: the engine must be imported before the queue to load the actions
+from mergify_engine import engine  # noqa: F401
+from mergify_engine import json
+from mergify_engine import queue
+from mergify_engine import subscription
+from mergify_engine.actions import merge
+
+
+class CountingRedis(redis.StrictRedis):
+    round_trips = 0
+
+    def execute_command(self, *args, **options):
+        self.round_trips += 1
+        return super().execute_command(*args, **options)
+
+
+def populate(r, count):
+    r.flushdb()
+    pipe = r.pipeline()
+    for pull_number in range(1, count + 1):
+        priority = 3000 if pull_number % 10 == 0 else 2000
+        config = json.dumps(
+            {
+                "strict_method": "merge",
+                "priority": priority,
+                "effective_priority": priority,
+                "bot_account": None,
+                "update_bot_account": None,
+            }
+        )
+        pipe.zadd(
+            queue.get_redis_queue_key(1, 1, "main"),
+            {str(pull_number): pull_number / priority},
+        )
+        pipe.hset(queue.get_redis_queue_configs_key(1, 1, "main"), pull_number, config)
+        pipe.set(f"merge-config~1~1~{pull_number}", config)
+    pipe.execute()
+
+
+def legacy_get_configs(r, pull_numbers):
+    return {p: queue._load_config(r.get(f"merge-config~1~1~{p}")) for p in pull_numbers}
+
+
+def measure(r, func, iterations):
+    r.round_trips = 0
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = (time.perf_counter() - started_at) / iterations * 1000
+    return elapsed, r.round_trips // iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge queue summary benchmark")
+    parser.add_argument("redis_url")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--pulls", type=int, nargs="+", default=[200, 1000])
+    args = parser.parse_args()
+
+    r = CountingRedis.from_url(args.redis_url, decode_responses=True)
+    q = queue.Queue(r, 1, "owner", 1, "repo", "main")
+    ctxt = mock.Mock(
+        subscription=subscription.Subscription(
+            1, True, "benchmark", {}, frozenset({subscription.Features.PRIORITY_QUEUES})
+        )
+    )
+    action = merge.MergeAction(voluptuous.Schema(merge.MergeAction.validator)({}))
+
+    try:
+        for count in args.pulls:
+            populate(r, count)
+            with mock.patch.object(
+                q, "get_configs", lambda pulls: legacy_get_configs(r, pulls)
+            ):
+                legacy = measure(
+                    r, lambda: action.get_queue_summary(ctxt, q), args.iterations
+                )
+            hashed = measure(
+                r, lambda: action.get_queue_summary(ctxt, q), args.iterations
+            )
+            print(
+                f"{count} pulls: legacy {legacy[0]:.3f} ms/summary "
+                f"({legacy[1]} round trips), "
+                f"hash {hashed[0]:.3f} ms/summary ({hashed[1]} round trips)"
+            )
+    finally:
+        r.flushdb()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+#
+# Copyright © 2021 Mergify SAS
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Compare the stream selection of the legacy `streams` sorted set, scanned
+# entirely and filtered by hash in Python, with the sharded sorted sets.
+#
+# Usage: benchmark-stream-selector.py redis://localhost:6379?db=15
+#
+# WARNING: the Redis database is flushed
+
+import argparse
+import asyncio
+import hashlib
+import time
+
+import aredis
+
+from mergify_engine import worker
+
+
+async def legacy_next_stream(redis, worker_id, worker_count):
+    for stream in await redis.zrangebyscore("streams", min=0, max=time.time()):
+        if int(hashlib.md5(stream).hexdigest(), 16) % worker_count == worker_id:
+            return stream.decode()
+
+
+async def populate(redis, count):
+    await redis.flushdb()
+    # Half of the streams are due, the other half is scheduled in the future
+    now = time.time()
+    for start in range(0, count, 1000):
+        pipe = await redis.pipeline()
+        for i in range(start, min(start + 1000, count)):
+            stream_name = f"stream~owner-{i}"
+            score = now - i if i % 2 else now + 3600 + i
+            await pipe.zadd("streams", **{stream_name: score})
+            await pipe.zadd(
+                worker.get_stream_shard_key(stream_name), **{stream_name: score}
+            )
+        await pipe.execute()
+
+
+async def measure(func, iterations):
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        await func()
+    return (time.perf_counter() - started_at) / iterations * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Stream selection benchmark")
+    parser.add_argument("redis_url")
+    parser.add_argument("--worker-count", type=int, default=7)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--streams", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    redis = aredis.StrictRedis.from_url(args.redis_url)
+    # The last worker is the one that must skip the most streams
+    worker_id = args.worker_count - 1
+    selector = worker.StreamSelector(redis, worker_id, args.worker_count)
+
+    try:
+        for count in args.streams:
+            await populate(redis, count)
+            legacy = await measure(
+                lambda: legacy_next_stream(redis, worker_id, args.worker_count),
+                args.iterations,
+            )
+            sharded = await measure(selector.next_stream, args.iterations)
+            print(
+                f"{count} streams: legacy {legacy:.3f} ms/poll, "
+                f"sharded {sharded:.3f} ms/poll"
+            )
+    finally:
+        await redis.flushdb()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())